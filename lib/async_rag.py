@@ -0,0 +1,1283 @@
+############################################################
+############################################################
+# RAG 관련 함수들 (asyncio 기반 retrieval engine)
+############################################################
+############################################################
+
+import time
+import queue
+import asyncio
+import inspect
+import threading
+import weakref
+import numpy as np
+from copy import deepcopy
+from opensearchpy import AsyncOpenSearch
+from opensearchpy.exceptions import NotFoundError
+
+from local_utils.opensearch import opensearch_utils
+from local_utils.rag import retriever_utils
+from local_utils.fusion import IncrementalFusion
+from local_utils.reranker import cascade_utils
+from local_utils.search_results import SearchHits
+
+#################################################################
+# Document Retriever with asyncio: return List(documents)
+#################################################################
+
+# retriever_utils 의 class-level ThreadPool 을 대체.
+# 단계(stage)별 Semaphore 로 동시 실행 수를 제한하고, 중첩된 pool.apply_async().get() 이 없으므로
+# 동시 세션이 늘어나도 서로의 worker 를 기다리며 deadlock 에 빠지지 않음.
+
+###########################################
+### Latency budget
+###########################################
+
+# search_hybrid(latency_budget=0.8) 처럼 요청 전체의 시간 예산(초)을 주면,
+# 남은 시간이 부족할 때 선택 단계(query 확장, cascade, reranker, parent document)를 줄이거나 건너뜀.
+# 적용된 degradation 과 단계별 소요 시간은 LatencyBudget 객체에 기록되고, 예산을 숫자로 넘겨도
+# search_hybrid 결과 (HybridSearchResults) 의 .degradations / .budget_info 로 확인 가능.
+###########################################
+
+class LatencyBudget():
+
+    # 단계별 예상 소요 시간 (초). 단계가 성공할 때마다 EWMA 로 갱신 (프로세스 전체 공유)
+    estimates = {
+        "query_expansion": 1.5,
+        "search": 0.15,
+        "cascade": 0.05,
+        "rerank": 0.3,
+        "parent_document": 0.05,
+    }
+    alpha = 0.2
+    _lock = threading.Lock()
+
+    def __init__(self, total: float):
+
+        assert total > 0, "Check your latency budget"
+
+        self.total = total
+        self.start = time.monotonic()
+        self.stage_latencies = {}
+        self.degradations = []
+
+    def elapsed(self):
+
+        return time.monotonic() - self.start
+
+    def remaining(self):
+
+        return max(self.total - self.elapsed(), 0.0)
+
+    def estimate(self, *stages):
+
+        return sum(self.estimates[stage] for stage in stages)
+
+    def allows(self, stage, *reserve_stages):
+        '''
+        남은 시간 안에 stage 와 그 뒤에 꼭 필요한 reserve_stages 를 실행할 수 있는지
+        '''
+        return self.remaining() >= self.estimate(stage, *reserve_stages)
+
+    def degrade(self, degradation):
+
+        self.degradations.append(degradation)
+
+    def _record(self, stage, latency, success):
+
+        self.stage_latencies[stage] = self.stage_latencies.get(stage, 0.0) + latency
+        if success:
+            with self._lock:
+                self.estimates[stage] = (1 - self.alpha) * self.estimates[stage] + self.alpha * latency
+
+    async def run(self, stage, coro, timeout=None):
+        '''
+        coro 를 timeout 안에서 실행하고 소요 시간 기록 (timeout 이면 asyncio.TimeoutError)
+        '''
+        start, success = time.monotonic(), False
+        try:
+            result = await asyncio.wait_for(coro, timeout=timeout)
+            success = True
+            return result
+        finally:
+            self._record(stage, time.monotonic() - start, success)
+
+    def info(self):
+
+        return {
+            "total": self.total,
+            "elapsed": self.elapsed(),
+            "stage_latencies": dict(self.stage_latencies),
+            "degradations": list(self.degradations),
+        }
+
+class HybridSearchResults(list):
+    '''
+    search_hybrid 결과 (List[Document]) + latency budget 정보.
+    degradations: 적용된 degradation (없으면 []), budget_info: LatencyBudget.info() (latency_budget 이 없으면 None)
+    '''
+    def __init__(self, similar_docs, budget=None):
+
+        super().__init__(similar_docs)
+        self.degradations = [] if budget is None else list(budget.degradations)
+        self.budget_info = None if budget is None else budget.info()
+
+    @property
+    def degraded(self):
+
+        return len(self.degradations) > 0
+
+class async_retriever_utils():
+
+    # 단계별 최대 동시 실행 수 (프로세스 전체, event loop 단위)
+    concurrency_limits = {
+        "search": 16,    # OpenSearch 요청
+        "embedding": 4,  # llm_emb 임베딩
+        "llm": 4,        # query 확장 (RAG-Fusion, HyDE)
+        "rerank": 2,     # reranker endpoint
+    }
+    # 단계별 timeout (초), None 이면 제한 없음
+    stage_timeouts = {
+        "search": 10,
+        "embedding": 10,
+        "llm": 30,
+        "rerank": 15,
+    }
+
+    _semaphores = weakref.WeakKeyDictionary()
+    _loop = None
+    _loop_lock = threading.Lock()
+
+    #################################################################
+    # event loop / concurrency helpers
+    #################################################################
+
+    @classmethod
+    def _get_semaphore(cls, stage):
+
+        loop = asyncio.get_running_loop()
+        semaphores = cls._semaphores.get(loop)
+        if semaphores is None:
+            semaphores = {name: asyncio.Semaphore(limit) for name, limit in cls.concurrency_limits.items()}
+            cls._semaphores[loop] = semaphores
+
+        return semaphores[stage]
+
+    @staticmethod
+    def _is_coroutine_function(func):
+        '''
+        AsyncOpenSearch 의 method 는 query_params decorator 로 감싸져 있어 asyncio.iscoroutinefunction 이 False
+        -> decorator 를 벗겨서 확인
+        '''
+        return inspect.iscoroutinefunction(func) or inspect.iscoroutinefunction(inspect.unwrap(func))
+
+    @classmethod
+    def _is_async_client(cls, os_client, method="search"):
+
+        return isinstance(os_client, AsyncOpenSearch) or cls._is_coroutine_function(getattr(os_client, method))
+
+    @classmethod
+    async def _run_stage(cls, stage, func, *args, **kwargs):
+        '''
+        stage 의 Semaphore 와 timeout 안에서 func 실행.
+        func 이 coroutine function 이면 await, 아니면 thread 에서 실행
+        '''
+        async with cls._get_semaphore(stage):
+            if cls._is_coroutine_function(func):
+                coro = func(*args, **kwargs)
+            else:
+                coro = asyncio.to_thread(func, *args, **kwargs)
+            return await asyncio.wait_for(coro, timeout=cls.stage_timeouts.get(stage, None))
+
+    @classmethod
+    async def _gather(cls, *coros):
+        '''
+        asyncio.gather 와 동일하나, 하나라도 실패하면 나머지 task 를 취소
+        '''
+        tasks = [asyncio.ensure_future(coro) for coro in coros]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    @classmethod
+    def _get_loop(cls):
+        '''
+        sync 호출자(streamlit session 등)가 공유하는 background event loop
+        '''
+        with cls._loop_lock:
+            if cls._loop is None or cls._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever,
+                    name="async-retriever-loop",
+                    daemon=True
+                )
+                thread.start()
+                cls._loop = loop
+
+        return cls._loop
+
+    @classmethod
+    def run_sync(cls, coro, timeout=None):
+        '''
+        coroutine 을 공용 event loop 에서 실행하고 결과를 기다림.
+        timeout 이 지나면 실행 중인 task 를 취소하고 TimeoutError 를 발생
+        '''
+        future = asyncio.run_coroutine_threadsafe(coro, cls._get_loop())
+        try:
+            return future.result(timeout=timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    #################################################################
+    # OpenSearch / embedding / llm 호출
+    #################################################################
+
+    @classmethod
+    async def _search_document(cls, os_client, query, index_name, search_pipeline=None):
+
+        # AsyncOpenSearch 이면 바로 await, sync OpenSearch 이면 thread 에서 실행
+        if cls._is_async_client(os_client):
+            params = {} if search_pipeline is None else {"search_pipeline": search_pipeline}
+            return await cls._run_stage("search", os_client.search, body=query, index=index_name, **params)
+
+        return await cls._run_stage(
+            "search",
+            opensearch_utils.search_document,
+            os_client=os_client,
+            query=query,
+            index_name=index_name,
+            search_pipeline=search_pipeline
+        )
+
+    @classmethod
+    async def _create_search_pipeline(cls, os_client, name, body):
+
+        if opensearch_utils.is_search_pipeline_ready(os_client, name):
+            return name
+
+        if not cls._is_async_client(os_client):
+            return await cls._run_stage("search", opensearch_utils.create_search_pipeline, os_client, name, body)
+
+        try:
+            await cls._run_stage("search", os_client.transport.perform_request, "GET", f"/_search/pipeline/{name}")
+        except NotFoundError:
+            await cls._run_stage("search", os_client.transport.perform_request, "PUT", f"/_search/pipeline/{name}", body=body)
+            print(f"Search pipeline {name} created")
+        opensearch_utils.set_search_pipeline_ready(os_client, name)
+
+        return name
+
+    @classmethod
+    async def _get_documents_by_ids(cls, os_client, ids, index_name, source_includes=None):
+
+        if cls._is_async_client(os_client, "mget"):
+            params = {} if source_includes is None else {"_source_includes": source_includes}
+            return await cls._run_stage("search", os_client.mget, body={"ids": ids}, index=index_name, **params)
+
+        return await cls._run_stage(
+            "search",
+            opensearch_utils.get_documents_by_ids,
+            os_client=os_client,
+            ids=ids,
+            index_name=index_name,
+            source_includes=source_includes
+        )
+
+    @classmethod
+    async def _search_documents_multi(cls, os_client, queries, index_name):
+
+        if cls._is_async_client(os_client, "msearch"):
+            response = await cls._run_stage(
+                "search",
+                os_client.msearch,
+                body=opensearch_utils.get_msearch_body(queries, index_name),
+                index=index_name
+            )
+            return opensearch_utils.get_msearch_responses(response)
+
+        return await cls._run_stage(
+            "search",
+            opensearch_utils.search_documents_multi,
+            os_client=os_client,
+            queries=queries,
+            index_name=index_name
+        )
+
+    @classmethod
+    async def _embed_query(cls, llm_emb, query):
+
+        return await cls._run_stage("embedding", llm_emb.aembed_query, query)
+
+    @classmethod
+    async def _embed_queries(cls, llm_emb, queries):
+
+        return await cls._run_stage("embedding", retriever_utils.embed_queries, llm_emb, queries)
+
+    @classmethod
+    def _keep_query_vectors(cls, queries, vectors, **kwargs):
+        '''
+        검색 단계에서 계산한 쿼리 벡터를 query_vectors (dict, query -> vector) 에 보관.
+        cascade 단계가 원본 query 를 다시 임베딩하지 않고 재사용
+        '''
+        query_vectors = kwargs.get("query_vectors", None)
+        if query_vectors is not None:
+            query_vectors.update(zip(queries, vectors))
+
+    @classmethod
+    async def _invoke_chain(cls, chain, inputs):
+
+        return await cls._run_stage("llm", chain.ainvoke, inputs)
+
+    @classmethod
+    async def _stream_chain(cls, chain, inputs):
+        '''
+        chain.astream 의 출력 chunk 를 llm Semaphore / timeout 안에서 yield
+        '''
+        timeout = cls.stage_timeouts.get("llm", None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        async with cls._get_semaphore("llm"):
+            stream = chain.astream(inputs).__aiter__()
+            while True:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout=remaining)
+                except StopAsyncIteration:
+                    break
+                yield chunk
+
+    @classmethod
+    async def _stream_lines(cls, chain, inputs):
+        '''
+        streaming 출력을 줄 단위로 yield (마지막 줄 포함)
+        '''
+        buffer = ""
+        async for chunk in cls._stream_chain(chain, inputs):
+            buffer += chunk
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                yield line
+        yield buffer
+
+    @classmethod
+    async def _search_vector_store(cls, **kwargs):
+        '''
+        OpenSearch k-NN 대신 in-process vector store (LocalVectorStore) 에서 검색
+        '''
+        return await cls._run_stage(
+            "search",
+            kwargs["vector_store"].similarity_search_by_vector,
+            kwargs["vector"],
+            k=kwargs["k"],
+            boolean_filter=kwargs.get("boolean_filter", []),
+            hybrid=kwargs.get("hybrid", False)
+        )
+
+    #################################################################
+    # Document Retriever
+    #################################################################
+
+    @classmethod
+    async def _search_lexical_store(cls, **kwargs):
+        '''
+        OpenSearch match query 대신 in-process lexical store (LocalLexicalStore) 에서 BM25 검색
+        '''
+        return await cls._run_stage("search", kwargs["lexical_store"].get_lexical_similar_docs, **kwargs)
+
+    @classmethod
+    # semantic search based
+    async def get_semantic_similar_docs(cls, **kwargs):
+
+        assert "query" in kwargs, "Check your query"
+        assert "k" in kwargs, "Check your k"
+
+        vector_store = kwargs.get("vector_store", None)
+        if vector_store is None:
+            assert "os_client" in kwargs, "Check your os_client"
+            assert "index_name" in kwargs, "Check your index_name"
+
+        vector = kwargs.get("vector", None)
+        if vector is None:
+            vector = await cls._embed_query(kwargs["llm_emb"], kwargs["query"])
+            cls._keep_query_vectors([kwargs["query"]], [vector], **kwargs)
+
+        if vector_store is not None:
+            return await cls._search_vector_store(**{**kwargs, "vector": vector})
+
+        query = retriever_utils._get_semantic_query(**{**kwargs, "vector": vector})
+        search_results = await cls._search_document(kwargs["os_client"], query, kwargs["index_name"])
+
+        return retriever_utils._get_search_results_docs(search_results, hybrid=kwargs.get("hybrid", False))
+
+    @classmethod
+    # lexical(keyword) search based (using Amazon OpenSearch)
+    async def get_lexical_similar_docs(cls, **kwargs):
+
+        assert "query" in kwargs, "Check your query"
+        assert "k" in kwargs, "Check your k"
+
+        if kwargs.get("lexical_store", None) is not None:
+            return await cls._search_lexical_store(**kwargs)
+
+        assert "os_client" in kwargs, "Check your os_client"
+        assert "index_name" in kwargs, "Check your index_name"
+
+        query = retriever_utils._get_lexical_query(**kwargs)
+        search_results = await cls._search_document(kwargs["os_client"], query, kwargs["index_name"])
+
+        return retriever_utils._get_search_results_docs(search_results, hybrid=kwargs.get("hybrid", False))
+
+    @classmethod
+    async def _get_semantic_queries(cls, queries, **kwargs):
+        '''
+        여러 쿼리에 대한 semantic search 쿼리 생성 (한 번의 embed_documents batch 로 임베딩)
+        '''
+        vectors = await cls._embed_queries(kwargs["llm_emb"], queries)
+        cls._keep_query_vectors(queries, vectors, **kwargs)
+
+        return [
+            retriever_utils._get_semantic_query(
+                query=query,
+                vector=vector,
+                k=kwargs["k"],
+                boolean_filter=kwargs.get("boolean_filter", []),
+                two_phase=kwargs.get("two_phase", False),
+                ef_search=kwargs.get("ef_search", None),
+                binary_search=kwargs.get("binary_search", False),
+                binary_oversample=kwargs.get("binary_oversample", 10),
+                binary_vector_field=kwargs.get("binary_vector_field", "binary_vector_field"),
+                space_type=kwargs.get("space_type", "cosinesimil"),
+            ) for query, vector in zip(queries, vectors)
+        ]
+
+    @classmethod
+    async def _get_semantic_doc_lists(cls, queries, async_mode=True, **kwargs):
+        '''
+        여러 쿼리에 대한 semantic search 결과 리스트 (fan-out).
+        msearch=True 이면 _msearch 한 번으로 요청하고 응답을 쿼리별로 분리.
+        vector_store 가 주어지면 batch 임베딩 후 local store 에서 검색
+        '''
+        if kwargs.get("vector_store", None) is not None:
+            vectors = await cls._embed_queries(kwargs["llm_emb"], queries)
+            cls._keep_query_vectors(queries, vectors, **kwargs)
+            searches = [
+                cls._search_vector_store(**{**kwargs, "vector": vector, "hybrid": True})
+                for vector in vectors
+            ]
+            if async_mode:
+                return await cls._gather(*searches)
+            return [await search for search in searches]
+
+        semantic_queries = await cls._get_semantic_queries(queries, **kwargs)
+
+        if kwargs.get("msearch", True):
+            responses = await cls._search_documents_multi(kwargs["os_client"], semantic_queries, kwargs["index_name"])
+            return [retriever_utils._get_search_results_docs(response, hybrid=True) for response in responses]
+
+        searches = [
+            cls._search_document(kwargs["os_client"], semantic_query, kwargs["index_name"])
+            for semantic_query in semantic_queries
+        ]
+        if async_mode:
+            responses = await cls._gather(*searches)
+        else:
+            responses = [await search for search in searches]
+
+        return [retriever_utils._get_search_results_docs(response, hybrid=True) for response in responses]
+
+    @classmethod
+    def _get_fused_doc_lists(cls, doc_lists, **kwargs):
+        '''
+        RAG-Fusion / HyDE 쿼리별 결과를 동일 가중치로 fusion
+        '''
+        doc_list_size = len(doc_lists)
+
+        return retriever_utils.get_ensemble_results(
+            doc_lists=doc_lists,
+            weights=[1/(doc_list_size)]*(doc_list_size), #query_augmentation_size + original query
+            algorithm=kwargs.get("fusion_algorithm", "RRF"), # fusion_utils.algorithms
+            c=60,
+            k=kwargs["k"],
+        )
+
+    @classmethod
+    async def _get_rag_fusion_queries(cls, **kwargs):
+
+        search_types = ["approximate_search", "script_scoring", "painless_scripting"]
+        space_types = ["l2", "l1", "linf", "cosinesimil", "innerproduct", "hammingbit"]
+
+        assert "llm_emb" in kwargs, "Check your llm_emb"
+        assert "query" in kwargs, "Check your query"
+        assert "query_transformation_prompt" in kwargs, "Check your query_transformation_prompt"
+        assert kwargs.get("search_type", "approximate_search") in search_types, f'Check your search_type: {search_types}'
+        assert kwargs.get("space_type", "l2") in space_types, f'Check your space_type: {space_types}'
+        assert kwargs.get("llm_text", None) != None, "Check your llm_text"
+
+        query_augmentation_size = kwargs["query_augmentation_size"]
+
+        generate_queries = retriever_utils._get_rag_fusion_chain(
+            kwargs["llm_text"],
+            kwargs["query_transformation_prompt"]
+        )
+        rag_fusion_query = await cls._invoke_chain(
+            generate_queries,
+            {
+                "query": kwargs["query"],
+                "query_augmentation_size": query_augmentation_size
+            }
+        )
+        rag_fusion_query = retriever_utils._get_rag_fusion_queries(kwargs["query"], rag_fusion_query, query_augmentation_size)
+
+        if kwargs.get("verbose", False):
+            print("\n")
+            print("===== RAG-Fusion Queries =====")
+            print(rag_fusion_query)
+
+        return rag_fusion_query
+
+    @classmethod
+    async def _get_hyde_answer(cls, template_type, **kwargs):
+        '''
+        template_type 의 HyDE 가상 문서. hyde_cache (HyDECache) 에 있으면 LLM 을 호출하지 않음
+        '''
+        hyde_cache = kwargs.get("hyde_cache", None)
+        if hyde_cache is not None:
+            answer = hyde_cache.get_answer(template_type, kwargs["query"], kwargs["llm_text"])
+            if answer is not None:
+                return answer
+
+        chain = retriever_utils._get_hyde_chain(template_type, kwargs["llm_text"])
+        answer = await cls._invoke_chain(chain, {"query": kwargs["query"]})
+        if hyde_cache is not None:
+            hyde_cache.set_answer(template_type, kwargs["query"], kwargs["llm_text"], answer)
+
+        return answer
+
+    @classmethod
+    async def _get_hyde_vector(cls, answer, **kwargs):
+
+        hyde_cache = kwargs.get("hyde_cache", None)
+        if hyde_cache is not None:
+            vector = hyde_cache.get_vector(answer, kwargs["llm_emb"])
+            if vector is not None:
+                return vector
+
+        vector = await cls._embed_query(kwargs["llm_emb"], answer)
+        if hyde_cache is not None:
+            hyde_cache.set_vector(answer, kwargs["llm_emb"], vector)
+
+        return vector
+
+    @classmethod
+    async def _get_streamed_hyde_docs(cls, **kwargs):
+        '''
+        HyDE streaming 모드 -> (similar_docs_semantic, similar_docs_keyword).
+        원본 query 의 semantic / lexical 검색을 바로 시작하고, 각 template 의 가상 문서가 준비되는 대로
+        (hyde_cache hit 이면 즉시) 임베딩 / 검색하여 IncrementalFusion 에 누적
+        '''
+        assert "hyde_query" in kwargs, "Check your hyde_query"
+        assert kwargs.get("llm_text", None) != None, "Check your llm_text"
+
+        semantic_kwargs = {**kwargs, "hybrid": True}
+        fusion = IncrementalFusion(algorithm=kwargs.get("fusion_algorithm", "RRF"), c=60)
+        hyde_answers = [kwargs["query"]] + [None] * len(kwargs["hyde_query"])
+
+        async def search(list_id, template_type):
+            if template_type is None:
+                doc_list = await cls.get_semantic_similar_docs(**semantic_kwargs)
+            else:
+                hyde_answers[list_id] = answer = await cls._get_hyde_answer(template_type, **kwargs)
+                vector = await cls._get_hyde_vector(answer, **kwargs)
+                doc_list = await cls.get_semantic_similar_docs(**{**semantic_kwargs, "query": answer, "vector": vector})
+            fusion.add(doc_list, list_id=list_id)
+
+        similar_docs_keyword, *_ = await cls._gather(
+            cls.get_lexical_similar_docs(**semantic_kwargs),
+            search(0, None),
+            *[search(list_id, template_type) for list_id, template_type in enumerate(kwargs["hyde_query"], start=1)]
+        )
+
+        if kwargs.get("verbose", False):
+            print("\n")
+            print("===== HyDE Answers (streamed) =====")
+            print(hyde_answers)
+
+        similar_docs_semantic = fusion.get_ensemble_results(k=kwargs["k"], weight=1/len(fusion))
+
+        return similar_docs_semantic, similar_docs_keyword
+
+    @classmethod
+    async def _get_hyde_queries(cls, **kwargs):
+
+        search_types = ["approximate_search", "script_scoring", "painless_scripting"]
+        space_types = ["l2", "l1", "linf", "cosinesimil", "innerproduct", "hammingbit"]
+
+        assert "llm_emb" in kwargs, "Check your llm_emb"
+        assert "query" in kwargs, "Check your query"
+        assert "hyde_query" in kwargs, "Check your hyde_query"
+        assert kwargs.get("search_type", "approximate_search") in search_types, f'Check your search_type: {search_types}'
+        assert kwargs.get("space_type", "l2") in space_types, f'Check your space_type: {space_types}'
+        assert kwargs.get("llm_text", None) != None, "Check your llm_text"
+
+        query = kwargs["query"]
+        template_types = kwargs["hyde_query"]
+
+        timeout = kwargs.get("hyde_timeout", None)
+        if timeout is not None:
+            # timeout 안에 끝난 답변만 사용 (하나도 없으면 asyncio.TimeoutError)
+            tasks = [asyncio.ensure_future(cls._get_hyde_answer(template_type, **kwargs)) for template_type in template_types]
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            hyde_answers = [task.result() for task in tasks if task in done and task.exception() is None]
+            if not hyde_answers:
+                if pending:
+                    raise asyncio.TimeoutError()
+                raise tasks[0].exception()
+        elif kwargs.get("async_mode", True):
+            hyde_answers = await cls._gather(*[cls._get_hyde_answer(template_type, **kwargs) for template_type in template_types])
+        else:
+            hyde_answers = [await cls._get_hyde_answer(template_type, **kwargs) for template_type in template_types]
+        hyde_answers.insert(0, query)
+
+        if kwargs.get("verbose", False):
+            print("\n")
+            print("===== HyDE Answers =====")
+            print(hyde_answers)
+
+        return hyde_answers
+
+    @classmethod
+    # rag-fusion based
+    async def get_rag_fusion_similar_docs(cls, **kwargs):
+
+        rag_fusion_query = kwargs.get("expanded_queries", None) or await cls._get_rag_fusion_queries(**kwargs)
+        rag_fusion_docs = await cls._get_semantic_doc_lists(rag_fusion_query, **kwargs)
+
+        return cls._get_fused_doc_lists(rag_fusion_docs, **kwargs)
+
+    @classmethod
+    async def _get_streamed_rag_fusion_docs(cls, **kwargs):
+        '''
+        RAG-Fusion streaming 모드 -> (similar_docs_semantic, similar_docs_keyword).
+        원본 query 의 semantic / lexical 검색을 바로 시작하고, LLM 이 쿼리를 한 줄 생성할 때마다 그 쿼리의 semantic 검색을 시작.
+        결과는 도착하는 대로 IncrementalFusion 에 누적하고, 생성이 끝나면 _get_rag_fusion_queries 와 같은 규칙
+        (빈 줄 제외, 마지막 query_augmentation_size 개) 에서 빠진 쿼리의 결과만 제거
+        '''
+        assert "query_transformation_prompt" in kwargs, "Check your query_transformation_prompt"
+        assert kwargs.get("llm_text", None) != None, "Check your llm_text"
+
+        query = kwargs["query"]
+        query_augmentation_size = kwargs["query_augmentation_size"]
+        semantic_kwargs = {**kwargs, "hybrid": True}
+        fusion = IncrementalFusion(algorithm=kwargs.get("fusion_algorithm", "RRF"), c=60)
+
+        async def search(list_id, search_query):
+            doc_list = await cls.get_semantic_similar_docs(**{**semantic_kwargs, "query": search_query})
+            fusion.add(doc_list, list_id=list_id)
+
+        lexical_task = asyncio.ensure_future(cls.get_lexical_similar_docs(**semantic_kwargs))
+        tasks = [asyncio.ensure_future(search(0, query))]
+        generated_queries = []
+        try:
+            generate_queries = retriever_utils._get_rag_fusion_chain(
+                kwargs["llm_text"],
+                kwargs["query_transformation_prompt"],
+                split=False
+            )
+            async for line in cls._stream_lines(generate_queries, {"query": query, "query_augmentation_size": query_augmentation_size}):
+                if line == "":
+                    continue
+                generated_queries.append(line)
+                tasks.append(asyncio.ensure_future(search(len(generated_queries), line)))
+            similar_docs_keyword, *_ = await cls._gather(lexical_task, *tasks)
+        except BaseException:
+            for task in [lexical_task] + tasks:
+                task.cancel()
+            raise
+
+        n_dropped = max(len(generated_queries) - query_augmentation_size, 0)
+        for list_id in range(1, n_dropped+1):
+            fusion.remove(list_id)
+
+        if kwargs.get("verbose", False):
+            print("\n")
+            print("===== RAG-Fusion Queries (streamed) =====")
+            print([query] + generated_queries[n_dropped:])
+
+        similar_docs_semantic = fusion.get_ensemble_results(k=kwargs["k"], weight=1/len(fusion))
+
+        return similar_docs_semantic, similar_docs_keyword
+
+    @classmethod
+    # HyDE based
+    async def get_hyde_similar_docs(cls, **kwargs):
+
+        hyde_answers = kwargs.get("expanded_queries", None) or await cls._get_hyde_queries(**kwargs)
+        hyde_docs = await cls._get_semantic_doc_lists(hyde_answers, **kwargs)
+
+        return cls._get_fused_doc_lists(hyde_docs, **kwargs)
+
+    @classmethod
+    # ParentDocument based
+    async def get_parent_document_similar_docs(cls, **kwargs):
+
+        child_search_results = kwargs["similar_docs"]
+        parent_cache = kwargs.get("parent_cache", None)
+
+        parent_info, parent_ids = retriever_utils._get_parent_info(child_search_results)
+        parent_sources, missing_ids = retriever_utils._get_cached_parent_sources(parent_cache, kwargs["index_name"], parent_ids)
+
+        if missing_ids:
+            parent_docs = await cls._get_documents_by_ids(kwargs["os_client"], missing_ids, kwargs["index_name"])
+            fetched_sources = retriever_utils._get_parent_sources(parent_docs)
+            if parent_cache is not None:
+                parent_cache.set_many(kwargs["index_name"], fetched_sources)
+            parent_sources.update(fetched_sources)
+
+        similar_docs = retriever_utils._get_parent_docs(parent_sources, parent_ids, parent_info, kwargs["hybrid"])
+
+        if kwargs.get("verbose", False):
+            print("===== ParentDocument =====")
+            print (f'filter: {kwargs["boolean_filter"]}')
+            print (f'# child_docs: {len(child_search_results)}')
+            print (f'# parent docs: {len(similar_docs)}')
+            print (f'# duplicates: {len(child_search_results)-len(similar_docs)}')
+            print (f'# parent cache hits: {len(parent_ids)-len(missing_ids)}')
+
+        return similar_docs
+
+    @classmethod
+    async def get_hydrated_docs(cls, similar_docs, **kwargs):
+        '''
+        two_phase 검색 결과 중 text / metadata 가 없는 문서만 채움.
+        vector_store / lexical_store 에 있으면 local 에서, 나머지는 mget 한 번 (_source: text, metadata)
+        '''
+        ids = retriever_utils._get_unhydrated_ids(similar_docs)
+        if not ids:
+            return similar_docs
+
+        sources = {}
+        for store in [kwargs.get("vector_store", None), kwargs.get("lexical_store", None)]:
+            if store is not None:
+                sources.update(store.get_documents_by_ids([doc_id for doc_id in ids if doc_id not in sources]))
+
+        missing_ids = [doc_id for doc_id in ids if doc_id not in sources]
+        if missing_ids:
+            response = await cls._get_documents_by_ids(kwargs["os_client"], missing_ids, kwargs["index_name"], source_includes=["text", "metadata"])
+            sources.update({res["_id"]: res["_source"] for res in response["docs"] if res.get("found", True)})
+
+        return retriever_utils._get_hydrated_docs(similar_docs, sources)
+
+    @classmethod
+    async def _get_chunk_vectors(cls, ids, **kwargs):
+        '''
+        {_id: vector}. vector_store 가 있으면 store 에서, 아니면 chunk_vector_cache -> mget(_source: vector_field) 순으로 조회
+        '''
+        if kwargs.get("vector_store", None) is not None:
+            return kwargs["vector_store"].get_vectors(ids)
+
+        vector_field = kwargs.get("vector_field", "vector_field")
+        chunk_vector_cache = kwargs.get("chunk_vector_cache", None)
+        vectors = {} if chunk_vector_cache is None else chunk_vector_cache.get_many(kwargs["index_name"], ids)
+        missing_ids = [doc_id for doc_id in ids if doc_id not in vectors]
+
+        if missing_ids:
+            response = await cls._get_documents_by_ids(kwargs["os_client"], missing_ids, kwargs["index_name"], source_includes=[vector_field])
+            fetched_vectors = {
+                res["_id"]: np.asarray(res["_source"][vector_field], dtype=np.float32)
+                for res in response["docs"] if res.get("found", True) and vector_field in res.get("_source", {})
+            }
+            if chunk_vector_cache is not None:
+                chunk_vector_cache.set_many(kwargs["index_name"], fetched_vectors)
+            vectors.update(fetched_vectors)
+
+        return vectors
+
+    @classmethod
+    async def get_cascade_docs(cls, **kwargs):
+        '''
+        cascade reranking 1단계: cosine(query, chunk 벡터) 로 후보를 다시 점수화하고 상위 M 개 반환
+        '''
+        assert "context" in kwargs, "Check your context"
+        assert "k" in kwargs, "Check your k"
+
+        ids = [doc.metadata["id"] for doc, _ in kwargs["context"] if doc.metadata.get("id", None) is not None]
+        # 검색 단계에서 계산한 query 벡터가 있으면 재사용하고, 없을 때만 임베딩
+        query_vector = kwargs.get("query_vector", None)
+        if query_vector is None:
+            query_vector, vectors = await cls._gather(
+                cls._embed_query(kwargs["llm_emb"], kwargs["query"]),
+                cls._get_chunk_vectors(ids, **kwargs)
+            )
+        else:
+            vectors = await cls._get_chunk_vectors(ids, **kwargs)
+        cascade_docs, info = cascade_utils.get_cascade_candidates(
+            query_vector,
+            kwargs["context"],
+            vectors,
+            k=kwargs["k"],
+            max_m=kwargs.get("max_m", None),
+            gap_ratio=kwargs.get("gap_ratio", 0.15)
+        )
+
+        if kwargs.get("verbose", False):
+            print("===== Cascade =====")
+            print (f'# candidates: {info["candidates"]}, # without vector: {info["without_vector"]}, # to reranker (M): {info["m"]}')
+
+        return cascade_docs
+
+    @classmethod
+    async def get_rerank_docs(cls, **kwargs):
+
+        reranker_service = kwargs.get("reranker_service", None) # MicroBatchReranker
+        assert reranker_service is not None or "reranker_endpoint_name" in kwargs, "Check your reranker_endpoint_name"
+        assert "k" in kwargs, "Check your k"
+
+        # tokenizer / text splitter 작업이 공용 event loop 를 막지 않도록 thread 에서 실행
+        rerank_queries, exceed_info = await asyncio.to_thread(retriever_utils._get_rerank_inputs, **kwargs)
+        if reranker_service is not None:
+            # 동시 요청을 하나의 batch 로 모아야 하므로 rerank Semaphore 를 거치지 않음 (동시성은 service 가 제한)
+            # queue 가 가득 차면 block=True 는 자리가 날 때까지 기다리고, False 는 queue.Full (latency budget 이 있을 때)
+            outs = await asyncio.wait_for(
+                reranker_service.arerank(rerank_queries["inputs"], block=kwargs.get("block", True)),
+                timeout=cls.stage_timeouts.get("rerank", None)
+            )
+        else:
+            outs = await cls._run_stage(
+                "rerank",
+                retriever_utils._invoke_reranker,
+                kwargs["reranker_endpoint_name"],
+                rerank_queries
+            )
+
+        return retriever_utils._get_rerank_contexts(kwargs["context"], outs, exceed_info, kwargs["k"])
+
+    @classmethod
+    async def _get_hybrid_docs(cls, rag_fusion=False, hyde=False, **kwargs):
+        '''
+        semantic / lexical 검색을 각각 요청하여 (similar_docs_semantic, similar_docs_keyword) 반환
+        '''
+        if rag_fusion:
+            semantic_search = cls.get_rag_fusion_similar_docs(**kwargs)
+        elif hyde:
+            semantic_search = cls.get_hyde_similar_docs(**kwargs)
+        else:
+            semantic_search = cls.get_semantic_similar_docs(**kwargs)
+        lexical_search = cls.get_lexical_similar_docs(**kwargs)
+
+        if kwargs.get("async_mode", True):
+            return await cls._gather(semantic_search, lexical_search)
+
+        return await semantic_search, await lexical_search
+
+    @classmethod
+    async def _get_expanded_queries(cls, rag_fusion=False, hyde=False, **kwargs):
+        '''
+        semantic search 에 쓸 쿼리 리스트 (원래 query 또는 RAG-Fusion / HyDE 쿼리)
+        '''
+        if kwargs.get("expanded_queries", None):
+            return kwargs["expanded_queries"]
+        if rag_fusion:
+            return await cls._get_rag_fusion_queries(**kwargs)
+        if hyde:
+            return await cls._get_hyde_queries(**kwargs)
+
+        return [kwargs["query"]]
+
+    @classmethod
+    # server-side hybrid (search pipeline)
+    async def get_server_side_hybrid_docs(cls, rag_fusion=False, hyde=False, **kwargs):
+        '''
+        semantic 쿼리 (RAG-Fusion / HyDE 쿼리 포함) 와 lexical 쿼리를 hybrid query 하나로 검색.
+        score 정규화 (hybrid_normalization) 와 가중합 (ensemble_weights) 은 search pipeline 에서 수행하므로
+        fusion 이 끝난 [(Document, score)] 반환
+        '''
+        queries = await cls._get_expanded_queries(rag_fusion=rag_fusion, hyde=hyde, **kwargs)
+        semantic_queries = await cls._get_semantic_queries(queries, **kwargs)
+        lexical_query = retriever_utils._get_lexical_query(**kwargs)
+
+        # semantic 가중치는 semantic 쿼리들에 똑같이 나눔
+        semantic_weight, lexical_weight = kwargs.get("ensemble_weights", [.51, .49])
+        pipeline_name, pipeline_body = opensearch_utils.get_hybrid_pipeline(
+            weights=[semantic_weight/len(semantic_queries)]*len(semantic_queries) + [lexical_weight],
+            normalization=kwargs.get("hybrid_normalization", "min_max"),
+            combination=kwargs.get("hybrid_combination", "arithmetic_mean"),
+        )
+        await cls._create_search_pipeline(kwargs["os_client"], pipeline_name, pipeline_body)
+
+        search_results = await cls._search_document(
+            kwargs["os_client"],
+            opensearch_utils.get_hybrid_query(semantic_queries + [lexical_query], k=kwargs["k"]),
+            kwargs["index_name"],
+            search_pipeline=pipeline_name
+        )
+
+        if kwargs.get("verbose", False):
+            print("===== Server-side hybrid =====")
+            print(f'pipeline: {pipeline_name}, {pipeline_body["description"]}')
+
+        # pipeline 의 결합 score 는 이미 정규화되어 있으므로 그대로 사용
+        return SearchHits.from_response(search_results, normalize=False).to_documents(with_score=True)
+
+    @classmethod
+    async def _get_hybrid_docs_by_msearch(cls, rag_fusion=False, hyde=False, **kwargs):
+        '''
+        semantic 쿼리(RAG-Fusion / HyDE 쿼리 포함)와 lexical 쿼리를 _msearch 한 번으로 검색.
+        semantic 결과가 여러 개이면 먼저 fusion 하여 (similar_docs_semantic, similar_docs_keyword) 반환
+        '''
+        queries = await cls._get_expanded_queries(rag_fusion=rag_fusion, hyde=hyde, **kwargs)
+
+        if kwargs.get("vector_store", None) is not None or kwargs.get("lexical_store", None) is not None:
+            # local store 를 쓰는 쪽은 local 에서, 나머지만 OpenSearch 로 검색
+            semantic_doc_lists, similar_docs_keyword = await cls._gather(
+                cls._get_semantic_doc_lists(queries, **kwargs),
+                cls.get_lexical_similar_docs(**kwargs)
+            )
+        else:
+            semantic_queries = await cls._get_semantic_queries(queries, **kwargs)
+            lexical_query = retriever_utils._get_lexical_query(**kwargs)
+
+            responses = await cls._search_documents_multi(
+                kwargs["os_client"],
+                semantic_queries + [lexical_query],
+                kwargs["index_name"]
+            )
+            doc_lists = [retriever_utils._get_search_results_docs(response, hybrid=True) for response in responses]
+            semantic_doc_lists, similar_docs_keyword = doc_lists[:-1], doc_lists[-1]
+
+        if len(semantic_doc_lists) == 1:
+            similar_docs_semantic = semantic_doc_lists[0]
+        else:
+            similar_docs_semantic = cls._get_fused_doc_lists(semantic_doc_lists, **kwargs)
+
+        return similar_docs_semantic, similar_docs_keyword
+
+    @classmethod
+    async def _get_budgeted_queries(cls, budget, rag_fusion=False, hyde=False, **kwargs):
+        '''
+        latency budget 안에서 RAG-Fusion / HyDE 쿼리 생성.
+        시간이 부족하면 RAG-Fusion 쿼리 수를 줄이거나, 끝난 HyDE 답변만 쓰거나, 원래 query 만 사용 (None 반환)
+        '''
+        name = "rag_fusion" if rag_fusion else "hyde"
+        stage_timeout = budget.remaining() - budget.estimate("search")
+        if stage_timeout <= 0:
+            budget.degrade(f"{name}->plain_query")
+            return None
+
+        if rag_fusion:
+            augmentation_size = kwargs["query_augmentation_size"]
+            if stage_timeout < budget.estimate("query_expansion") and augmentation_size > 1:
+                # 생성 시간은 생성할 쿼리 수에 비례한다고 보고 줄임
+                reduced_size = max(1, int(augmentation_size * stage_timeout / budget.estimate("query_expansion")))
+                budget.degrade(f"rag_fusion_queries:{augmentation_size}->{reduced_size}")
+                kwargs["query_augmentation_size"] = reduced_size
+            coro, timeout = cls._get_rag_fusion_queries(**kwargs), stage_timeout
+        else:
+            # HyDE 는 _get_hyde_queries 안에서 timeout 까지 끝난 답변만 사용
+            coro, timeout = cls._get_hyde_queries(**{**kwargs, "hyde_timeout": stage_timeout}), None
+
+        try:
+            queries = await budget.run("query_expansion", coro, timeout=timeout)
+        except asyncio.TimeoutError:
+            budget.degrade(f"{name}_timeout->plain_query")
+            return None
+
+        if hyde and len(queries)-1 < len(kwargs["hyde_query"]):
+            budget.degrade(f'hyde_query:{len(kwargs["hyde_query"])}->{len(queries)-1}')
+
+        return queries
+
+    @classmethod
+    def _use_server_side_hybrid(cls, **kwargs):
+        '''
+        server_side_hybrid 를 쓸 수 있는지: local store 를 쓰지 않고, 서브 쿼리 수가 hybrid query 한도 이내
+        (한도를 넘으면 기존 client-side fusion 사용)
+        '''
+        if not kwargs.get("server_side_hybrid", False):
+            return False
+        if kwargs.get("vector_store", None) is not None or kwargs.get("lexical_store", None) is not None:
+            return False
+        if kwargs.get("binary_search", False): # rescore 는 hybrid query 의 서브 쿼리별로 적용할 수 없음
+            return False
+
+        # 확장 쿼리는 원래 query 가 맨 앞에 포함됨 (_get_rag_fusion_queries, _get_hyde_queries)
+        n_semantic_queries = 1
+        if kwargs.get("rag_fusion", False):
+            n_semantic_queries = 1 + kwargs["query_augmentation_size"]
+        elif kwargs.get("hyde", False):
+            n_semantic_queries = 1 + len(kwargs["hyde_query"])
+
+        return n_semantic_queries + 1 <= opensearch_utils.hybrid_max_queries
+
+    @classmethod
+    def _get_latency_budget(cls, latency_budget):
+        '''
+        None, 초 단위 숫자 또는 LatencyBudget -> LatencyBudget (또는 None)
+        '''
+        if latency_budget is None or isinstance(latency_budget, LatencyBudget):
+            return latency_budget
+
+        return LatencyBudget(latency_budget)
+
+    @classmethod
+    # hybrid (lexical + semantic) search based
+    async def search_hybrid(cls, **kwargs):
+        '''
+        result_cache (RetrievalResultCache) 가 주어지면 같은 query / filter / 옵션의 결과를 재사용.
+        latency_budget 때문에 degradation 이 적용된 결과는 캐시하지 않음.
+        -> HybridSearchResults (.degradations 로 degradation 여부 확인)
+        '''
+        result_cache = kwargs.get("result_cache", None)
+        if result_cache is not None:
+            similar_docs = result_cache.get(**kwargs)
+            if similar_docs is not None:
+                return HybridSearchResults(similar_docs)
+
+        kwargs["latency_budget"] = budget = cls._get_latency_budget(kwargs.get("latency_budget", None))
+        similar_docs = await cls._search_hybrid(**kwargs)
+        if result_cache is not None and not (budget is not None and budget.degradations):
+            result_cache.set(similar_docs, **kwargs)
+
+        return similar_docs
+
+    @classmethod
+    async def _search_hybrid(cls, **kwargs):
+
+        assert "query" in kwargs, "Check your query"
+        assert "llm_emb" in kwargs, "Check your llm_emb"
+        rag_fusion = kwargs.get("rag_fusion", False)
+        hyde = kwargs.get("hyde", False)
+        parent_document = kwargs.get("parent_document", False)
+
+        assert (rag_fusion + hyde) <= 1, "choose only one between RAG-FUSION and HyDE"
+        if rag_fusion:
+            assert "query_augmentation_size" in kwargs, "if you use RAG-FUSION, Check your query_augmentation_size"
+        if hyde:
+            assert "hyde_query" in kwargs, "if you use HyDE, Check your hyde_query"
+        # vector_store 와 lexical_store 를 모두 쓰면 OpenSearch 없이 검색 (parent_document 는 OpenSearch 필요)
+        if kwargs.get("vector_store", None) is None or kwargs.get("lexical_store", None) is None or parent_document:
+            assert "index_name" in kwargs, "Check your index_name"
+            assert "os_client" in kwargs, "Check your os_client"
+
+        verbose = kwargs.get("verbose", False)
+        async_mode = kwargs.get("async_mode", True)
+        budget = cls._get_latency_budget(kwargs.get("latency_budget", None))
+        reranker = kwargs.get("reranker", False)
+        cascade = reranker and kwargs.get("cascade", False)
+        server_side_hybrid = cls._use_server_side_hybrid(**kwargs)
+        search_filter = deepcopy(kwargs.get("filter", []))
+        if parent_document:
+            search_filter.append({"term": {"metadata.family_tree": "child"}})
+        if cascade:
+            # cascade 1단계가 cross-encoder 입력을 cascade_max_m 개 이하로 줄이므로 후보를 더 깊게 가져옴
+            k = kwargs.get("cascade_depth", kwargs["k"]*4)
+        else:
+            k = kwargs.get("k", 5) if not reranker else int(kwargs["k"]*1.5)
+
+        search_kwargs = dict(
+            index_name=kwargs.get("index_name", None),
+            os_client=kwargs.get("os_client", None),
+            llm_emb=kwargs["llm_emb"],
+
+            query=kwargs["query"],
+            k=k,
+            boolean_filter=search_filter,
+            filter=search_filter,
+            minimum_should_match=kwargs.get("minimum_should_match", 0),
+            hybrid=True,
+            async_mode=async_mode,
+            msearch=kwargs.get("msearch", True),
+            two_phase=kwargs.get("two_phase", False), # _id / _score 만 검색하고 최종 후보만 hydrate
+            ef_search=kwargs.get("ef_search", None), # HNSW 탐색 폭 (KNNIndexProfile.get_search_kwargs)
+            binary_search=kwargs.get("binary_search", False), # binary (Hamming) 1단계 + float rescore
+            binary_oversample=kwargs.get("binary_oversample", 10), # 1단계 후보 수 = k * binary_oversample
+            binary_vector_field=kwargs.get("binary_vector_field", "binary_vector_field"),
+            space_type=kwargs.get("space_type", "cosinesimil"), # rescore 거리
+            stream_expansion=kwargs.get("stream_expansion", False), # RAG-Fusion / HyDE 쿼리를 생성되는 대로 검색
+            vector_store=kwargs.get("vector_store", None), # LocalVectorStore (semantic search backend)
+            lexical_store=kwargs.get("lexical_store", None), # LocalLexicalStore (lexical search backend)
+
+            llm_text=kwargs.get("llm_text", None),
+            query_augmentation_size=kwargs.get("query_augmentation_size", None),
+            query_transformation_prompt=kwargs.get("query_transformation_prompt", None),
+            hyde_query=kwargs.get("hyde_query", None),
+            hyde_cache=kwargs.get("hyde_cache", None), # HyDECache (가상 문서 / 임베딩 캐시)
+            fusion_algorithm=kwargs.get("fusion_algorithm", "RRF"), # fusion_utils.algorithms
+            ensemble_weights=kwargs.get("ensemble_weights", [.51, .49]),
+            hybrid_normalization=kwargs.get("hybrid_normalization", "min_max"), # server_side_hybrid: min_max / l2
+            hybrid_combination=kwargs.get("hybrid_combination", "arithmetic_mean"),
+            query_vectors={}, # 검색 단계에서 계산한 쿼리 벡터 (cascade 단계에서 재사용)
+
+            verbose=verbose,
+        )
+
+        if budget is not None and (rag_fusion or hyde):
+            search_kwargs["expanded_queries"] = await cls._get_budgeted_queries(budget, rag_fusion=rag_fusion, hyde=hyde, **search_kwargs)
+            if search_kwargs["expanded_queries"] is None:
+                rag_fusion, hyde = False, False
+
+        if server_side_hybrid:
+            search = cls.get_server_side_hybrid_docs(rag_fusion=rag_fusion, hyde=hyde, **search_kwargs)
+        elif rag_fusion and search_kwargs["stream_expansion"] and not search_kwargs.get("expanded_queries", None):
+            search = cls._get_streamed_rag_fusion_docs(**search_kwargs)
+        elif hyde and search_kwargs["stream_expansion"] and not search_kwargs.get("expanded_queries", None):
+            search = cls._get_streamed_hyde_docs(**search_kwargs)
+        elif search_kwargs["msearch"]:
+            search = cls._get_hybrid_docs_by_msearch(
+                rag_fusion=rag_fusion,
+                hyde=hyde,
+                **search_kwargs
+            )
+        else:
+            search = cls._get_hybrid_docs(rag_fusion=rag_fusion, hyde=hyde, **search_kwargs)
+
+        if budget is not None:
+            search_results = await budget.run("search", search)
+        else:
+            search_results = await search
+
+        if server_side_hybrid:
+            # OpenSearch 에서 fusion 까지 끝난 결과
+            similar_docs = search_results
+            similar_docs_semantic, similar_docs_keyword = search_results, []
+        else:
+            similar_docs_semantic, similar_docs_keyword = search_results
+            similar_docs = retriever_utils.get_ensemble_results(
+                doc_lists=[similar_docs_semantic, similar_docs_keyword],
+                weights=kwargs.get("ensemble_weights", [.51, .49]),
+                algorithm=kwargs.get("fusion_algorithm", "RRF"), # fusion_utils.algorithms
+                c=60,
+                k=k,
+            )
+
+        if verbose:
+            similar_docs_wo_reranker = deepcopy(similar_docs)
+
+        if budget is not None and reranker:
+            reserve_stages = ["parent_document"] if parent_document else []
+            if not budget.allows("rerank", *reserve_stages):
+                budget.degrade("skip_reranker")
+                reranker, cascade = False, False
+                similar_docs = similar_docs[:kwargs.get("k", 5)]
+            elif cascade and not budget.allows("cascade", "rerank", *reserve_stages):
+                budget.degrade("skip_cascade")
+                cascade = False
+                similar_docs = similar_docs[:int(kwargs.get("k", 5)*1.5)]
+
+        if cascade:
+            cascade_search = cls.get_cascade_docs(
+                query=kwargs["query"],
+                query_vector=search_kwargs["query_vectors"].get(kwargs["query"], None),
+                llm_emb=kwargs["llm_emb"],
+                context=similar_docs,
+                k=kwargs.get("k", 5),
+                max_m=kwargs.get("cascade_max_m", int(kwargs.get("k", 5)*1.5)),
+                gap_ratio=kwargs.get("cascade_gap_ratio", 0.15),
+                index_name=kwargs.get("index_name", None),
+                os_client=kwargs.get("os_client", None),
+                vector_store=kwargs.get("vector_store", None),
+                chunk_vector_cache=kwargs.get("chunk_vector_cache", None),
+                verbose=verbose
+            )
+            if budget is not None:
+                similar_docs = await budget.run("cascade", cascade_search)
+            else:
+                similar_docs = await cascade_search
+
+        if search_kwargs["two_phase"]:
+            # fusion / cascade 후 남은 후보만 text / metadata 조회
+            similar_docs = await cls.get_hydrated_docs(similar_docs, **search_kwargs)
+
+        if reranker:
+            rerank = cls.get_rerank_docs(
+                llm_text=kwargs["llm_text"],
+                query=kwargs["query"],
+                context=similar_docs,
+                k=kwargs.get("k", 5),
+                reranker_endpoint_name=kwargs.get("reranker_endpoint_name", None),
+                reranker_service=kwargs.get("reranker_service", None),
+                block=budget is None, # latency budget 이 있으면 queue 를 기다리지 않고 reranker 를 건너뜀
+                verbose=verbose
+            )
+            if budget is not None:
+                try:
+                    rerank_timeout = budget.remaining() - (budget.estimate("parent_document") if parent_document else 0)
+                    similar_docs = await budget.run("rerank", rerank, timeout=max(rerank_timeout, 0))
+                except asyncio.TimeoutError:
+                    budget.degrade("reranker_timeout")
+                    similar_docs = similar_docs[:kwargs.get("k", 5)]
+                except queue.Full:
+                    budget.degrade("reranker_rejected")
+                    similar_docs = similar_docs[:kwargs.get("k", 5)]
+            else:
+                similar_docs = await rerank
+
+        if parent_document and budget is not None and not budget.allows("parent_document"):
+            budget.degrade("skip_parent_document")
+            parent_document = False
+
+        if parent_document:
+            parent_search = cls.get_parent_document_similar_docs(
+                index_name=kwargs["index_name"],
+                os_client=kwargs["os_client"],
+                similar_docs=similar_docs,
+                hybrid=True,
+                boolean_filter=search_filter,
+                parent_cache=kwargs.get("parent_cache", None),
+                verbose=verbose
+            )
+            if budget is not None:
+                try:
+                    similar_docs = await budget.run("parent_document", parent_search, timeout=budget.remaining())
+                except asyncio.TimeoutError:
+                    budget.degrade("parent_document_timeout")
+            else:
+                similar_docs = await parent_search
+
+        if verbose and budget is not None:
+            print("===== Latency Budget =====")
+            print(budget.info())
+
+        if verbose:
+            cls._print_search_hybrid_info(
+                async_mode=async_mode,
+                reranker=reranker,
+                rag_fusion=rag_fusion,
+                hyde=hyde,
+                parent_document=parent_document,
+                similar_docs_semantic=similar_docs_semantic,
+                similar_docs_keyword=similar_docs_keyword,
+                similar_docs_wo_reranker=similar_docs_wo_reranker,
+                similar_docs=similar_docs
+            )
+
+        similar_docs = list(map(lambda x:x[0], similar_docs))
+
+        return HybridSearchResults(similar_docs, budget)
+
+    @classmethod
+    def _print_search_hybrid_info(cls, **kwargs):
+
+        for name in ["async_mode", "reranker", "rag_fusion", "hyde", "parent_document"]:
+            print("##############################")
+            print(name if name != "hyde" else "HyDE")
+            print("##############################")
+            print(kwargs[name])
+
+        doc_names = ["similar_docs_semantic", "similar_docs_keyword"]
+        if kwargs["reranker"]: doc_names.append("similar_docs_wo_reranker")
+        doc_names.append("similar_docs")
+
+        for name in doc_names:
+            print("##############################")
+            print(name if name != "similar_docs_wo_reranker" else "similar_docs_without_reranker")
+            print("##############################")
+            print (opensearch_utils.opensearch_pretty_print_documents_with_score(kwargs[name]))
@@ -0,0 +1,128 @@
+############################################################
+############################################################
+# Cache 관련 함수들
+############################################################
+############################################################
+
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+_MISSING = object()
+
+def normalize_text(text):
+    '''
+    캐시 key 용 텍스트 정규화: NFKC + 공백 정리 (대소문자는 임베딩 결과에 영향을 줄 수 있어 유지)
+    '''
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+class LRUTTLCache():
+    '''
+    thread-safe LRU + TTL 캐시.
+    maxsize 를 넘으면 가장 오래 사용되지 않은 항목부터 제거하고, ttl(초)이 지난 항목은 조회 시 만료 처리
+    '''
+    def __init__(self, maxsize=1024, ttl=None):
+
+        assert maxsize > 0, "Check your maxsize"
+        assert ttl is None or ttl > 0, "Check your ttl"
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict() # key -> (expire_at, value)
+        self._lock = threading.RLock()
+
+    def _is_expired(self, expire_at, now=None):
+
+        return expire_at is not None and (now or time.time()) >= expire_at
+
+    def get(self, key, default=None):
+
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING or self._is_expired(item[0]):
+                if item is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=_MISSING, expire_at=_MISSING):
+        '''
+        expire_at 을 주면 (디스크에서 복원할 때 등) 만료 시각을 그대로 사용
+        '''
+        if expire_at is _MISSING:
+            ttl = self.ttl if ttl is _MISSING else ttl
+            expire_at = None if ttl is None else time.time() + ttl
+
+        with self._lock:
+            self._data[key] = (expire_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            return default if item is _MISSING else item[1]
+
+    def pop_if(self, predicate):
+        '''
+        predicate(key, value) 가 True 인 항목 제거. 제거한 개수 반환
+        '''
+        with self._lock:
+            keys = [key for key, (_, value) in self._data.items() if predicate(key, value)]
+            for key in keys:
+                del self._data[key]
+
+        return len(keys)
+
+    def purge_expired(self):
+
+        now = time.time()
+        with self._lock:
+            keys = [key for key, (expire_at, _) in self._data.items() if self._is_expired(expire_at, now)]
+            for key in keys:
+                del self._data[key]
+
+        return len(keys)
+
+    def clear(self):
+
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def __contains__(self, key):
+
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            return item is not _MISSING and not self._is_expired(item[0])
+
+    def __len__(self):
+
+        with self._lock:
+            return len(self._data)
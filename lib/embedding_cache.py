@@ -0,0 +1,175 @@
+############################################################
+############################################################
+# Embedding 캐시 관련 함수들
+############################################################
+############################################################
+
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from local_utils.cache import LRUTTLCache, normalize_text
+
+###########################################
+### Query embedding cache (LRU + TTL, SQLite persistence)
+###########################################
+
+# 매개변수 (Parameters):
+# * embeddings: 실제 임베딩 모델 (get_embedding_model 의 반환값, llm_emb)
+# * model_id: 캐시 key 에 들어갈 모델 식별자. None 이면 model_id / endpoint_name 에서 추출
+# * maxsize, ttl: 메모리 캐시 최대 항목 수와 만료 시간(초)
+# * persist_path: SQLite 파일 경로. 지정하면 재시작 후에도 임베딩을 재사용
+###########################################
+
+class CachedEmbeddings(Embeddings):
+
+    def __init__(self, embeddings: Embeddings, model_id: Optional[str]=None, maxsize: int=10000, ttl: Optional[float]=60*60*24, persist_path: Optional[str]=None):
+
+        self.embeddings = embeddings
+        self.model_id = model_id or self.get_model_id(embeddings)
+        self.cache = LRUTTLCache(maxsize=maxsize, ttl=ttl)
+        self.persist_path = persist_path
+        self.disk_hits = 0
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if persist_path is not None:
+            self._db = sqlite3.connect(persist_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, expire_at REAL, vector BLOB)"
+            )
+            self._db.commit()
+            self.purge_expired()
+
+    @staticmethod
+    def get_model_id(embeddings):
+
+        for attr in ["model_id", "model", "endpoint_name", "model_name"]:
+            value = getattr(embeddings, attr, None)
+            if isinstance(value, str) and value:
+                return value
+
+        return type(embeddings).__name__
+
+    def get_key(self, text):
+
+        key = f"{self.model_id}\x00{normalize_text(text)}"
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _get_from_disk(self, keys):
+
+        if self._db is None or not keys:
+            return {}
+
+        now = time.time()
+        with self._db_lock:
+            rows = self._db.execute(
+                f"SELECT key, expire_at, vector FROM embeddings WHERE key IN ({','.join('?'*len(keys))})",
+                keys
+            ).fetchall()
+
+        vectors = {}
+        for key, expire_at, vector in rows:
+            if expire_at is not None and expire_at <= now:
+                continue
+            vector = np.frombuffer(vector, dtype=np.float32)
+            self.cache.set(key, vector, expire_at=expire_at)
+            vectors[key] = vector
+        self.disk_hits += len(vectors)
+
+        return vectors
+
+    def _set_to_disk(self, items):
+
+        if self._db is None or not items:
+            return
+
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, expire_at, vector) VALUES (?, ?, ?)",
+                [(key, expire_at, vector.tobytes()) for key, expire_at, vector in items]
+            )
+            self._db.commit()
+
+    def embed_documents(self, texts: List[str], **kwargs) -> List[List[float]]:
+        '''
+        캐시에 없는 텍스트만 모아서 embeddings.embed_documents 로 한 번에 임베딩.
+        kwargs (chunk_size 등) 는 그대로 전달
+        '''
+        keys = [self.get_key(text) for text in texts]
+        vectors = {}
+        for key in set(keys):
+            vector = self.cache.get(key)
+            if vector is not None:
+                vectors[key] = vector
+
+        vectors.update(self._get_from_disk([key for key in set(keys) if key not in vectors]))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()), **kwargs)
+            persist_items = []
+            for key, vector in zip(missing.keys(), new_vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                self.cache.set(key, vector)
+                vectors[key] = vector
+                persist_items.append((key, None if self.cache.ttl is None else time.time() + self.cache.ttl, vector))
+            self._set_to_disk(persist_items)
+
+        return [vectors[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+
+        key = self.get_key(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self._get_from_disk([key]).get(key)
+        if vector is None:
+            vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+            self.cache.set(key, vector)
+            self._set_to_disk([(key, None if self.cache.ttl is None else time.time() + self.cache.ttl, vector)])
+
+        return vector.tolist()
+
+    def purge_expired(self):
+
+        removed = self.cache.purge_expired()
+        if self._db is not None:
+            with self._db_lock:
+                cursor = self._db.execute(
+                    "DELETE FROM embeddings WHERE expire_at IS NOT NULL AND expire_at <= ?",
+                    (time.time(),)
+                )
+                self._db.commit()
+            removed += cursor.rowcount
+
+        return removed
+
+    def clear(self):
+
+        self.cache.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+
+    def stats(self):
+        '''
+        hits/misses 는 메모리 캐시 기준, disk_hits 는 메모리 miss 중 SQLite 에서 찾은 수
+        '''
+        stats = self.cache.stats()
+        stats["model_id"] = self.model_id
+        stats["disk_hits"] = self.disk_hits
+        stats["persist_path"] = self.persist_path
+
+        return stats
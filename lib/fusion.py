@@ -0,0 +1,258 @@
+############################################################
+############################################################
+# Score fusion 관련 함수들
+############################################################
+############################################################
+
+import numpy as np
+from typing import List, Tuple
+
+from langchain.schema import Document
+
+from local_utils.search_results import SearchHits
+
+#################################################################
+# Score fusion (lexical + semantic, RAG-Fusion, HyDE)
+#################################################################
+
+# 문서는 OpenSearch _id (metadata["id"]) 로 식별하고 (없으면 page_content),
+# 모든 (문서, 리스트, rank, score) 를 1차원 배열로 펼쳐서 np.bincount 로 점수를 합산한 뒤
+# np.argpartition 으로 top-k 만 정렬.
+# 리스트가 SearchHits 이면 ids / scores 열만 사용하고, Document 는 최종 top-k 만 만듦.
+#
+# algorithm
+# * RRF: sum(weight / (rank + c))
+# * simple_weighted: sum(weight * score)
+# * CombSUM: sum(score)
+# * CombMNZ: sum(score) * (문서가 등장한 리스트 수)
+# * convex_min_max, convex_z_score: 리스트별로 min-max / z-score 정규화 후 sum(weight * score)
+
+class fusion_utils():
+
+    algorithms = ["RRF", "simple_weighted", "CombSUM", "CombMNZ", "convex_min_max", "convex_z_score"]
+
+    @classmethod
+    def get_doc_key(cls, doc):
+
+        return doc.metadata.get("id", None) or doc.page_content
+
+    @classmethod
+    def _get_keys_and_scores(cls, doc_list):
+        '''
+        (문서 key 리스트, score 배열, row -> 문서 참조). SearchHits 는 Document 를 만들지 않음
+        '''
+        if isinstance(doc_list, SearchHits):
+            return doc_list.ids, doc_list.scores, lambda row: (doc_list, row)
+
+        return (
+            [cls.get_doc_key(doc) for doc, _ in doc_list],
+            [score for _, score in doc_list],
+            lambda row: doc_list[row][0]
+        )
+
+    @classmethod
+    def get_document(cls, doc_ref):
+        '''
+        _flatten 의 문서 참조 (Document 또는 (SearchHits, row)) 를 Document 로 변환
+        '''
+        if isinstance(doc_ref, tuple):
+            hits, row = doc_ref
+            return hits.get_document(row)
+
+        return doc_ref
+
+    @classmethod
+    def _flatten(cls, doc_lists, n_lists):
+        '''
+        doc_lists 를 (doc_idx, list_idx, rank, score) 배열과 unique 문서 참조 리스트로 변환
+        '''
+        key_to_idx, docs = {}, []
+        doc_idx, list_idx, ranks, scores = [], [], [], []
+
+        for l_idx, doc_list in enumerate(doc_lists[:n_lists]):
+            keys, list_scores, get_ref = cls._get_keys_and_scores(doc_list)
+            for row, key in enumerate(keys):
+                idx = key_to_idx.get(key)
+                if idx is None:
+                    idx = key_to_idx[key] = len(docs)
+                    docs.append(get_ref(row))
+                doc_idx.append(idx)
+            list_idx.append(np.full(len(keys), l_idx, dtype=np.int64))
+            ranks.append(np.arange(1, len(keys)+1, dtype=np.float64))
+            scores.append(np.asarray(list_scores, dtype=np.float64))
+
+        return (
+            docs,
+            np.asarray(doc_idx, dtype=np.int64),
+            np.concatenate(list_idx) if list_idx else np.zeros(0, dtype=np.int64),
+            np.concatenate(ranks) if ranks else np.zeros(0, dtype=np.float64),
+            np.concatenate(scores) if scores else np.zeros(0, dtype=np.float64),
+        )
+
+    @classmethod
+    def _normalize_per_list(cls, scores, list_idx, n_lists, normalization):
+        '''
+        리스트별 min-max 또는 z-score 정규화
+        '''
+        counts = np.bincount(list_idx, minlength=n_lists)
+        if normalization == "min_max":
+            mins = np.full(n_lists, np.inf)
+            maxs = np.full(n_lists, -np.inf)
+            np.minimum.at(mins, list_idx, scores)
+            np.maximum.at(maxs, list_idx, scores)
+            ranges = maxs - mins
+            ranges[(counts == 0) | (ranges == 0)] = 1.0
+            mins[counts == 0] = 0.0
+            return (scores - mins[list_idx]) / ranges[list_idx]
+
+        # z_score
+        safe_counts = np.maximum(counts, 1)
+        means = np.bincount(list_idx, weights=scores, minlength=n_lists) / safe_counts
+        variances = np.bincount(list_idx, weights=(scores - means[list_idx])**2, minlength=n_lists) / safe_counts
+        stds = np.sqrt(variances)
+        stds[stds == 0] = 1.0
+        return (scores - means[list_idx]) / stds[list_idx]
+
+    @classmethod
+    def _get_contributions(cls, scores, ranks, list_idx, n_lists, weights, algorithm, c):
+        '''
+        (문서, 리스트) 항목별 fusion score 기여도
+        '''
+        if algorithm == "RRF": # RRF (Reciprocal Rank Fusion)
+            return weights[list_idx] / (ranks + c)
+        if algorithm == "simple_weighted":
+            return weights[list_idx] * scores
+        if algorithm in ["CombSUM", "CombMNZ"]:
+            return scores
+
+        normalization = algorithm[len("convex_"):]
+        return weights[list_idx] * cls._normalize_per_list(scores, list_idx, n_lists, normalization)
+
+    @classmethod
+    def get_fused_scores(cls, doc_lists, weights, algorithm="RRF", c=60):
+        '''
+        unique 문서 참조 리스트 (get_document 로 변환) 와 fusion score 배열 반환
+        '''
+        assert algorithm in cls.algorithms, f'Check your algorithm: {cls.algorithms}'
+
+        n_lists = min(len(doc_lists), len(weights))
+        docs, doc_idx, list_idx, ranks, scores = cls._flatten(doc_lists, n_lists)
+        if not docs:
+            return docs, np.zeros(0, dtype=np.float64)
+
+        weights = np.asarray(weights[:n_lists], dtype=np.float64)
+        contrib = cls._get_contributions(scores, ranks, list_idx, n_lists, weights, algorithm, c)
+
+        fused_scores = np.bincount(doc_idx, weights=contrib, minlength=len(docs))
+        if algorithm == "CombMNZ":
+            fused_scores *= np.bincount(doc_idx, minlength=len(docs))
+
+        return docs, fused_scores
+
+    @classmethod
+    def get_top_k(cls, scores, k):
+        '''
+        score 내림차순 top-k index (argpartition 후 k 개만 정렬, 동점은 먼저 등장한 문서 우선)
+        '''
+        n = len(scores)
+        if k <= 0 or n == 0:
+            return np.zeros(0, dtype=np.int64)
+        if k < n:
+            top_idx = np.argpartition(-scores, k-1)[:k]
+        else:
+            top_idx = np.arange(n)
+
+        return top_idx[np.lexsort((top_idx, -scores[top_idx]))]
+
+    @classmethod
+    def get_ensemble_results(cls, doc_lists: List[List[Tuple[Document, float]]], weights, algorithm="RRF", c=60, k=5) -> List[Tuple[Document, float]]:
+
+        docs, fused_scores = cls.get_fused_scores(doc_lists, weights, algorithm=algorithm, c=c)
+        top_idx = cls.get_top_k(fused_scores, k)
+
+        return [(cls.get_document(docs[idx]), float(fused_scores[idx])) for idx in top_idx]
+
+#################################################################
+# Incremental fusion (streaming)
+#################################################################
+
+# 검색 결과 리스트가 하나씩 도착할 때 (streaming RAG-Fusion / HyDE) 바로 누적하는 fusion.
+# add 에서 문서 key 중복 제거 (doc_idx) 까지 끝내 두고, remove 는 리스트 항목만 뺌.
+# get_ensemble_results 는 리스트 항목을 list_id 순서로 이어 붙여 fusion_utils 와 같은 방식
+# (_get_contributions + np.bincount) 으로 합산하므로, 결과 (score 의 부동소수점 합산 순서 포함) 는
+# list_id 순서로 fusion_utils.get_ensemble_results 를 호출한 것과 같음
+# (도착 순서와 관계없이 동점은 list_id, rank 가 앞선 문서 우선). list_id 는 정수
+
+class IncrementalFusion():
+
+    def __init__(self, algorithm="RRF", c=60):
+
+        assert algorithm in fusion_utils.algorithms, f'Check your algorithm: {fusion_utils.algorithms}'
+
+        self.algorithm = algorithm
+        self.c = c
+        self.key_to_idx, self.docs = {}, []
+        self.lists = {} # list_id -> (doc_idx, scores)
+
+    def __len__(self):
+
+        return len(self.lists)
+
+    def add(self, doc_list: List[Tuple[Document, float]], list_id=None):
+
+        list_id = len(self.lists) if list_id is None else list_id
+        assert list_id not in self.lists, f"Duplicated list_id: {list_id}"
+
+        keys, list_scores, get_ref = fusion_utils._get_keys_and_scores(doc_list)
+        doc_idx = []
+        for row, key in enumerate(keys):
+            idx = self.key_to_idx.get(key)
+            if idx is None:
+                idx = self.key_to_idx[key] = len(self.docs)
+                self.docs.append(get_ref(row))
+            doc_idx.append(idx)
+
+        self.lists[list_id] = (np.asarray(doc_idx, dtype=np.int64), np.asarray(list_scores, dtype=np.float64))
+
+        return list_id
+
+    def remove(self, list_id):
+
+        self.lists.pop(list_id)
+
+    def get_ensemble_results(self, k=5, weight=1.0) -> List[Tuple[Document, float]]:
+
+        list_ids = sorted(self.lists)
+        if not list_ids:
+            return []
+
+        # batch fusion 과 같은 순서 (list_id, rank) 로 펼쳐서 기여도 계산 / 합산
+        doc_lists = [self.lists[list_id] for list_id in list_ids]
+        doc_idx = np.concatenate([doc_idx for doc_idx, _ in doc_lists])
+        scores = np.concatenate([scores for _, scores in doc_lists])
+        list_idx = np.concatenate([np.full(len(doc_idx), l_idx, dtype=np.int64) for l_idx, (doc_idx, _) in enumerate(doc_lists)])
+        ranks = np.concatenate([np.arange(1, len(doc_idx)+1, dtype=np.float64) for doc_idx, _ in doc_lists])
+
+        contrib = fusion_utils._get_contributions(
+            scores,
+            ranks,
+            list_idx,
+            len(doc_lists),
+            np.full(len(doc_lists), weight, dtype=np.float64),
+            self.algorithm,
+            self.c
+        )
+        fused_scores = np.bincount(doc_idx, weights=contrib, minlength=len(self.docs))
+        counts = np.bincount(doc_idx, minlength=len(self.docs))
+        if self.algorithm == "CombMNZ":
+            fused_scores *= counts
+
+        # 동점 처리를 batch fusion 과 같게 하기 위해 가장 앞선 등장 위치 (list_id, rank) 순으로 정렬
+        positions = np.full(len(self.docs), np.inf)
+        np.minimum.at(positions, doc_idx, np.arange(len(doc_idx)))
+
+        candidates = np.flatnonzero(counts > 0)
+        candidates = candidates[np.argsort(positions[candidates], kind="stable")]
+        top_idx = candidates[fusion_utils.get_top_k(fused_scores[candidates], k)]
+
+        return [(fusion_utils.get_document(self.docs[idx]), float(fused_scores[idx])) for idx in top_idx]
@@ -0,0 +1,671 @@
+############################################################
+############################################################
+# Ingestion 관련 함수들 (OpenSearch _bulk)
+############################################################
+############################################################
+
+import os
+import json
+import time
+import random
+import hashlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from opensearchpy.helpers import scan
+from opensearchpy.exceptions import TransportError
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from local_utils.opensearch import opensearch_utils
+from local_utils.serializer import serializer_utils
+from local_utils.quantization import binary_quantization_utils
+from local_utils.embedding_cache import CachedEmbeddings
+from local_utils.projection import EmbeddingProjection, ProjectedEmbeddings
+from local_utils.rag import embed_documents_batch, retriever_utils
+
+###########################################
+### Streaming bulk ingestion pipeline
+###########################################
+
+# 문서(generator 또는 JSONL) -> chunking -> batch 임베딩 -> _bulk 색인 을 스트리밍으로 처리.
+#
+# 매개변수 (Parameters):
+# * embed_batch_size: 한 번에 임베딩할 chunk 수
+# * bulk_batch_size, bulk_max_bytes: _bulk 요청 하나에 들어갈 최대 문서 수 / 바이트
+# * max_in_flight: 동시에 보낼 _bulk 요청 수
+# * max_retries, initial_backoff, max_backoff: 429 (Too Many Requests) 재시도 설정 (exponential backoff)
+# * disable_refresh: 색인 중 refresh_interval=-1 로 두고 끝나면 원래 값으로 복원 후 refresh
+# * llm_text: 주어지면 chunk metadata 에 reranker 용 token_count / rerank_segments 를 미리 계산해서 저장
+#   (retriever_utils.get_rerank_metadata, 검색 시 get_num_tokens / text_splitter 호출 생략)
+# * serializer: _bulk 줄 encode 에 쓸 opensearch-py Serializer (None 이면 orjson 이 있을 때 OrjsonSerializer)
+# * binary_vector_field: 주어지면 벡터의 sign-binarized 값 (binary_quantization_utils) 을 이 필드에도 색인
+#   (retriever_utils.search_hybrid(..., binary_search=True) 의 1단계 검색용)
+# llm_emb 가 ProjectedEmbeddings 이면 (fit_projection 또는 get_embedding_model(..., projection=)) 차원을 줄인 벡터를 색인하고,
+# 색인 전에 index _meta 의 변환 version 을 확인 / 기록 (EmbeddingProjection.set_index_meta)
+#
+# sync(documents, manifest_path=...): 증분 동기화. chunk 마다 sha1(임베딩 모델 id + text) 를 metadata.content_hash 로 저장하고
+# 이전 상태 (manifest 파일 또는 index 의 content_hash) 와 비교해서
+# * hash 가 같은 chunk 는 건너뜀 (임베딩 / 색인 없음)
+# * 새로 생기거나 바뀐 chunk 만 임베딩 / 색인. 같은 text 가 다른 id 로 옮겨졌으면 (앞에 chunk 가 추가되는 등)
+#   임베딩 대신 색인 전에 index 의 기존 벡터를 mget 으로 읽어서 재사용
+# * 이번 corpus 에 없는 chunk 는 _bulk delete (delete_missing=True)
+# 문서에 metadata["id"] 가 없으면 source (+ page) 로 id 를 만들어 실행마다 chunk id 가 같도록 함
+###########################################
+
+class BulkIngestionPipeline():
+
+    def __init__(
+        self,
+        os_client,
+        index_name: str,
+        llm_emb,
+        text_splitter=None,
+        vector_field: str="vector_field",
+        embed_batch_size: int=32,
+        bulk_batch_size: int=500,
+        bulk_max_bytes: int=10*1024*1024,
+        max_in_flight: int=4,
+        max_retries: int=5,
+        initial_backoff: float=1.0,
+        max_backoff: float=60.0,
+        disable_refresh: bool=True,
+        progress_interval: float=5.0,
+        llm_text=None,
+        serializer=None,
+        binary_vector_field: Optional[str]=None,
+        verbose: bool=True
+    ):
+
+        assert embed_batch_size > 0, "Check your embed_batch_size"
+        assert bulk_batch_size > 0, "Check your bulk_batch_size"
+        assert max_in_flight > 0, "Check your max_in_flight"
+
+        self.os_client = os_client
+        self.index_name = index_name
+        self.llm_emb = llm_emb
+        self.text_splitter = text_splitter or RecursiveCharacterTextSplitter(
+            chunk_size=1024,
+            chunk_overlap=100,
+            separators=["\n\n", "\n", ".", " ", ""],
+            length_function=len,
+        )
+        self.vector_field = vector_field
+        self.binary_vector_field = binary_vector_field
+        self.embed_batch_size = embed_batch_size
+        self.bulk_batch_size = bulk_batch_size
+        self.bulk_max_bytes = bulk_max_bytes
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.disable_refresh = disable_refresh
+        self.progress_interval = progress_interval
+        self.llm_text = llm_text
+        self.serializer = serializer_utils.get_serializer(serializer) # _bulk ndjson 줄 encode (None 이면 json)
+        self.verbose = verbose
+
+        self._reset_stats()
+
+    def _reset_stats(self):
+
+        self.stats = {
+            "documents": 0,
+            "chunks": 0,
+            "indexed": 0,
+            "errors": 0,
+            "retries": 0,
+            "bulk_requests": 0,
+            "elapsed": 0.0,
+            "docs_per_sec": 0.0,
+            "skipped": 0, # sync: hash 가 같아서 건너뛴 chunk
+            "reused_vectors": 0, # sync: 옮겨진 chunk 의 벡터 재사용
+            "deleted": 0, # sync: 삭제한 chunk
+        }
+        self.errors = []
+        self.failed_ids = set() # 색인 / 삭제에 실패한 _id (알 수 없으면 None)
+        self._reused_vectors = {} # sync: {chunk id: 다른 id 에서 옮겨온 기존 벡터}
+        self._start_time = time.time()
+        self._last_progress = self._start_time
+
+    #################################################################
+    # Source
+    #################################################################
+
+    @staticmethod
+    def load_jsonl(path: str, text_fields: List[str]=["text"], id_field: Optional[str]=None) -> Iterator[Document]:
+        '''
+        JSONL 파일을 한 줄씩 읽어 Document 로 변환 (예: requests.jsonl 은 text_fields=["title", "body"], id_field="request_id")
+        text_fields 는 줄바꿈으로 이어서 page_content 로, 나머지 필드는 metadata 로 저장
+        '''
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                page_content = "\n".join(str(record[field]) for field in text_fields if record.get(field))
+                metadata = {key: value for key, value in record.items() if key not in text_fields}
+                if id_field is not None:
+                    metadata["id"] = str(record[id_field])
+                yield Document(page_content=page_content, metadata=metadata)
+
+    #################################################################
+    # Chunking / Embedding
+    #################################################################
+
+    def get_chunks(self, documents: Iterable[Document]) -> Iterator[Document]:
+        '''
+        문서를 하나씩 chunking. metadata["id"] 가 있으면 chunk id 는 "{id}-{순번}"
+        '''
+        for document in documents:
+            self.stats["documents"] += 1
+            chunks = self.text_splitter.split_documents([document])
+            doc_id = document.metadata.get("id", None)
+            for idx, chunk in enumerate(chunks):
+                if doc_id is not None:
+                    chunk.metadata["id"] = f"{doc_id}-{idx}"
+                yield chunk
+
+    def get_sources(self, chunks: Iterable[Document]) -> Iterator[Tuple[Optional[str], Dict[str, Any]]]:
+        '''
+        chunk 를 embed_batch_size 씩 모아서 임베딩하고 (doc_id, _source) 생성
+        '''
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= self.embed_batch_size:
+                yield from self._embed_chunks(batch)
+                batch = []
+        if batch:
+            yield from self._embed_chunks(batch)
+
+    def _needs_vector(self, chunk):
+
+        return True
+
+    def _needs_rerank_metadata(self, chunk):
+
+        return self.llm_text is not None
+
+    def _embed_chunks(self, chunks):
+
+        reused_vectors = self._reused_vectors
+        embed_chunks = [chunk for chunk in chunks if self._needs_vector(chunk) and chunk.metadata.get("id", None) not in reused_vectors]
+        vectors = iter(embed_documents_batch(self.llm_emb, [chunk.page_content for chunk in embed_chunks]) if embed_chunks else [])
+        for chunk in chunks:
+            self.stats["chunks"] += 1
+            metadata = dict(chunk.metadata)
+            doc_id = metadata.pop("id", None)
+            if self._needs_rerank_metadata(chunk):
+                metadata.update(retriever_utils.get_rerank_metadata(self.llm_text, chunk.page_content))
+            source = {
+                "text": chunk.page_content,
+                "metadata": metadata,
+            }
+            if self._needs_vector(chunk):
+                source[self.vector_field] = reused_vectors[doc_id] if doc_id in reused_vectors else next(vectors)
+                if self.binary_vector_field is not None:
+                    source[self.binary_vector_field] = binary_quantization_utils.get_binary_vector(source[self.vector_field])
+            yield doc_id, source
+
+    #################################################################
+    # _bulk
+    #################################################################
+
+    def _get_bulk_lines(self, doc_id, source):
+
+        action = {"index": {"_index": self.index_name}}
+        if doc_id is not None:
+            action["index"]["_id"] = doc_id
+
+        if self.serializer is not None:
+            return self.serializer.dumps(action), self.serializer.dumps(source)
+
+        return json.dumps(action), json.dumps(source, ensure_ascii=False)
+
+    def get_bulk_batches(self, sources: Iterable[Tuple[Optional[str], Dict[str, Any]]]) -> Iterator[List[Tuple[str, str]]]:
+        '''
+        (action, source) ndjson 줄을 bulk_batch_size / bulk_max_bytes 를 넘지 않게 묶음
+        '''
+        batch, batch_bytes = [], 0
+        for doc_id, source in sources:
+            lines = self._get_bulk_lines(doc_id, source)
+            line_bytes = len(lines[0].encode("utf-8")) + len(lines[1].encode("utf-8")) + 2
+            if batch and (len(batch) >= self.bulk_batch_size or batch_bytes + line_bytes > self.bulk_max_bytes):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(lines)
+            batch_bytes += line_bytes
+        if batch:
+            yield batch
+
+    def _get_backoff(self, attempt):
+
+        backoff = min(self.max_backoff, self.initial_backoff * (2 ** attempt))
+        return backoff * (0.5 + random.random() / 2)
+
+    def _send_bulk(self, batch):
+        '''
+        _bulk 요청. 요청 전체 또는 개별 문서가 429 이면 해당 부분만 backoff 후 재시도
+        '''
+        indexed, errors, retries = 0, [], 0
+
+        for attempt in range(self.max_retries + 1):
+            body = "\n".join(line for lines in batch for line in lines) + "\n"
+            try:
+                response = self.os_client.bulk(body=body, index=self.index_name, refresh=False)
+            except TransportError as e:
+                if e.status_code == 429 and attempt < self.max_retries:
+                    retries += 1
+                    time.sleep(self._get_backoff(attempt))
+                    continue
+                raise
+
+            retry_batch = []
+            for lines, item in zip(batch, response["items"]):
+                result = next(iter(item.values()))
+                status = result.get("status", 500)
+                if status == 429:
+                    retry_batch.append(lines)
+                elif status >= 300 and not (status == 404 and "delete" in item): # 이미 없는 문서의 delete 는 성공
+                    errors.append(result)
+                else:
+                    indexed += 1
+
+            if not retry_batch:
+                break
+            if attempt == self.max_retries:
+                errors.extend({"status": 429, "error": "max retries exceeded"} for _ in retry_batch)
+                break
+
+            retries += 1
+            batch = retry_batch
+            time.sleep(self._get_backoff(attempt))
+
+        return indexed, errors, retries
+
+    def _collect(self, futures):
+
+        for future in futures:
+            indexed, errors, retries = future.result()
+            self.stats["indexed"] += indexed
+            self.stats["errors"] += len(errors)
+            self.stats["retries"] += retries
+            self.stats["bulk_requests"] += 1
+            self.errors.extend(errors[:max(0, 100-len(self.errors))]) # 최대 100개까지만 보관
+            self.failed_ids.update(error.get("_id", None) for error in errors)
+        self._report_progress()
+
+    def _report_progress(self, force=False):
+
+        now = time.time()
+        self.stats["elapsed"] = now - self._start_time
+        self.stats["docs_per_sec"] = self.stats["indexed"] / self.stats["elapsed"] if self.stats["elapsed"] > 0 else 0.0
+
+        if self.verbose and (force or now - self._last_progress >= self.progress_interval):
+            self._last_progress = now
+            print(
+                f'[{self.index_name}] documents={self.stats["documents"]}, chunks={self.stats["chunks"]}, '
+                f'indexed={self.stats["indexed"]}, errors={self.stats["errors"]}, retries={self.stats["retries"]}, '
+                f'{self.stats["docs_per_sec"]:.1f} docs/sec'
+            )
+
+    #################################################################
+    # Refresh
+    #################################################################
+
+    def _get_refresh_interval(self):
+
+        settings = self.os_client.indices.get_settings(index=self.index_name, name="index.refresh_interval")
+        return settings.get(self.index_name, {}).get("settings", {}).get("index", {}).get("refresh_interval", None)
+
+    def _set_refresh_interval(self, refresh_interval):
+
+        # None 이면 기본값으로 되돌림
+        self.os_client.indices.put_settings(
+            index=self.index_name,
+            body={"index": {"refresh_interval": refresh_interval}}
+        )
+
+    #################################################################
+    # Projection
+    #################################################################
+
+    def fit_projection(self, documents: Iterable[Document], sample_size: int=5000, seed: int=0, **fit_kwargs) -> EmbeddingProjection:
+        '''
+        documents 의 chunk 중 sample_size 개 (reservoir sampling) 를 원래 차원으로 임베딩해서 EmbeddingProjection 을 학습하고
+        이후 색인에 쓸 llm_emb 를 ProjectedEmbeddings 로 교체. fit_kwargs: method, dimension, target_recall, space_type 등
+        '''
+        rng = random.Random(seed)
+        sample = []
+        chunks = (chunk for chunk in self.get_chunks(documents) if self._needs_vector(chunk))
+        for n_chunks, chunk in enumerate(chunks):
+            if len(sample) < sample_size:
+                sample.append(chunk.page_content)
+            else:
+                idx = rng.randint(0, n_chunks)
+                if idx < sample_size:
+                    sample[idx] = chunk.page_content
+        self._reset_stats()
+
+        llm_emb = self.llm_emb.embeddings if isinstance(self.llm_emb, ProjectedEmbeddings) else self.llm_emb
+        vectors = []
+        for start in range(0, len(sample), self.embed_batch_size):
+            vectors.extend(embed_documents_batch(llm_emb, sample[start:start+self.embed_batch_size]))
+
+        projection = EmbeddingProjection.fit(vectors, model_id=CachedEmbeddings.get_model_id(llm_emb), verbose=self.verbose, **fit_kwargs)
+        self.llm_emb = ProjectedEmbeddings(llm_emb, projection)
+
+        return projection
+
+    #################################################################
+    # Run
+    #################################################################
+
+    def index_sources(self, sources: Iterable[Tuple[Optional[str], Dict[str, Any]]]) -> Dict[str, Any]:
+        '''
+        (doc_id, _source) 를 max_in_flight 개의 _bulk 요청으로 병렬 색인
+        '''
+        if isinstance(self.llm_emb, ProjectedEmbeddings):
+            self.llm_emb.projection.set_index_meta(self.os_client, self.index_name)
+
+        previous_refresh_interval = None
+        if self.disable_refresh:
+            previous_refresh_interval = self._get_refresh_interval()
+            self._set_refresh_interval("-1")
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+                in_flight = set()
+                for batch in self.get_bulk_batches(sources):
+                    if len(in_flight) >= self.max_in_flight:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        self._collect(done)
+                    in_flight.add(executor.submit(self._send_bulk, batch))
+                self._collect(in_flight)
+        finally:
+            if self.disable_refresh:
+                self._set_refresh_interval(previous_refresh_interval)
+            self.os_client.indices.refresh(index=self.index_name)
+            opensearch_utils.notify_index_write(self.index_name)
+
+        self._report_progress(force=True)
+
+        return self.stats
+
+    def run(self, documents: Iterable[Document]) -> Dict[str, Any]:
+        '''
+        documents (generator 가능) 를 chunking -> 임베딩 -> _bulk 색인
+        '''
+        self._reset_stats()
+
+        return self.index_sources(self.get_sources(self.get_chunks(documents)))
+
+    def run_jsonl(self, path: str, text_fields: List[str]=["text"], id_field: Optional[str]=None) -> Dict[str, Any]:
+
+        return self.run(self.load_jsonl(path, text_fields=text_fields, id_field=id_field))
+
+    #################################################################
+    # Incremental sync
+    #################################################################
+
+    @staticmethod
+    def get_content_hash(text: str, model_id: str) -> str:
+
+        return hashlib.sha1(f"{model_id}\x00{text}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _get_sync_documents(documents: Iterable[Document]) -> Iterator[Document]:
+        '''
+        metadata["id"] 가 없는 문서는 source + page (없으면 page_content) 의 sha1 을 id 로 사용
+        '''
+        for document in documents:
+            if document.metadata.get("id", None) is None:
+                source = document.metadata.get("source", None)
+                key = f'{source}\x00{document.metadata.get("page", "")}' if source is not None else document.page_content
+                metadata = {**document.metadata, "id": hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]}
+                document = Document(page_content=document.page_content, metadata=metadata)
+            yield document
+
+    def load_manifest(self, manifest_path: Optional[str]=None) -> Dict[str, Optional[str]]:
+        '''
+        {chunk id: content_hash}. manifest 파일이 없으면 index 의 metadata.content_hash 를 scan
+        (content_hash 가 없는 기존 chunk 는 None -> 다시 색인)
+        '''
+        if manifest_path is not None and os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("index_name", None) == self.index_name:
+                return manifest["chunks"]
+            print(f'Manifest {manifest_path} is for index {manifest.get("index_name", None)}, reading content_hash from {self.index_name}')
+
+        if not self.os_client.indices.exists(self.index_name):
+            return {}
+
+        hits = scan(
+            self.os_client,
+            index=self.index_name,
+            query={"_source": ["metadata.content_hash"], "query": {"match_all": {}}},
+            size=5000
+        )
+
+        return {hit["_id"]: hit.get("_source", {}).get("metadata", {}).get("content_hash", None) for hit in hits}
+
+    def save_manifest(self, manifest_path: str, chunks: Dict[str, Optional[str]], model_id: str):
+
+        manifest = {
+            "index_name": self.index_name,
+            "model_id": model_id,
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "chunks": chunks,
+        }
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, manifest_path) # 중간에 실패해도 이전 manifest 유지
+
+    def _get_reusable_vectors(self, chunks, old_manifest):
+        '''
+        다른 id 로 옮겨진 chunk 의 {새 id: index 에 있는 기존 벡터}.
+        색인으로 기존 id 가 덮어써지기 전에 mget (bulk_batch_size 씩) 으로 읽어 둠
+        '''
+        moved_ids = {content_hash: chunk_id for chunk_id, content_hash in old_manifest.items() if content_hash is not None}
+        old_ids = {
+            chunk.metadata["id"]: moved_ids[chunk.metadata["content_hash"]]
+            for chunk in chunks if self._needs_vector(chunk) and chunk.metadata["content_hash"] in moved_ids
+        }
+        unique_old_ids = list(set(old_ids.values()))
+
+        vectors = {}
+        for start in range(0, len(unique_old_ids), self.bulk_batch_size):
+            response = opensearch_utils.get_documents_by_ids(
+                self.os_client,
+                unique_old_ids[start:start+self.bulk_batch_size],
+                self.index_name,
+                source_includes=[self.vector_field]
+            )
+            vectors.update({
+                res["_id"]: res["_source"][self.vector_field]
+                for res in response["docs"] if res.get("found", False) and self.vector_field in res.get("_source", {})
+            })
+
+        reused_vectors = {chunk_id: vectors[old_id] for chunk_id, old_id in old_ids.items() if old_id in vectors}
+        self.stats["reused_vectors"] += len(reused_vectors)
+
+        return reused_vectors
+
+    def delete_ids(self, ids: List[str]) -> int:
+        '''
+        _bulk delete (bulk_batch_size 씩)
+        '''
+        deleted = 0
+        for start in range(0, len(ids), self.bulk_batch_size):
+            batch = [
+                (json.dumps({"delete": {"_index": self.index_name, "_id": doc_id}}),)
+                for doc_id in ids[start:start+self.bulk_batch_size]
+            ]
+            batch_deleted, errors, retries = self._send_bulk(batch)
+            deleted += batch_deleted
+            self.stats["errors"] += len(errors)
+            self.stats["retries"] += retries
+            self.stats["bulk_requests"] += 1
+            self.errors.extend(errors[:max(0, 100-len(self.errors))])
+            self.failed_ids.update(error.get("_id", None) for error in errors)
+        self.stats["deleted"] += deleted
+
+        return deleted
+
+    def sync(self, documents: Iterable[Document], manifest_path: Optional[str]=None, delete_missing: bool=True) -> Dict[str, Any]:
+        '''
+        documents (전체 corpus) 와 index 를 증분 동기화: 바뀐 chunk 만 임베딩 / 색인하고 없어진 chunk 는 삭제.
+        manifest_path 가 없으면 index 의 metadata.content_hash 로 비교
+        '''
+        self._reset_stats()
+        model_id = CachedEmbeddings.get_model_id(self.llm_emb) # ProjectedEmbeddings 는 변환 version 포함
+        old_manifest = self.load_manifest(manifest_path)
+
+        # 1. chunking 과 hash 만 먼저 계산 (바뀐 chunk 만 메모리에 보관)
+        new_manifest, changed_chunks = {}, []
+        for chunk in self.get_chunks(self._get_sync_documents(documents)):
+            chunk_id = chunk.metadata["id"]
+            content_hash = self.get_content_hash(chunk.page_content, model_id)
+            chunk.metadata["content_hash"] = content_hash
+            new_manifest[chunk_id] = content_hash
+            if old_manifest.get(chunk_id, None) == content_hash:
+                self.stats["skipped"] += 1
+            else:
+                changed_chunks.append(chunk)
+        removed_ids = [chunk_id for chunk_id in old_manifest if chunk_id not in new_manifest] if delete_missing else []
+
+        self._reused_vectors = self._get_reusable_vectors(changed_chunks, old_manifest)
+
+        if self.verbose:
+            print(f'[{self.index_name}] sync: {len(changed_chunks)} new or changed, {self.stats["skipped"]} unchanged, {len(removed_ids)} removed')
+
+        # 2. 바뀐 chunk 색인 -> 3. 없어진 chunk 삭제 (재사용할 벡터를 먼저 읽은 뒤)
+        try:
+            if changed_chunks:
+                self.index_sources(self.get_sources(changed_chunks))
+            if removed_ids:
+                self.delete_ids(removed_ids)
+                self.os_client.indices.refresh(index=self.index_name)
+                opensearch_utils.notify_index_write(self.index_name)
+        finally:
+            self._reused_vectors = {}
+
+        if manifest_path is not None:
+            if None in self.failed_ids:
+                print(f"Manifest {manifest_path} not updated: some bulk requests failed without _id")
+            else:
+                # 실패한 chunk 는 이전 hash 로 남겨 다음 sync 에서 다시 시도
+                for chunk_id in self.failed_ids:
+                    if chunk_id in old_manifest:
+                        new_manifest[chunk_id] = old_manifest[chunk_id]
+                    else:
+                        new_manifest.pop(chunk_id, None)
+                self.save_manifest(manifest_path, new_manifest, model_id)
+
+        self._report_progress(force=True)
+
+        return self.stats
+
+    def sync_jsonl(self, path: str, text_fields: List[str]=["text"], id_field: Optional[str]=None, manifest_path: Optional[str]=None, delete_missing: bool=True) -> Dict[str, Any]:
+
+        return self.sync(self.load_jsonl(path, text_fields=text_fields, id_field=id_field), manifest_path=manifest_path, delete_missing=delete_missing)
+
+
+###########################################
+### Parent / child chunk ingestion
+###########################################
+
+# retriever_utils.get_parent_document_similar_docs / search_hybrid(parent_document=True) 가 기대하는 구조로 색인.
+# * parent: metadata.family_tree="parent", id="{문서 id}-p{순번}" (기본적으로 vector 없이 색인)
+# * child: metadata.family_tree="child", metadata.parent_id=parent id, id="{parent id}-c{순번}"
+# 문서에 metadata["id"] 가 없으면 source + page_content 의 sha1 로 id 를 만들어서 재색인해도 id 가 같음.
+# parent 와 child 는 같은 _bulk 스트림으로 한 번에 색인하고, parent -> child id 목록은 id_map 에 저장
+###########################################
+
+class ParentDocumentIngestionPipeline(BulkIngestionPipeline):
+
+    def __init__(self, os_client, index_name: str, llm_emb, parent_splitter=None, child_splitter=None, embed_parents: bool=False, **kwargs):
+
+        child_splitter = child_splitter or RecursiveCharacterTextSplitter(
+            chunk_size=512,
+            chunk_overlap=0,
+            separators=["\n\n", "\n", ".", " ", ""],
+            length_function=len,
+        )
+        super().__init__(os_client, index_name, llm_emb, text_splitter=child_splitter, **kwargs)
+
+        self.parent_splitter = parent_splitter or RecursiveCharacterTextSplitter(
+            chunk_size=4096,
+            chunk_overlap=0,
+            separators=["\n\n", "\n", ".", " ", ""],
+            length_function=len,
+        )
+        self.child_splitter = self.text_splitter
+        self.embed_parents = embed_parents
+        self.id_map = {}
+
+    @staticmethod
+    def get_document_id(document):
+
+        doc_id = document.metadata.get("id", None)
+        if doc_id is not None:
+            return str(doc_id)
+
+        key = f'{document.metadata.get("source", "")}\x00{document.page_content}'
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+
+    def _needs_vector(self, chunk):
+
+        return self.embed_parents or chunk.metadata.get("family_tree", None) != "parent"
+
+    def _needs_rerank_metadata(self, chunk):
+
+        # rerank 는 child 검색 결과에 대해 수행
+        return self.llm_text is not None and chunk.metadata.get("family_tree", None) != "parent"
+
+    def get_chunks(self, documents: Iterable[Document]) -> Iterator[Document]:
+
+        for document in documents:
+            self.stats["documents"] += 1
+            doc_id = self.get_document_id(document)
+
+            for p_idx, parent in enumerate(self.parent_splitter.split_documents([document])):
+                parent_id = f"{doc_id}-p{p_idx}"
+                parent.metadata["id"] = parent_id
+                parent.metadata["family_tree"] = "parent"
+
+                children = self.child_splitter.split_documents([
+                    Document(page_content=parent.page_content, metadata=dict(document.metadata))
+                ])
+                child_ids = []
+                for c_idx, child in enumerate(children):
+                    child_id = f"{parent_id}-c{c_idx}"
+                    child.metadata["id"] = child_id
+                    child.metadata["family_tree"] = "child"
+                    child.metadata["parent_id"] = parent_id
+                    child_ids.append(child_id)
+
+                self.id_map[parent_id] = child_ids
+                yield parent
+                yield from children
+
+    def run(self, documents: Iterable[Document]) -> Dict[str, Any]:
+
+        self.id_map = {}
+
+        return super().run(documents)
+
+    def save_id_map(self, path: str):
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.id_map, f, ensure_ascii=False)
+
+    @staticmethod
+    def load_id_map(path: str) -> Dict[str, List[str]]:
+
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
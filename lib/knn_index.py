@@ -0,0 +1,389 @@
+############################################################
+############################################################
+# k-NN index profile / HNSW 파라미터 tuning 관련 함수들
+############################################################
+############################################################
+
+import json
+import time
+import random
+
+import numpy as np
+from opensearchpy.exceptions import NotFoundError
+
+from local_utils.opensearch import opensearch_utils
+from local_utils.rag import embed_documents_batch
+
+###########################################
+### k-NN index profile
+###########################################
+
+# k-NN index 의 engine, space_type, HNSW 파라미터 (m, ef_construction, ef_search) 를 한 곳에서 관리하고
+# opensearch_utils.create_index 에 넘길 index_body 를 만듦.
+# * m, ef_construction: 그래프 구조 (index 생성 시 고정, 바꾸려면 reindex)
+# * ef_search: 검색 시 탐색 폭
+#   - nmslib: index setting (index.knn.algo_param.ef_search, 생성 후에도 변경 가능)
+#   - faiss / lucene: 쿼리의 method_parameters (OpenSearch 2.16+, retriever_utils.search_hybrid(..., ef_search=))
+# * binary_vector_field: 주어지면 sign-binarized 벡터 필드 (data_type: binary, faiss, hammingbit) 를 추가.
+#   검색은 이 필드의 HNSW 로 하고 vector_field 는 rescore (exact) 에만 쓰므로 vector_field 는 "index": false
+#   (graph 없이 doc values 만 저장) 로 매핑 -> float 벡터의 graph 생성 / native memory 비용 없음
+#   (BulkIngestionPipeline(binary_vector_field=...) 로 색인)
+# * to_dict / save / load 로 JSON 저장 -> 같은 설정으로 index 를 다시 만들 수 있음
+#
+# 사용법:
+#   profile = KNNIndexProfile.from_preset("balanced", dimension=768)
+#   profile.create_index(os_client, index_name)
+#   retriever_utils.search_hybrid(..., **profile.get_search_kwargs())
+###########################################
+
+class KNNIndexProfile():
+
+    # engine 별 지원 space_type
+    space_types = {
+        "nmslib": ["l2", "l1", "linf", "cosinesimil", "innerproduct"],
+        "faiss": ["l2", "innerproduct", "cosinesimil"],
+        "lucene": ["l2", "innerproduct", "cosinesimil"],
+    }
+
+    presets = {
+        "fast": {"m": 8, "ef_construction": 128, "ef_search": 64},
+        "balanced": {"m": 16, "ef_construction": 256, "ef_search": 128},
+        "accurate": {"m": 32, "ef_construction": 512, "ef_search": 256},
+    }
+
+    def __init__(self, dimension, engine="faiss", space_type="l2", m=16, ef_construction=256, ef_search=128, vector_field="vector_field", text_analyzer=None, binary_vector_field=None):
+
+        assert engine in self.space_types, f'Check your engine: {list(self.space_types)}'
+        assert space_type in self.space_types[engine], f'Check your space_type: {self.space_types[engine]}'
+        assert m >= 2 and ef_construction >= m and ef_search >= 1, "Check your m, ef_construction, ef_search"
+        assert binary_vector_field is None or dimension % 8 == 0, "Check your dimension: binary vectors need a multiple of 8"
+
+        self.dimension = dimension
+        self.engine = engine
+        self.space_type = space_type
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.vector_field = vector_field
+        self.text_analyzer = text_analyzer # text 필드 analyzer (예: "nori"), None 이면 기본값
+        self.binary_vector_field = binary_vector_field
+
+    @classmethod
+    def from_preset(cls, name, dimension, **kwargs):
+
+        assert name in cls.presets, f'Check your preset: {list(cls.presets)}'
+
+        return cls(dimension, **{**cls.presets[name], **kwargs})
+
+    def __repr__(self):
+
+        return f"KNNIndexProfile({self.to_dict()})"
+
+    def get_vector_mapping(self):
+
+        if self.binary_vector_field is not None:
+            # rescore (knn_score script) 에서 doc values 만 읽으므로 HNSW graph 를 만들지 않음
+            return {"type": "knn_vector", "dimension": self.dimension, "index": False}
+
+        return {
+            "type": "knn_vector",
+            "dimension": self.dimension,
+            "method": {
+                "name": "hnsw",
+                "engine": self.engine,
+                "space_type": self.space_type,
+                "parameters": {"m": self.m, "ef_construction": self.ef_construction},
+            }
+        }
+
+    def get_binary_vector_mapping(self):
+
+        return {
+            "type": "knn_vector",
+            "dimension": self.dimension, # bit 수
+            "data_type": "binary",
+            "method": {
+                "name": "hnsw",
+                "engine": "faiss",
+                "space_type": "hammingbit",
+                "parameters": {"m": self.m, "ef_construction": self.ef_construction},
+            }
+        }
+
+    def get_index_settings(self):
+
+        settings = {"index": {"knn": True}}
+        if self.engine == "nmslib":
+            settings["index"]["knn.algo_param.ef_search"] = self.ef_search
+
+        return settings
+
+    def get_index_body(self):
+        '''
+        opensearch_utils.create_index 의 index_body (text / metadata / vector_field)
+        '''
+        text_mapping = {"type": "text"}
+        if self.text_analyzer is not None:
+            text_mapping["analyzer"] = self.text_analyzer
+
+        properties = {
+            "text": text_mapping,
+            # rerank_segments (retriever_utils.get_rerank_metadata) 는 _source 에만 두고 색인하지 않음
+            "metadata": {"type": "object", "properties": {"rerank_segments": {"type": "object", "enabled": False}}},
+            self.vector_field: self.get_vector_mapping(),
+        }
+        if self.binary_vector_field is not None:
+            properties[self.binary_vector_field] = self.get_binary_vector_mapping()
+
+        return {
+            "settings": self.get_index_settings(),
+            "mappings": {"properties": properties}
+        }
+
+    def get_search_kwargs(self):
+        '''
+        retriever_utils.search_hybrid 에 넘길 ef_search (nmslib 은 index setting 이므로 없음) / binary_search 설정
+        '''
+        if self.binary_vector_field is not None:
+            return {"ef_search": self.ef_search, "binary_search": True, "binary_vector_field": self.binary_vector_field, "space_type": self.space_type}
+
+        return {} if self.engine == "nmslib" else {"ef_search": self.ef_search}
+
+    def create_index(self, os_client, index_name):
+
+        opensearch_utils.create_index(os_client, index_name, self.get_index_body())
+
+    def set_ef_search(self, os_client, index_name, ef_search):
+        '''
+        ef_search 변경 (nmslib 은 index setting 도 갱신, faiss / lucene 은 쿼리에서 사용)
+        '''
+        self.ef_search = ef_search
+        if self.engine == "nmslib":
+            os_client.indices.put_settings(index=index_name, body={"index": {"knn.algo_param.ef_search": ef_search}})
+
+    def get_memory_bytes(self, n_vectors):
+        '''
+        HNSW 그래프 메모리 추정치: 1.1 * (벡터 bytes + 8 * m) * n_vectors (binary 이면 벡터 bytes = dimension / 8)
+        '''
+        vector_bytes = self.dimension / 8 if self.binary_vector_field is not None else 4 * self.dimension
+
+        return int(1.1 * (vector_bytes + 8 * self.m) * n_vectors)
+
+    def to_dict(self):
+
+        return {
+            "dimension": self.dimension,
+            "engine": self.engine,
+            "space_type": self.space_type,
+            "m": self.m,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+            "vector_field": self.vector_field,
+            "text_analyzer": self.text_analyzer,
+            "binary_vector_field": self.binary_vector_field,
+        }
+
+    @classmethod
+    def from_dict(cls, profile):
+
+        return cls(**profile)
+
+    def save(self, path):
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+###########################################
+### Offline HNSW tuner
+###########################################
+
+# 실제 쿼리 샘플을 다시 실행해서 (m, ef_construction, ef_search) 조합별 recall@k 와 latency 를 측정하고
+# target_recall 을 만족하는 가장 저렴한 설정을 고름.
+# 1. (m, ef_construction) 마다 source index 를 임시 index 로 reindex (max_docs 로 문서 수 제한 가능)
+# 2. 임시 index 에서 exact search (script_score, knn_score) 로 정답 top-k 계산
+# 3. ef_search 마다 k-NN 검색 -> recall@k (정답과 겹치는 비율), latency (client 측 p50 / p95, 서버 took)
+#    (k 보다 작은 ef_search 는 k 로 올려서 측정: HNSW 는 ef_search 를 최소 k 로 사용)
+# 4. recall >= target_recall 인 설정 중 p95 latency, 메모리, ef_construction 순으로 가장 작은 것
+#    (만족하는 설정이 없으면 recall 이 가장 높은 것)
+# 임시 index 는 측정 후 삭제 (keep_indices=True 이면 유지).
+#
+# 사용법:
+#   tuner = KNNIndexTuner(os_client, index_name, base_profile=KNNIndexProfile(768, space_type="cosinesimil"))
+#   best_profile, results = tuner.tune(queries=sample_queries, llm_emb=llm_emb, k=10, target_recall=0.95)
+#   best_profile.save("knn_profile.json")
+###########################################
+
+class KNNIndexTuner():
+
+    def __init__(self, os_client, source_index, base_profile, m_grid=[8, 16, 32], ef_construction_grid=[128, 256], ef_search_grid=[32, 64, 128, 256, 512], max_docs=None, index_prefix=None, keep_indices=False):
+
+        # binary profile 의 vector_field 는 graph 가 없으므로 (rescore 전용) float HNSW 로 측정할 수 없음
+        assert base_profile.binary_vector_field is None, "Check your base_profile: binary profiles are not supported by the tuner"
+
+        self.os_client = os_client
+        self.source_index = source_index
+        self.base_profile = base_profile
+        self.m_grid = m_grid
+        self.ef_construction_grid = ef_construction_grid
+        self.ef_search_grid = ef_search_grid
+        self.max_docs = max_docs
+        self.index_prefix = index_prefix or f"{source_index}-knn-tune"
+        self.keep_indices = keep_indices
+
+    def get_query_vectors(self, queries=None, llm_emb=None, query_vectors=None, sample_size=200, seed=0):
+        '''
+        query_vectors 가 있으면 그대로, 아니면 queries 중 sample_size 개를 샘플링해서 임베딩
+        '''
+        if query_vectors is None:
+            assert queries and llm_emb is not None, "Check your queries and llm_emb"
+            queries = list(queries)
+            if len(queries) > sample_size:
+                queries = random.Random(seed).sample(queries, sample_size)
+            query_vectors = embed_documents_batch(llm_emb, queries)
+
+        return [np.asarray(vector, dtype=np.float32) for vector in query_vectors]
+
+    def _get_profile(self, m, ef_construction, ef_search):
+
+        return KNNIndexProfile.from_dict({**self.base_profile.to_dict(), "m": m, "ef_construction": ef_construction, "ef_search": ef_search})
+
+    def _build_index(self, profile, index_name):
+
+        if self.os_client.indices.exists(index_name):
+            opensearch_utils.delete_index(self.os_client, index_name)
+        profile.create_index(self.os_client, index_name)
+
+        body = {"source": {"index": self.source_index}, "dest": {"index": index_name}}
+        if self.max_docs is not None:
+            body["max_docs"] = self.max_docs
+        start = time.perf_counter()
+        self.os_client.reindex(body=body, wait_for_completion=True, request_timeout=60*60, refresh=True)
+        # segment 를 하나로 합쳐 운영 index 와 비슷한 그래프로 측정
+        self.os_client.indices.forcemerge(index=index_name, max_num_segments=1, request_timeout=60*60)
+        self.os_client.indices.refresh(index=index_name)
+
+        return time.perf_counter() - start
+
+    def _get_exact_ids(self, index_name, vector, k):
+        '''
+        exact search (모든 문서와 거리 계산) 의 top-k _id
+        '''
+        query = {
+            "size": k,
+            "_source": False,
+            "query": {
+                "script_score": {
+                    "query": {"match_all": {}},
+                    "script": {
+                        "source": "knn_score",
+                        "lang": "knn",
+                        "params": {
+                            "field": self.base_profile.vector_field,
+                            "query_value": vector,
+                            "space_type": self.base_profile.space_type,
+                        }
+                    }
+                }
+            }
+        }
+        response = self.os_client.search(body=query, index=index_name, request_timeout=60)
+
+        return [hit["_id"] for hit in response["hits"]["hits"]]
+
+    def _get_knn_query(self, profile, vector, k):
+
+        knn = {"vector": vector, "k": k}
+        if profile.engine != "nmslib":
+            knn["method_parameters"] = {"ef_search": profile.ef_search}
+
+        return {"size": k, "_source": False, "query": {"knn": {profile.vector_field: knn}}}
+
+    def _measure(self, profile, index_name, query_vectors, exact_ids, k, warmup=5):
+
+        for vector in query_vectors[:warmup]:
+            self.os_client.search(body=self._get_knn_query(profile, vector, k), index=index_name)
+
+        recalls, latencies, tooks = [], [], []
+        for vector, truth in zip(query_vectors, exact_ids):
+            start = time.perf_counter()
+            response = self.os_client.search(body=self._get_knn_query(profile, vector, k), index=index_name)
+            latencies.append((time.perf_counter() - start) * 1000)
+            tooks.append(response.get("took", 0))
+            ids = {hit["_id"] for hit in response["hits"]["hits"]}
+            recalls.append(len(ids & set(truth)) / max(len(truth), 1))
+
+        return {
+            "recall": float(np.mean(recalls)),
+            "latency_p50_ms": float(np.percentile(latencies, 50)),
+            "latency_p95_ms": float(np.percentile(latencies, 95)),
+            "took_p50_ms": float(np.percentile(tooks, 50)),
+        }
+
+    def tune(self, queries=None, llm_emb=None, query_vectors=None, k=10, target_recall=0.95, sample_size=200, seed=0, verbose=True):
+        '''
+        -> (가장 저렴한 KNNIndexProfile, 조합별 측정 결과 리스트)
+        '''
+        query_vectors = self.get_query_vectors(queries=queries, llm_emb=llm_emb, query_vectors=query_vectors, sample_size=sample_size, seed=seed)
+        n_docs = opensearch_utils.get_count(self.os_client, self.source_index)["count"]
+        if self.max_docs is not None:
+            n_docs = min(n_docs, self.max_docs)
+
+        ef_search_grid = sorted({max(ef_search, k) for ef_search in self.ef_search_grid})
+        results = []
+        for m in self.m_grid:
+            for ef_construction in self.ef_construction_grid:
+                if ef_construction < m:
+                    continue
+                index_name = f"{self.index_prefix}-m{m}-efc{ef_construction}"
+                profile = self._get_profile(m, ef_construction, ef_search_grid[0])
+                try:
+                    build_sec = self._build_index(profile, index_name)
+                    exact_ids = [self._get_exact_ids(index_name, vector, k) for vector in query_vectors]
+                    for ef_search in ef_search_grid:
+                        profile.set_ef_search(self.os_client, index_name, ef_search)
+                        result = {
+                            "m": m,
+                            "ef_construction": ef_construction,
+                            "ef_search": ef_search,
+                            "build_sec": build_sec,
+                            "memory_mb": profile.get_memory_bytes(n_docs) / 2**20,
+                            **self._measure(profile, index_name, query_vectors, exact_ids, k),
+                        }
+                        results.append(result)
+                        if verbose:
+                            print(f'm={m:>3}, ef_construction={ef_construction:>4}, ef_search={ef_search:>4}: recall@{k} {result["recall"]:.4f}, p50 {result["latency_p50_ms"]:.1f} ms, p95 {result["latency_p95_ms"]:.1f} ms, memory {result["memory_mb"]:.1f} MB')
+                finally:
+                    if not self.keep_indices:
+                        try:
+                            opensearch_utils.delete_index(self.os_client, index_name)
+                        except NotFoundError:
+                            pass
+
+        best = self.select(results, target_recall=target_recall)
+        best_profile = self._get_profile(best["m"], best["ef_construction"], best["ef_search"])
+        if verbose:
+            met = "met" if best["recall"] >= target_recall else "NOT met (highest recall)"
+            print(f'===== Best (target recall@{k} {target_recall}: {met}) =====')
+            print(best_profile)
+
+        return best_profile, results
+
+    @classmethod
+    def select(cls, results, target_recall=0.95):
+        '''
+        recall >= target_recall 중 (p95 latency, memory, ef_construction) 이 가장 작은 결과
+        '''
+        if not results:
+            raise ValueError("No tuning results to select from: check m_grid / ef_construction_grid (ef_construction >= m) and ef_search_grid")
+
+        candidates = [result for result in results if result["recall"] >= target_recall]
+        if not candidates:
+            return max(results, key=lambda result: (result["recall"], -result["latency_p95_ms"]))
+
+        return min(candidates, key=lambda result: (result["latency_p95_ms"], result["memory_mb"], result["ef_construction"]))
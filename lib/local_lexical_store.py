@@ -0,0 +1,346 @@
+############################################################
+############################################################
+# Local (in-process) lexical store 관련 함수들
+############################################################
+############################################################
+
+import os
+import re
+import json
+import math
+import unicodedata
+from array import array
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain.schema import Document
+
+from local_utils.fusion import fusion_utils
+from local_utils.local_vector_store import MetadataColumns, TextStore
+
+try:
+    from kiwipiepy import Kiwi
+except ImportError:
+    Kiwi = None
+
+###########################################
+### Korean tokenizers
+###########################################
+
+# tokenizer 는 str -> List[str] 인 callable 이면 무엇이든 사용 가능.
+# * NgramTokenizer: 한글 구간은 문자 n-gram, 영문/숫자는 단어 단위 (추가 의존성 없음)
+# * MorphemeTokenizer: kiwipiepy 형태소 분석 + nori 기본 stoptags 와 비슷한 품사 제거
+###########################################
+
+class NgramTokenizer():
+
+    _token_pattern = re.compile(r"[가-힣]+|[a-z0-9]+")
+
+    def __init__(self, ngram_range=(2, 2)):
+
+        self.ngram_range = ngram_range
+
+    def __call__(self, text: str) -> List[str]:
+
+        text = unicodedata.normalize("NFKC", text).lower()
+        min_n, max_n = self.ngram_range
+
+        tokens = []
+        for token in self._token_pattern.findall(text):
+            if not ("가" <= token[0] <= "힣"):
+                tokens.append(token)
+                continue
+            if len(token) < min_n:
+                tokens.append(token)
+                continue
+            for n in range(min_n, max_n+1):
+                tokens.extend(token[i:i+n] for i in range(len(token)-n+1))
+
+        return tokens
+
+class MorphemeTokenizer():
+
+    # nori_part_of_speech 기본 stoptags 에 대응하는 (Sejong) 품사 prefix
+    stop_tags = ("E", "J", "IC", "MAG", "MAJ", "MM", "S", "XP", "XS", "UN", "NA", "W")
+
+    def __init__(self, stop_tags=None):
+
+        assert Kiwi is not None, "kiwipiepy is required for MorphemeTokenizer (or use NgramTokenizer)"
+
+        self.kiwi = Kiwi()
+        if stop_tags is not None:
+            self.stop_tags = tuple(stop_tags)
+
+    def __call__(self, text: str) -> List[str]:
+
+        text = unicodedata.normalize("NFKC", text)
+
+        return [
+            token.form.lower() for token in self.kiwi.tokenize(text)
+            if not token.tag.startswith(self.stop_tags)
+        ]
+
+def get_korean_tokenizer(tokenizer_type="auto"):
+    '''
+    "morpheme", "ngram", "auto" (kiwipiepy 가 있으면 morpheme, 없으면 ngram)
+    '''
+    if tokenizer_type == "auto":
+        tokenizer_type = "morpheme" if Kiwi is not None else "ngram"
+    if tokenizer_type == "morpheme":
+        return MorphemeTokenizer()
+
+    return NgramTokenizer()
+
+###########################################
+### Local lexical store (inverted index + BM25)
+###########################################
+
+# retriever_utils.get_lexical_similar_docs 와 같은 계약 ((Document, normalized_score) 리스트) 을 갖는
+# in-process lexical search backend. search_hybrid(lexical_store=...) 로 OpenSearch match query 대신 사용.
+#
+# 매개변수 (Parameters):
+# * tokenizer: str -> List[str]. 색인과 검색에 같은 tokenizer 를 사용해야 함
+#   (save 시 NgramTokenizer / MorphemeTokenizer 여부만 저장하므로 custom tokenizer 는 load 때 다시 지정)
+# * k1, b: BM25 파라미터 (OpenSearch 기본값과 동일)
+# * name: store 이름 (RetrievalResultCache 의 key / invalidation 단위, None 이면 객체마다 고유한 이름)
+#
+# 검색 방식은 opensearch_utils.get_query(search_type="lexical") 의 match query (operator "or") 와 동일:
+# * score = sum(idf * tf / (tf + k1 * (1 - b + b * dl / avgdl)))  (Lucene BM25)
+# * minimum_should_match (%): floor(query term 수 * % / 100) 개 이상의 term 이 있는 문서만 반환
+# * filter: term / terms / bool 필터 (MetadataColumns)
+###########################################
+
+class LocalLexicalStore():
+
+    def __init__(self, tokenizer=None, k1: float=1.2, b: float=0.75, name: Optional[str]=None):
+
+        self.name = name if name is not None else f"{type(self).__name__}-{id(self):x}"
+        self.tokenizer = tokenizer if tokenizer is not None else get_korean_tokenizer()
+        self.k1 = k1
+        self.b = b
+
+        self.ids = []
+        self._id_to_row = {}
+        self.texts = TextStore()
+        self.metadata = MetadataColumns()
+
+        self.term_to_idx = {}
+        self._postings = [] # term idx -> (array('i') rows, array('i') tfs)
+        self._doc_lengths = array("i")
+        self._csr = None # 검색용 (offsets, rows, tfs, doc_lengths), add 때마다 무효화
+
+    def __len__(self):
+
+        return len(self.ids)
+
+    def add(self, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]]):
+        '''
+        문서 추가. 이미 있는 id 는 지원하지 않음 (새 store 로 다시 빌드)
+        '''
+        assert len(ids) == len(texts) == len(metadatas), "Check your ids, texts, metadatas"
+
+        for doc_id, text, metadata in zip(ids, texts, metadatas):
+            assert doc_id not in self._id_to_row, f"Duplicated id: {doc_id}"
+
+            row = len(self.ids)
+            tokens = self.tokenizer(text)
+            term_freqs = {}
+            for token in tokens:
+                term_freqs[token] = term_freqs.get(token, 0) + 1
+            for term, tf in term_freqs.items():
+                idx = self.term_to_idx.get(term, None)
+                if idx is None:
+                    idx = self.term_to_idx[term] = len(self._postings)
+                    self._postings.append((array("i"), array("i")))
+                self._postings[idx][0].append(row)
+                self._postings[idx][1].append(tf)
+
+            self._id_to_row[doc_id] = row
+            self.ids.append(doc_id)
+            self.texts.append(text)
+            self.metadata.append(metadata)
+            self._doc_lengths.append(len(tokens))
+
+        self._csr = None
+        self._notify_write()
+
+    def _notify_write(self):
+        '''
+        색인 변경을 index 쓰기 hook 에 알려 이 store 를 쓴 캐시 결과를 제거
+        '''
+        from local_utils.opensearch import opensearch_utils
+
+        opensearch_utils.notify_index_write(self.name)
+
+    def add_sources(self, sources):
+        '''
+        BulkIngestionPipeline.get_sources() 의 (doc_id, _source) 를 그대로 추가 (vector 는 무시)
+        '''
+        ids, texts, metadatas = [], [], []
+        for doc_id, source in sources:
+            ids.append(doc_id if doc_id is not None else str(len(self.ids) + len(ids)))
+            texts.append(source["text"])
+            metadatas.append(source["metadata"])
+        if ids:
+            self.add(ids, texts, metadatas)
+
+    def _get_csr(self):
+        '''
+        postings 를 하나의 (offsets, rows, tfs) 배열로 합침
+        '''
+        if self._csr is None:
+            lengths = np.asarray([len(rows) for rows, _ in self._postings], dtype=np.int64)
+            offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(lengths)
+            rows = np.frombuffer(b"".join(rows.tobytes() for rows, _ in self._postings), dtype=np.int32)
+            tfs = np.frombuffer(b"".join(tfs.tobytes() for _, tfs in self._postings), dtype=np.int32)
+            self._csr = (offsets, rows, tfs, np.array(self._doc_lengths, dtype=np.int32))
+
+        return self._csr
+
+    def _get_query_terms(self, query):
+
+        terms = []
+        for token in self.tokenizer(query):
+            if token not in terms:
+                terms.append(token)
+
+        return terms
+
+    def get_scores(self, query: str, minimum_should_match=0, boolean_filter=None):
+        '''
+        전체 문서에 대한 BM25 score 배열과, 조건(minimum_should_match, filter)을 만족하는 row mask
+        '''
+        n_docs = len(self.ids)
+        terms = self._get_query_terms(query)
+        offsets, rows, tfs, doc_lengths = self._get_csr()
+
+        scores = np.zeros(n_docs, dtype=np.float64)
+        matched = np.zeros(n_docs, dtype=np.int64)
+        if n_docs == 0 or not terms:
+            return scores, np.zeros(n_docs, dtype=bool)
+
+        avgdl = max(float(doc_lengths.mean()), 1e-9)
+        norms = self.k1 * (1 - self.b + self.b * doc_lengths / avgdl)
+
+        for term in terms:
+            idx = self.term_to_idx.get(term, None)
+            if idx is None:
+                continue
+            term_rows = rows[offsets[idx]:offsets[idx+1]]
+            term_tfs = tfs[offsets[idx]:offsets[idx+1]].astype(np.float64)
+            df = len(term_rows)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            scores[term_rows] += idf * term_tfs / (term_tfs + norms[term_rows])
+            matched[term_rows] += 1
+
+        required = max(1, math.floor(len(terms) * float(str(minimum_should_match).rstrip("%")) / 100))
+        mask = matched >= required
+        filter_mask = self.metadata.get_filter_mask(boolean_filter)
+        if filter_mask is not None:
+            mask &= filter_mask
+
+        return scores, mask
+
+    def search(self, query: str, k: int=5, minimum_should_match=0, boolean_filter=None):
+        '''
+        (row 배열, score 배열), score 내림차순
+        '''
+        scores, mask = self.get_scores(query, minimum_should_match=minimum_should_match, boolean_filter=boolean_filter)
+        candidates = np.flatnonzero(mask)
+        top = fusion_utils.get_top_k(scores[candidates], k)
+
+        return candidates[top], scores[candidates][top]
+
+    def get_document(self, row: int) -> Document:
+
+        metadata = self.metadata.get(row)
+        metadata["id"] = self.ids[row]
+
+        return Document(page_content=self.texts[row], metadata=metadata)
+
+    def get_documents_by_ids(self, ids: List[str]) -> Dict[str, Document]:
+        '''
+        {id: Document} (store 에 있는 id 만)
+        '''
+        return {doc_id: self.get_document(self._id_to_row[doc_id]) for doc_id in ids if doc_id in self._id_to_row}
+
+    def get_lexical_similar_docs(self, **kwargs):
+        '''
+        retriever_utils.get_lexical_similar_docs 와 같은 kwargs / 반환값 (os_client, index_name 불필요)
+        '''
+        assert "query" in kwargs, "Check your query"
+        assert "k" in kwargs, "Check your k"
+
+        rows, scores = self.search(
+            kwargs["query"],
+            k=kwargs["k"],
+            minimum_should_match=kwargs.get("minimum_should_match", 0),
+            boolean_filter=kwargs.get("filter", [])
+        )
+        if len(rows) == 0:
+            return []
+
+        if kwargs.get("hybrid", False):
+            scores = scores / (scores[0] or 1.0)
+            return [(self.get_document(row), float(score)) for row, score in zip(rows, scores)]
+
+        return [self.get_document(row) for row in rows]
+
+    def save(self, path: str):
+
+        os.makedirs(path, exist_ok=True)
+        offsets, rows, tfs, doc_lengths = self._get_csr()
+        terms = [None] * len(self.term_to_idx)
+        for term, idx in self.term_to_idx.items():
+            terms[idx] = term
+
+        tokenizer_info = {"type": "custom"}
+        if isinstance(self.tokenizer, NgramTokenizer):
+            tokenizer_info = {"type": "ngram", "ngram_range": list(self.tokenizer.ngram_range)}
+        elif isinstance(self.tokenizer, MorphemeTokenizer):
+            tokenizer_info = {"type": "morpheme", "stop_tags": list(self.tokenizer.stop_tags)}
+
+        with open(os.path.join(path, "lexical.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {"k1": self.k1, "b": self.b, "tokenizer": tokenizer_info, "ids": self.ids, "terms": terms},
+                f, ensure_ascii=False
+            )
+        np.savez(os.path.join(path, "postings.npz"), offsets=offsets, rows=rows, tfs=tfs, doc_lengths=doc_lengths)
+        self.texts.save(path)
+        self.metadata.save(path)
+
+    @classmethod
+    def load(cls, path: str, tokenizer=None, mmap: bool=True, name: Optional[str]=None):
+        '''
+        tokenizer 가 None 이면 저장된 tokenizer 설정으로 생성 (custom tokenizer 는 직접 지정)
+        '''
+        with open(os.path.join(path, "lexical.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+
+        if tokenizer is None:
+            tokenizer_info = info["tokenizer"]
+            assert tokenizer_info["type"] != "custom", "Check your tokenizer (index was built with a custom tokenizer)"
+            if tokenizer_info["type"] == "ngram":
+                tokenizer = NgramTokenizer(ngram_range=tuple(tokenizer_info["ngram_range"]))
+            else:
+                tokenizer = MorphemeTokenizer(stop_tags=tokenizer_info["stop_tags"])
+
+        store = cls(tokenizer=tokenizer, k1=info["k1"], b=info["b"], name=name)
+        store.ids = info["ids"]
+        store._id_to_row = {doc_id: row for row, doc_id in enumerate(store.ids)}
+        store.term_to_idx = {term: idx for idx, term in enumerate(info["terms"])}
+
+        postings = np.load(os.path.join(path, "postings.npz"))
+        offsets, rows, tfs = postings["offsets"], postings["rows"], postings["tfs"]
+        store._doc_lengths = array("i", postings["doc_lengths"].astype(np.int32).tobytes())
+        store._postings = [
+            (array("i", rows[offsets[idx]:offsets[idx+1]].tobytes()), array("i", tfs[offsets[idx]:offsets[idx+1]].tobytes()))
+            for idx in range(len(offsets) - 1)
+        ]
+        store._csr = (offsets, rows, tfs, postings["doc_lengths"].astype(np.int32))
+
+        store.texts = TextStore.load(path, mmap=mmap)
+        store.metadata = MetadataColumns.load(path)
+
+        return store
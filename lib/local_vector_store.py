@@ -0,0 +1,578 @@
+############################################################
+############################################################
+# Local (in-process) vector store 관련 함수들
+############################################################
+############################################################
+
+import os
+import json
+from array import array
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain.schema import Document
+
+from local_utils.quantization import binary_quantization_utils
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+###########################################
+### Metadata columns (compact metadata + term filter)
+###########################################
+
+# metadata 를 문서별 dict 대신 필드별 (int32 code 배열 + 값 사전) 으로 저장.
+# boolean_filter 의 term / terms / bool 필터를 code 비교(numpy mask)로 평가
+###########################################
+
+class MetadataColumns():
+
+    def __init__(self):
+
+        self.n_rows = 0
+        self.codes = {}  # field -> array('i'), 값이 없으면 -1
+        self.vocab = {}  # field -> [value, ...]
+        self._value_to_code = {}  # field -> {value: code}
+
+    @staticmethod
+    def _to_hashable(value):
+
+        if isinstance(value, list):
+            return tuple(MetadataColumns._to_hashable(v) for v in value)
+        if isinstance(value, dict):
+            return ("__dict__", json.dumps(value, sort_keys=True, ensure_ascii=False))
+        return value
+
+    @staticmethod
+    def _from_hashable(value):
+
+        if isinstance(value, tuple):
+            if len(value) == 2 and value[0] == "__dict__":
+                return json.loads(value[1])
+            return [MetadataColumns._from_hashable(v) for v in value]
+        return value
+
+    def append(self, metadata: Dict[str, Any]):
+
+        for field, value in metadata.items():
+            if field not in self.codes:
+                self.codes[field] = array("i", [-1]) * self.n_rows
+                self.vocab[field] = []
+                self._value_to_code[field] = {}
+            value = self._to_hashable(value)
+            code = self._value_to_code[field].get(value, None)
+            if code is None:
+                code = self._value_to_code[field][value] = len(self.vocab[field])
+                self.vocab[field].append(value)
+            self.codes[field].append(code)
+
+        self.n_rows += 1
+        for field, codes in self.codes.items():
+            if len(codes) < self.n_rows:
+                codes.append(-1)
+
+    def get(self, row: int) -> Dict[str, Any]:
+
+        metadata = {}
+        for field, codes in self.codes.items():
+            code = codes[row]
+            if code >= 0:
+                metadata[field] = self._from_hashable(self.vocab[field][code])
+
+        return metadata
+
+    @staticmethod
+    def _get_field(field):
+
+        if field.startswith("metadata."):
+            field = field[len("metadata."):]
+        if field.endswith(".keyword"):
+            field = field[:-len(".keyword")]
+
+        return field
+
+    def _get_term_mask(self, field, values):
+
+        field = self._get_field(field)
+        if field not in self.codes:
+            return np.zeros(self.n_rows, dtype=bool)
+
+        values = [self._to_hashable(value) for value in values]
+        matched_codes = [
+            code for code, vocab_value in enumerate(self.vocab[field])
+            if vocab_value in values or (isinstance(vocab_value, tuple) and any(value in vocab_value for value in values))
+        ]
+        codes = np.frombuffer(self.codes[field], dtype=np.int32)
+
+        return np.isin(codes, matched_codes)
+
+    def get_filter_mask(self, boolean_filter) -> Optional[np.ndarray]:
+        '''
+        boolean_filter (filter 절 리스트 또는 {"bool": {...}}) -> row mask. 필터가 없으면 None
+        지원: term, terms, match_all, bool(filter / must / should / must_not)
+        '''
+        if not boolean_filter:
+            return None
+        if isinstance(boolean_filter, dict):
+            boolean_filter = [boolean_filter]
+
+        mask = np.ones(self.n_rows, dtype=bool)
+        for clause in boolean_filter:
+            mask &= self._get_clause_mask(clause)
+
+        return mask
+
+    def _get_clause_mask(self, clause):
+
+        (clause_type, body), = clause.items()
+
+        if clause_type == "term":
+            (field, value), = body.items()
+            if isinstance(value, dict):
+                value = value["value"]
+            return self._get_term_mask(field, [value])
+        if clause_type == "terms":
+            (field, values), = body.items()
+            return self._get_term_mask(field, values)
+        if clause_type == "match_all":
+            return np.ones(self.n_rows, dtype=bool)
+        if clause_type == "bool":
+            mask = np.ones(self.n_rows, dtype=bool)
+            for sub_clause in body.get("filter", []) + body.get("must", []):
+                mask &= self._get_clause_mask(sub_clause)
+            for sub_clause in body.get("must_not", []):
+                mask &= ~self._get_clause_mask(sub_clause)
+            if body.get("should", []):
+                should_mask = np.zeros(self.n_rows, dtype=bool)
+                for sub_clause in body["should"]:
+                    should_mask |= self._get_clause_mask(sub_clause)
+                mask &= should_mask
+            return mask
+
+        raise ValueError(f"Unsupported filter for local store: {clause_type}")
+
+    def save(self, path: str):
+
+        with open(os.path.join(path, "metadata_vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {"n_rows": self.n_rows, "fields": list(self.codes.keys()), "vocab": self.vocab},
+                f, ensure_ascii=False
+            )
+        if self.codes:
+            np.save(
+                os.path.join(path, "metadata_codes.npy"),
+                np.stack([np.frombuffer(codes, dtype=np.int32) for codes in self.codes.values()])
+            )
+
+    @classmethod
+    def load(cls, path: str):
+
+        columns = cls()
+        with open(os.path.join(path, "metadata_vocab.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+
+        columns.n_rows = info["n_rows"]
+        if info["fields"]:
+            codes = np.load(os.path.join(path, "metadata_codes.npy"))
+            for field, field_codes in zip(info["fields"], codes):
+                columns.codes[field] = array("i", field_codes.astype(np.int32).tobytes())
+                columns.vocab[field] = [cls._to_hashable(value) for value in info["vocab"][field]]
+                columns._value_to_code[field] = {value: code for code, value in enumerate(columns.vocab[field])}
+
+        return columns
+
+###########################################
+### Text store
+###########################################
+
+class TextStore():
+    '''
+    텍스트를 하나의 utf-8 blob + offset 배열로 저장 (load 시 mmap)
+    '''
+    def __init__(self):
+
+        self._texts = []
+        self._blob = None
+        self._offsets = None
+
+    def __len__(self):
+
+        return len(self._texts) if self._blob is None else len(self._offsets) - 1
+
+    def _materialize(self):
+
+        if self._blob is not None:
+            self._texts = [self[row] for row in range(len(self))]
+            self._blob, self._offsets = None, None
+
+    def append(self, text: str):
+
+        self._materialize()
+        self._texts.append(text)
+
+    def __getitem__(self, row: int) -> str:
+
+        if self._blob is None:
+            return self._texts[row]
+
+        return bytes(self._blob[self._offsets[row]:self._offsets[row+1]]).decode("utf-8")
+
+    def save(self, path: str):
+
+        encoded = [self[row].encode("utf-8") for row in range(len(self))]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(text) for text in encoded])
+        with open(os.path.join(path, "texts.bin"), "wb") as f:
+            for text in encoded:
+                f.write(text)
+        np.save(os.path.join(path, "text_offsets.npy"), offsets)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool=True):
+
+        store = cls()
+        store._offsets = np.load(os.path.join(path, "text_offsets.npy"))
+        blob_path = os.path.join(path, "texts.bin")
+        if store._offsets[-1] == 0:
+            store._blob = np.zeros(0, dtype=np.uint8)
+        elif mmap:
+            store._blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        else:
+            store._blob = np.fromfile(blob_path, dtype=np.uint8)
+
+        return store
+
+###########################################
+### Local vector store (FAISS HNSW / IVF-PQ, NumPy flat / binary)
+###########################################
+
+# retriever_utils.get_semantic_similar_docs 와 같은 계약 ((Document, normalized_score) 리스트) 을 갖는
+# in-process semantic search backend. search_hybrid(vector_store=...) 로 OpenSearch k-NN 대신 사용.
+#
+# 매개변수 (Parameters):
+# * index_type: "flat", "binary" (numpy, faiss 불필요), "hnsw", "ivfpq" (faiss 필요)
+#   - binary: sign-binarized code (dimension / 8 bytes) 의 Hamming 거리로 k * binary_oversample 개 후보를 뽑고
+#     float 벡터로 rescore. load(mmap=True) 이면 float 벡터는 memory-map 으로 두고 code 만 메모리에 올림
+# * space_type: "cosinesimil", "l2", "innerproduct" (score 는 OpenSearch k-NN 과 같은 방식으로 변환)
+# * hnsw_m, ef_construction, ef_search: HNSW 파라미터
+# * nlist, nprobe, pq_m, pq_nbits: IVF-PQ 파라미터. 문서를 넣기 전에 train(sample_vectors) 로 학습
+#   (max(nlist, 2 ** pq_nbits) 개 이상 필요, faiss 권장은 39 * nlist 개 이상). train 하지 않으면 첫 add 의 벡터로 학습하며
+#   이후 add 는 다시 학습하지 않으므로 첫 batch 가 corpus 를 대표해야 함
+# * binary_oversample: binary 1단계 후보 수 배율
+# * name: store 이름 (RetrievalResultCache 의 key / invalidation 단위, None 이면 객체마다 고유한 이름)
+###########################################
+
+class LocalVectorStore():
+
+    index_types = ["flat", "binary", "hnsw", "ivfpq"]
+    space_types = ["cosinesimil", "l2", "innerproduct"]
+
+    def __init__(
+        self,
+        dimension: int,
+        index_type: str="hnsw",
+        space_type: str="cosinesimil",
+        hnsw_m: int=16,
+        ef_construction: int=128,
+        ef_search: int=64,
+        nlist: int=256,
+        nprobe: int=16,
+        pq_m: int=16,
+        pq_nbits: int=8,
+        binary_oversample: int=10,
+        name: Optional[str]=None,
+    ):
+
+        assert index_type in self.index_types, f'Check your index_type: {self.index_types}'
+        assert space_type in self.space_types, f'Check your space_type: {self.space_types}'
+        assert index_type in ["flat", "binary"] or faiss is not None, f'faiss-cpu is required for index_type="{index_type}"'
+
+        self.name = name if name is not None else f"{type(self).__name__}-{id(self):x}"
+        self.dimension = dimension
+        self.index_type = index_type
+        self.space_type = space_type
+        self.config = {
+            "hnsw_m": hnsw_m,
+            "ef_construction": ef_construction,
+            "ef_search": ef_search,
+            "nlist": nlist,
+            "nprobe": nprobe,
+            "pq_m": pq_m,
+            "pq_nbits": pq_nbits,
+            "binary_oversample": binary_oversample,
+        }
+
+        self.ids = []
+        self._id_to_row = {}
+        self.texts = TextStore()
+        self.metadata = MetadataColumns()
+        self._vectors = np.zeros((0, dimension), dtype=np.float32) # flat / binary 일 때만 사용
+        self._codes = np.zeros((0, (dimension + 7) // 8), dtype=np.uint8) # binary 일 때만 사용
+        self._index = self._create_index() if index_type not in ["flat", "binary"] else None
+
+    def __len__(self):
+
+        return len(self.ids)
+
+    def _create_index(self):
+
+        metric = faiss.METRIC_L2 if self.space_type == "l2" else faiss.METRIC_INNER_PRODUCT
+        if self.index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(self.dimension, self.config["hnsw_m"], metric)
+            index.hnsw.efConstruction = self.config["ef_construction"]
+            index.hnsw.efSearch = self.config["ef_search"]
+        else:
+            quantizer = faiss.IndexFlat(self.dimension, metric)
+            index = faiss.IndexIVFPQ(quantizer, self.dimension, self.config["nlist"], self.config["pq_m"], self.config["pq_nbits"], metric)
+            index.nprobe = self.config["nprobe"]
+            index.make_direct_map() # get_vectors (reconstruct) 용 id -> list 위치, 이후 add 때 함께 갱신
+
+        return index
+
+    def _prepare_vectors(self, vectors):
+
+        vectors = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension))
+        if self.space_type == "cosinesimil":
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            vectors = vectors / norms
+
+        return vectors
+
+    def add(self, ids: List[str], texts: List[str], metadatas: List[Dict[str, Any]], vectors):
+        '''
+        문서 추가. 이미 있는 id 는 지원하지 않음 (새 store 로 다시 빌드)
+        '''
+        assert len(ids) == len(texts) == len(metadatas) == len(vectors), "Check your ids, texts, metadatas, vectors"
+
+        vectors = self._prepare_vectors(vectors)
+        for doc_id in ids:
+            assert doc_id not in self._id_to_row, f"Duplicated id: {doc_id}"
+
+        if self._index is None:
+            self._vectors = np.concatenate([np.asarray(self._vectors), vectors])
+            if self.index_type == "binary":
+                self._codes = np.concatenate([self._codes, binary_quantization_utils.get_binary_codes(vectors)])
+        else:
+            if not self._index.is_trained:
+                self._train(vectors)
+            self._index.add(vectors)
+
+        for doc_id, text, metadata in zip(ids, texts, metadatas):
+            self._id_to_row[doc_id] = len(self.ids)
+            self.ids.append(doc_id)
+            self.texts.append(text)
+            self.metadata.append(metadata)
+
+        self._notify_write()
+
+    def train(self, vectors):
+        '''
+        ivfpq 의 coarse quantizer / PQ codebook 을 corpus 샘플로 학습 (문서를 add 하기 전에 한 번)
+        '''
+        assert self.index_type == "ivfpq", "Check your index_type: only ivfpq needs training"
+        assert len(self.ids) == 0, "Check your store: train before adding documents"
+
+        self._train(self._prepare_vectors(vectors))
+
+    def _train(self, vectors):
+
+        n_min = max(self.config["nlist"], 2 ** self.config["pq_nbits"])
+        assert len(vectors) >= n_min, f"Check your nlist / training vectors: ivfpq needs at least {n_min} training vectors (got {len(vectors)})"
+
+        self._index.train(vectors)
+
+    def _notify_write(self):
+        '''
+        opensearch_utils 의 index 쓰기 hook (RetrievalResultCache.invalidate) 에 store 이름으로 알림
+        '''
+        from local_utils.opensearch import opensearch_utils
+
+        opensearch_utils.notify_index_write(self.name)
+
+    def add_sources(self, sources, vector_field: str="vector_field"):
+        '''
+        BulkIngestionPipeline.get_sources() 의 (doc_id, _source) 를 그대로 추가
+        '''
+        ids, texts, metadatas, vectors = [], [], [], []
+        for doc_id, source in sources:
+            ids.append(doc_id if doc_id is not None else str(len(self.ids) + len(ids)))
+            texts.append(source["text"])
+            metadatas.append(source["metadata"])
+            vectors.append(source[vector_field])
+        if ids:
+            self.add(ids, texts, metadatas, vectors)
+
+    def _to_score(self, values):
+        '''
+        거리 / 내적 -> OpenSearch k-NN score
+        '''
+        if self.space_type == "l2":
+            return 1 / (1 + values)
+        if self.space_type == "cosinesimil":
+            return (1 + values) / 2
+        return np.where(values >= 0, values + 1, 1 / (1 - values))
+
+    def search_by_vector(self, vector, k: int=5, boolean_filter=None):
+        '''
+        (row 배열, score 배열). boolean_filter 는 검색 전에 적용 (pre-filter)
+        '''
+        query = self._prepare_vectors(vector)
+        mask = self.metadata.get_filter_mask(boolean_filter)
+        if len(self.ids) == 0 or (mask is not None and not mask.any()):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        if self._index is None:
+            candidates = None if mask is None else np.flatnonzero(mask)
+            if self.index_type == "binary":
+                candidates = self._get_binary_candidates(query, candidates, k * self.config["binary_oversample"])
+            vectors = np.asarray(self._vectors) if candidates is None else self._vectors[candidates]
+            if self.space_type == "l2":
+                values = ((vectors - query) ** 2).sum(axis=1)
+            else:
+                values = vectors @ query[0]
+            if candidates is None:
+                candidates = np.arange(len(values))
+            order = -values if self.space_type != "l2" else values
+            top = np.argsort(order, kind="stable")[:k] if k >= len(values) else np.argpartition(order, k-1)[:k]
+            top = top[np.argsort(order[top], kind="stable")]
+            rows, values = candidates[top], values[top]
+        else:
+            params = None
+            if mask is not None:
+                selector = faiss.IDSelectorBatch(np.flatnonzero(mask).astype(np.int64))
+                if self.index_type == "hnsw":
+                    params = faiss.SearchParametersHNSW(sel=selector, efSearch=self.config["ef_search"])
+                else:
+                    params = faiss.SearchParametersIVF(sel=selector, nprobe=self.config["nprobe"])
+            values, rows = self._index.search(query, k, params=params)
+            values, rows = values[0], rows[0]
+            valid = rows >= 0
+            rows, values = rows[valid], values[valid]
+
+        return rows, self._to_score(values).astype(np.float32)
+
+    def _get_binary_candidates(self, query, rows, n_candidates):
+        '''
+        rows (None 이면 전체) 중 query 와 Hamming 거리가 가까운 n_candidates 개의 row
+        '''
+        codes = self._codes if rows is None else self._codes[rows]
+        distances = binary_quantization_utils.get_hamming_distances(codes, binary_quantization_utils.get_binary_codes(query)[0])
+        if n_candidates < len(distances):
+            top = np.argpartition(distances, n_candidates-1)[:n_candidates]
+        else:
+            top = np.arange(len(distances))
+
+        return top if rows is None else rows[top]
+
+    def get_vectors(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        '''
+        {id: vector} (store 에 있는 id 만). cosinesimil 이면 정규화된 벡터, ivfpq 는 PQ 복원 근사값
+        '''
+        rows = {doc_id: self._id_to_row[doc_id] for doc_id in ids if doc_id in self._id_to_row}
+        if self._index is None:
+            return {doc_id: np.asarray(self._vectors[row]) for doc_id, row in rows.items()}
+
+        return {doc_id: self._index.reconstruct(int(row)) for doc_id, row in rows.items()}
+
+    def get_document(self, row: int) -> Document:
+
+        metadata = self.metadata.get(row)
+        metadata["id"] = self.ids[row]
+
+        return Document(page_content=self.texts[row], metadata=metadata)
+
+    def get_documents_by_ids(self, ids: List[str]) -> Dict[str, Document]:
+        '''
+        {id: Document} (store 에 있는 id 만)
+        '''
+        return {doc_id: self.get_document(self._id_to_row[doc_id]) for doc_id in ids if doc_id in self._id_to_row}
+
+    def similarity_search_by_vector(self, vector, k: int=5, boolean_filter=None, hybrid=False):
+
+        rows, scores = self.search_by_vector(vector, k=k, boolean_filter=boolean_filter)
+        if len(rows) == 0:
+            return []
+
+        if hybrid:
+            scores = scores / (scores[0] or 1.0)
+            return [(self.get_document(row), float(score)) for row, score in zip(rows, scores)]
+
+        return [self.get_document(row) for row in rows]
+
+    def get_semantic_similar_docs(self, **kwargs):
+        '''
+        retriever_utils.get_semantic_similar_docs 와 같은 kwargs / 반환값 (os_client, index_name 불필요)
+        '''
+        assert "query" in kwargs, "Check your query"
+        assert "k" in kwargs, "Check your k"
+
+        vector = kwargs.get("vector", None)
+        if vector is None:
+            vector = kwargs["llm_emb"].embed_query(kwargs["query"])
+
+        return self.similarity_search_by_vector(
+            vector,
+            k=kwargs["k"],
+            boolean_filter=kwargs.get("boolean_filter", []),
+            hybrid=kwargs.get("hybrid", False)
+        )
+
+    def save(self, path: str):
+
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "store.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "dimension": self.dimension,
+                    "index_type": self.index_type,
+                    "space_type": self.space_type,
+                    "config": self.config,
+                    "ids": self.ids,
+                },
+                f, ensure_ascii=False
+            )
+        if self._index is None:
+            np.save(os.path.join(path, "vectors.npy"), np.asarray(self._vectors))
+            if self.index_type == "binary":
+                np.save(os.path.join(path, "codes.npy"), self._codes)
+        else:
+            faiss.write_index(self._index, os.path.join(path, "index.faiss"))
+        self.texts.save(path)
+        self.metadata.save(path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool=True, name: Optional[str]=None):
+        '''
+        mmap=True 이면 벡터 / 텍스트를 memory-map 으로 읽음 (faiss 는 지원하는 index 만 mmap)
+        '''
+        with open(os.path.join(path, "store.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+
+        store = cls(info["dimension"], index_type=info["index_type"], space_type=info["space_type"], name=name, **info["config"])
+        store.ids = info["ids"]
+        store._id_to_row = {doc_id: row for row, doc_id in enumerate(store.ids)}
+
+        if store.index_type in ["flat", "binary"]:
+            store._vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)
+            if store.index_type == "binary":
+                store._codes = np.load(os.path.join(path, "codes.npy"))
+        else:
+            index_path = os.path.join(path, "index.faiss")
+            try:
+                store._index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0)
+            except RuntimeError:
+                store._index = faiss.read_index(index_path)
+            if store.index_type == "hnsw":
+                store._index.hnsw.efSearch = store.config["ef_search"]
+            else:
+                store._index.nprobe = store.config["nprobe"]
+                if store._index.direct_map.type == faiss.DirectMap.NoMap: # direct map 없이 저장된 index 는 load 때 한 번만 생성
+                    store._index.make_direct_map()
+
+        store.texts = TextStore.load(path, mmap=mmap)
+        store.metadata = MetadataColumns.load(path)
+
+        return store
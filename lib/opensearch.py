@@ -1,12 +1,55 @@
-import copy
+import os
+import json
+import hashlib
+import weakref
+import threading
 from typing import List, Optional, Tuple
-from opensearchpy import OpenSearch, RequestsHttpConnection, OpenSearchException
+from opensearchpy import OpenSearch, AsyncOpenSearch, RequestsHttpConnection, Urllib3HttpConnection, AIOHttpConnection, OpenSearchException
 from opensearchpy.exceptions import NotFoundError
 import streamlit as st
 import pandas as pd
 
+from local_utils.serializer import serializer_utils
+from local_utils.opensearch_client import LatencyAwareSelector, opensearch_client_utils
+
 
 class opensearch_utils():
+
+    # index 에 쓰기(문서 추가, index 생성/삭제)가 일어나면 호출되는 hook: hook(index_name)
+    # (예: RetrievalResultCache.invalidate)
+    # bound method 는 weakref.WeakMethod 로 보관하므로 close() 하지 않은 캐시도 GC 되고, 죽은 hook 은 notify 때 제거
+    index_write_hooks = []
+
+    @staticmethod
+    def _get_hook_ref(hook):
+
+        if hasattr(hook, "__self__") and hasattr(hook, "__func__"):
+            return weakref.WeakMethod(hook)
+
+        return lambda: hook # 함수 등은 그대로 보관
+
+    @classmethod
+    def register_index_write_hook(cls, hook):
+
+        if not any(ref() == hook for ref in cls.index_write_hooks):
+            cls.index_write_hooks.append(cls._get_hook_ref(hook))
+
+    @classmethod
+    def unregister_index_write_hook(cls, hook):
+
+        cls.index_write_hooks = [ref for ref in cls.index_write_hooks if ref() is not None and ref() != hook]
+
+    @classmethod
+    def notify_index_write(cls, index_name):
+
+        hooks = [ref() for ref in cls.index_write_hooks]
+        if any(hook is None for hook in hooks):
+            cls.index_write_hooks = [ref for ref, hook in zip(cls.index_write_hooks, hooks) if hook is not None]
+
+        for hook in hooks:
+            if hook is not None:
+                hook(index_name)
+
     @classmethod
     def check_opensearch_connection(cls, os_client: OpenSearch) -> bool:
         """
@@ -20,38 +63,187 @@ class opensearch_utils():
             print(f"Failed to connect to OpenSearch: {e}")
             return False
     
+    ###########################################
+    ### Client factory
+    ###########################################
+
+    # 모든 client 는 create_opensearch_client 로 생성하고, 기본적으로 프로세스 당 (설정별) 하나를 만들어
+    # 모든 retriever 가 공유 (fork 된 프로세스는 새로 생성). AsyncOpenSearch 는 async_retriever_utils 의
+    # event loop (run_sync) 에서 사용할 것.
+    # * hosts: "host", "https://host:443", {"host", "port"} 또는 그 리스트 (여러 node)
+    # * pool_maxsize: node 당 keep-alive connection 수 (동시 검색 수에 맞춤)
+    # * sniff: 시작 / 연결 실패 시 cluster node 목록을 다시 조회 (Amazon OpenSearch Service 는 지원하지 않음)
+    # * latency_aware: node 별 응답 시간 (EWMA) 을 기록해 빠른 node 를 우선 선택 (opensearch_client.py)
+    ###########################################
+
+    # connection pool 크기 기본값 (async_retriever_utils.concurrency_limits["search"] 와 같게)
+    default_pool_maxsize = 16
+    _clients = {}
+    _clients_lock = threading.Lock()
+
     @classmethod
-    def create_aws_opensearch_client(cls, region: str, host: str, http_auth: Tuple[str, str]) -> OpenSearch:
+    def _get_client_key(cls, **kwargs):
 
-        client = OpenSearch(
-            hosts=[
-                {'host': host.replace("https://", ""),
-                 'port': 443
-                }
-            ],
+        def freeze(value):
+            if isinstance(value, dict):
+                return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+            if isinstance(value, (list, tuple)):
+                return tuple(freeze(item) for item in value)
+            try:
+                hash(value)
+                return value
+            except TypeError:
+                return id(value)
+
+        return (os.getpid(), freeze(kwargs))
+
+    @classmethod
+    def create_opensearch_client(
+        cls,
+        hosts,
+        http_auth=None,
+        port: int=9200,
+        use_ssl: bool=False,
+        verify_certs: bool=False,
+        async_mode: bool=False,
+        connection_class=None,
+        pool_maxsize: Optional[int]=None,
+        sniff: bool=False,
+        latency_aware: bool=True,
+        serializer=None,
+        shared: bool=True,
+        **kwargs
+    ):
+        '''
+        OpenSearch (async_mode=True 이면 AsyncOpenSearch) client. shared=True 이면 같은 설정의 client 를 재사용
+        '''
+        config = dict(
+            hosts=opensearch_client_utils.get_hosts(hosts, port=port),
+            http_auth=http_auth,
+            use_ssl=use_ssl,
+            verify_certs=verify_certs,
+            async_mode=async_mode,
+            connection_class=connection_class,
+            pool_maxsize=pool_maxsize or cls.default_pool_maxsize,
+            sniff=sniff,
+            latency_aware=latency_aware,
+            serializer=serializer,
+            **kwargs
+        )
+        if not shared:
+            return cls._create_opensearch_client(**config)
+
+        key = cls._get_client_key(**config)
+        with cls._clients_lock:
+            client = cls._clients.get(key, None)
+            if client is None:
+                client = cls._clients[key] = cls._create_opensearch_client(**config)
+
+        return client
+
+    @classmethod
+    def _create_opensearch_client(cls, **kwargs):
+
+        async_mode, latency_aware = kwargs.pop("async_mode"), kwargs.pop("latency_aware")
+        pool_maxsize, sniff = kwargs.pop("pool_maxsize"), kwargs.pop("sniff")
+        connection_class = kwargs.pop("connection_class") or (AIOHttpConnection if async_mode else Urllib3HttpConnection)
+        kwargs.update(serializer_utils.get_client_kwargs(kwargs.pop("serializer")))
+
+        # AIOHttpConnection 은 maxsize, 나머지는 pool_maxsize (connection 재사용 = HTTP keep-alive)
+        kwargs["maxsize" if async_mode else "pool_maxsize"] = pool_maxsize
+        if len(kwargs["hosts"]) > 1:
+            kwargs.setdefault("retry_on_timeout", True) # timeout 이 나면 다른 node 로 재시도
+        if sniff:
+            kwargs.setdefault("sniff_on_start", True)
+            kwargs.setdefault("sniff_on_connection_fail", True)
+            kwargs.setdefault("sniffer_timeout", 60)
+        if latency_aware:
+            connection_class = opensearch_client_utils.get_latency_tracking_class(connection_class)
+            kwargs["selector_class"] = LatencyAwareSelector
+
+        client_class = AsyncOpenSearch if async_mode else OpenSearch
+
+        return client_class(connection_class=connection_class, **kwargs)
+
+    @classmethod
+    def clear_opensearch_clients(cls):
+        '''
+        공유 client 목록 초기화 (close 는 호출하지 않음)
+        '''
+        with cls._clients_lock:
+            cls._clients.clear()
+
+    @classmethod
+    def create_aws_opensearch_client(cls, region: str, host: str, http_auth: Tuple[str, str], serializer=None, **kwargs) -> OpenSearch:
+        '''
+        serializer: opensearch-py Serializer (None 이면 orjson 이 있을 때 OrjsonSerializer)
+        나머지 kwargs (pool_maxsize, sniff, shared 등) 는 create_opensearch_client 참고
+        '''
+        return cls.create_opensearch_client(
+            hosts=host,
             http_auth=http_auth,
+            port=443,
             use_ssl=True,
             verify_certs=True,
-            connection_class=RequestsHttpConnection
+            connection_class=RequestsHttpConnection,
+            serializer=serializer,
+            **kwargs
         )
 
-        return client
-    
     @classmethod
-    def create_local_opensearch_client(cls, host: str, http_auth: Tuple[str, str]) -> OpenSearch:
+    def create_local_opensearch_client(cls, host: str, http_auth: Tuple[str, str], serializer=None, **kwargs) -> OpenSearch:
         try:
-            client = OpenSearch(
-                hosts=[{'host': host, 'port': 9200}],
+            return cls.create_opensearch_client(
+                hosts=host,
                 http_auth=http_auth,
+                port=9200,
                 use_ssl=False,
                 verify_certs=False,
-                ssl_show_warn=False
+                ssl_show_warn=False,
+                serializer=serializer,
+                **kwargs
             )
-            return client
         except Exception as e:
             print(f"Error creating OpenSearch client: {e}")
             raise
 
+    @classmethod
+    def create_async_aws_opensearch_client(cls, region: str, host: str, http_auth: Tuple[str, str], serializer=None, **kwargs) -> AsyncOpenSearch:
+        '''
+        async_retriever_utils 용 AsyncOpenSearch 클라이언트 (aiohttp 필요)
+        '''
+        return cls.create_opensearch_client(
+            hosts=host,
+            http_auth=http_auth,
+            port=443,
+            use_ssl=True,
+            verify_certs=True,
+            async_mode=True,
+            serializer=serializer,
+            **kwargs
+        )
+
+    @classmethod
+    def create_async_local_opensearch_client(cls, host: str, http_auth: Tuple[str, str], serializer=None, **kwargs) -> AsyncOpenSearch:
+        '''
+        async_retriever_utils 용 AsyncOpenSearch 클라이언트 (aiohttp 필요)
+        '''
+        try:
+            return cls.create_opensearch_client(
+                hosts=host,
+                http_auth=http_auth,
+                port=9200,
+                use_ssl=False,
+                verify_certs=False,
+                ssl_show_warn=False,
+                async_mode=True,
+                serializer=serializer,
+                **kwargs
+            )
+        except Exception as e:
+            print(f"Error creating AsyncOpenSearch client: {e}")
+            raise
+
     @classmethod
     def create_index(cls, os_client, index_name, index_body):
         '''
@@ -61,6 +253,7 @@ class opensearch_utils():
             index_name,
             body=index_body
         )
+        cls.notify_index_write(index_name)
         print('\nCreating index:')
         print(response)
 
@@ -85,12 +278,13 @@ class opensearch_utils():
             id = id,
             refresh = True
         )
+        cls.notify_index_write(index_name)
 
         # print('\nAdding document:')
         print(response)
 
     @classmethod
-    def search_document(cls, os_client, query, index_name):
+    def search_document(cls, os_client, query, index_name, search_pipeline=None):
         # try:
         #     response = os_client.search(
         #         body=query,
@@ -101,19 +295,167 @@ class opensearch_utils():
         #     print(f"Index {index_name} not found.")
         #     return None
         
+        params = {} if search_pipeline is None else {"search_pipeline": search_pipeline}
         response = os_client.search(
             body=query,
             index=index_name,
+            **params
         )
         # print(response)
         #print('\nKeyword Search results:')
         return response
 
+    @classmethod
+    def get_msearch_body(cls, queries, index_name):
+        '''
+        _msearch 요청 body (header, query 쌍) 생성
+        '''
+        body = []
+        for query in queries:
+            body.append({"index": index_name})
+            body.append(query)
+
+        return body
+
+    @classmethod
+    def get_msearch_responses(cls, response):
+        '''
+        _msearch 응답을 query 순서대로 분리. 실패한 query 가 있으면 예외 발생
+        '''
+        responses = response["responses"]
+        for res in responses:
+            if "error" in res:
+                raise OpenSearchException(res["error"])
+
+        return responses
+
+    ###########################################
+    ### Hybrid query (search pipeline)
+    ###########################################
+
+    # semantic / lexical 쿼리를 hybrid compound query 하나로 묶고, search pipeline 의 normalization-processor 가
+    # 서브 쿼리별 score 를 정규화 (min_max / l2) 한 뒤 weights 로 결합 (OpenSearch 2.10+, neural-search 플러그인).
+    # pipeline 이름은 설정 (body) 의 hash 를 포함하므로 weights / 정규화 방식이 바뀌면 새 pipeline 이 생성되고,
+    # 이전 버전은 delete_stale_hybrid_pipelines 로 정리.
+    ###########################################
+
+    hybrid_max_queries = 5 # hybrid query 의 최대 서브 쿼리 수
+    hybrid_pipeline_prefix = "rag-hybrid"
+    hybrid_normalizations = ["min_max", "l2"]
+    hybrid_combinations = ["arithmetic_mean", "geometric_mean", "harmonic_mean"]
+    # {os_client: 존재를 확인했거나 생성한 pipeline 이름}
+    _search_pipelines = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def get_hybrid_query(cls, queries, k):
+        '''
+        get_query 로 만든 쿼리들을 hybrid query 로 묶음 (서브 쿼리 순서 = pipeline weights 순서)
+        '''
+        assert len(queries) <= cls.hybrid_max_queries, f"Check your queries: hybrid query supports up to {cls.hybrid_max_queries} queries"
+
+        query = {
+            "size": k,
+            "query": {
+                "hybrid": {
+                    "queries": [sub_query["query"] for sub_query in queries]
+                }
+            }
+        }
+        if "_source" in queries[0]:
+            query["_source"] = queries[0]["_source"]
+
+        return query
+
+    @classmethod
+    def get_hybrid_pipeline(cls, weights, normalization="min_max", combination="arithmetic_mean"):
+        '''
+        (pipeline 이름, body). weights 는 합이 1 이 되도록 정규화
+        '''
+        assert normalization in cls.hybrid_normalizations, f"Check your normalization: {cls.hybrid_normalizations}"
+        assert combination in cls.hybrid_combinations, f"Check your combination: {cls.hybrid_combinations}"
+
+        weights = [round(weight / sum(weights), 6) for weight in weights]
+        weights[-1] = round(1.0 - sum(weights[:-1]), 6)
+        body = {
+            "description": f"search_hybrid: {normalization} normalization, {combination} (weights: {weights})",
+            "phase_results_processors": [
+                {
+                    "normalization-processor": {
+                        "normalization": {"technique": normalization},
+                        "combination": {"technique": combination, "parameters": {"weights": weights}}
+                    }
+                }
+            ]
+        }
+        version = hashlib.sha1(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()[:10]
+
+        return f"{cls.hybrid_pipeline_prefix}-{version}", body
+
+    @classmethod
+    def is_search_pipeline_ready(cls, os_client, name):
+
+        return name in cls._search_pipelines.get(os_client, ())
+
+    @classmethod
+    def set_search_pipeline_ready(cls, os_client, name):
+
+        cls._search_pipelines.setdefault(os_client, set()).add(name)
+
+    @classmethod
+    def create_search_pipeline(cls, os_client, name, body):
+        '''
+        search pipeline 이 없을 때만 생성 (프로세스에서 한 번 확인한 pipeline 은 다시 조회하지 않음)
+        '''
+        if cls.is_search_pipeline_ready(os_client, name):
+            return name
+
+        try:
+            os_client.transport.perform_request("GET", f"/_search/pipeline/{name}")
+        except NotFoundError:
+            os_client.transport.perform_request("PUT", f"/_search/pipeline/{name}", body=body)
+            print(f"Search pipeline {name} created")
+        cls.set_search_pipeline_ready(os_client, name)
+
+        return name
+
+    @classmethod
+    def delete_stale_hybrid_pipelines(cls, os_client, keep: Optional[List[str]]=None):
+        '''
+        keep 에 없는 hybrid_pipeline_prefix pipeline 삭제. 삭제한 이름 리스트 반환
+        '''
+        keep = set(keep or [])
+        try:
+            pipelines = os_client.transport.perform_request("GET", "/_search/pipeline")
+        except NotFoundError:
+            return []
+
+        deleted = []
+        for name in pipelines:
+            if name.startswith(f"{cls.hybrid_pipeline_prefix}-") and name not in keep:
+                os_client.transport.perform_request("DELETE", f"/_search/pipeline/{name}")
+                cls._search_pipelines.get(os_client, set()).discard(name)
+                deleted.append(name)
+
+        return deleted
+
+    @classmethod
+    def search_documents_multi(cls, os_client, queries, index_name):
+        '''
+        여러 query 를 _msearch 한 번의 요청으로 검색. 결과는 queries 순서와 동일
+        '''
+        response = os_client.msearch(
+            body=cls.get_msearch_body(queries, index_name),
+            index=index_name
+        )
+
+        return cls.get_msearch_responses(response)
+
     @classmethod
     def delete_index(cls, os_client, index_name):
         response = os_client.indices.delete(
             index=index_name
         )
+        cls.notify_index_write(index_name)
 
         print('\nDeleting index:')
         print(response)
@@ -250,6 +592,9 @@ class opensearch_utils():
                 }
             }
 
+            if kwargs.get("ef_search", None) is not None: # faiss / lucene (OpenSearch 2.16+), KNNIndexProfile 참고
+                QUERY_TEMPLATE["query"]["bool"]["must"][0]["knn"][kwargs["vector_field"]]["method_parameters"] = {"ef_search": kwargs["ef_search"]}
+
             if "filter" in kwargs:
                 QUERY_TEMPLATE["query"]["bool"]["filter"].extend(kwargs["filter"])
         
@@ -272,6 +617,34 @@ class opensearch_utils():
 
         return QUERY_TEMPLATE
 
+    @classmethod
+    def get_knn_rescore(cls, vector, window_size, vector_field="vector_field", space_type="cosinesimil"):
+        '''
+        1단계 결과 상위 window_size 개를 vector_field 의 float 벡터로 exact 점수화 (knn_score script) 하는 rescore.
+        최종 score 는 rescore 점수만 사용 (query_weight=0)
+        '''
+        return {
+            "window_size": window_size,
+            "query": {
+                "rescore_query": {
+                    "script_score": {
+                        "query": {"match_all": {}},
+                        "script": {
+                            "source": "knn_score",
+                            "lang": "knn",
+                            "params": {
+                                "field": vector_field,
+                                "query_value": vector,
+                                "space_type": space_type,
+                            }
+                        }
+                    }
+                },
+                "query_weight": 0.0,
+                "rescore_query_weight": 1.0,
+            }
+        }
+
     @classmethod
     def get_index_dimensions(cls, os_client, index_name: str) -> Optional[dict]:
         '''
@@ -309,11 +682,15 @@ class opensearch_utils():
         return BOOL_FILTER_TEMPLATE
 
     @staticmethod
-    def get_documents_by_ids(os_client, ids, index_name):
-
+    def get_documents_by_ids(os_client, ids, index_name, source_includes=None):
+        '''
+        mget. source_includes 가 주어지면 _source 에서 해당 필드만 반환 (예: ["vector_field"])
+        '''
+        params = {} if source_includes is None else {"_source_includes": source_includes}
         response = os_client.mget(
             body={"ids": ids},
-            index=index_name
+            index=index_name,
+            **params
         )
 
         return response
@@ -325,15 +702,13 @@ class opensearch_utils():
         '''
         table_data = []
 
-        responses = copy.deepcopy(response)
-        for doc, score in responses:
+        for doc, score in response:
             # st.write(f'\nScore: {score}')
             # st.write(f'Document Number: {doc.metadata["row"]}')
             # Split the page content into lines
             lines = doc.page_content.split("\n")
-            metadata = doc.metadata
-            if "image_base64" in metadata: metadata["image_base64"] = ""
-            if "orig_elements" in metadata: metadata["orig_elements"] = ""
+            # 큰 필드는 표시만 생략 (원본 Document 는 수정하지 않음)
+            metadata = {k: "" if k in ["image_base64", "orig_elements"] else v for k, v in doc.metadata.items()}
             
             row = {
             "Score": score,
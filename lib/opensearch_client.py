@@ -0,0 +1,117 @@
+############################################################
+############################################################
+# OpenSearch client connection 관련 함수들 (latency-aware node 선택)
+############################################################
+############################################################
+
+import random
+
+from opensearchpy import RequestsHttpConnection, Urllib3HttpConnection, AIOHttpConnection
+from opensearchpy.connection_pool import ConnectionSelector
+
+###########################################
+### Latency-aware connection selection
+###########################################
+
+# 여러 node 에 연결할 때, node 별 응답 시간을 EWMA 로 기록하고 요청마다
+# 1 / latency 에 비례하는 확률로 node 를 선택.
+# 느린 node 는 덜 쓰이지만, 가장 빠른 node 하나에 요청이 몰리지 않고 측정값도 계속 갱신됨.
+# 아직 측정되지 않은 node 는 먼저 사용.
+#
+# * LatencyTrackingConnection: connection_class 에 latency 기록을 추가 (log_request_success / fail)
+# * LatencyAwareSelector: ConnectionPool 의 selector_class
+###########################################
+
+class LatencyTrackingConnection():
+
+    # EWMA 가중치
+    latency_alpha = 0.2
+    # 실패한 요청은 (timeout 등) 이 배수만큼 느린 것으로 기록
+    failure_penalty = 5.0
+
+    def _record_latency(self, duration):
+
+        # 동시 요청끼리 갱신이 겹쳐도 EWMA 값 하나가 빠질 뿐이므로 lock 없이 기록
+        latency = getattr(self, "latency", None)
+        self.latency = duration if latency is None else (1 - self.latency_alpha) * latency + self.latency_alpha * duration
+        self.n_requests = getattr(self, "n_requests", 0) + 1
+
+    def log_request_success(self, method, full_url, path, body, status_code, response, duration):
+
+        self._record_latency(duration)
+        super().log_request_success(method, full_url, path, body, status_code, response, duration)
+
+    def log_request_fail(self, method, full_url, path, body, duration, status_code=None, response=None, exception=None):
+
+        self._record_latency(duration * self.failure_penalty)
+        super().log_request_fail(method, full_url, path, body, duration, status_code=status_code, response=response, exception=exception)
+
+class LatencyTrackingRequestsHttpConnection(LatencyTrackingConnection, RequestsHttpConnection):
+    pass
+
+class LatencyTrackingUrllib3HttpConnection(LatencyTrackingConnection, Urllib3HttpConnection):
+    pass
+
+class LatencyTrackingAIOHttpConnection(LatencyTrackingConnection, AIOHttpConnection):
+    pass
+
+class LatencyAwareSelector(ConnectionSelector):
+
+    def select(self, connections):
+
+        if len(connections) == 1:
+            return connections[0]
+
+        latencies = [getattr(conn, "latency", None) for conn in connections]
+        unmeasured = [conn for conn, latency in zip(connections, latencies) if latency is None]
+        if unmeasured:
+            return random.choice(unmeasured)
+
+        return random.choices(connections, weights=[1 / max(latency, 1e-6) for latency in latencies])[0]
+
+class opensearch_client_utils():
+
+    latency_tracking_classes = {
+        RequestsHttpConnection: LatencyTrackingRequestsHttpConnection,
+        Urllib3HttpConnection: LatencyTrackingUrllib3HttpConnection,
+        AIOHttpConnection: LatencyTrackingAIOHttpConnection,
+    }
+
+    @classmethod
+    def get_latency_tracking_class(cls, connection_class):
+
+        assert connection_class in cls.latency_tracking_classes, f'Check your connection_class: {list(cls.latency_tracking_classes)}'
+
+        return cls.latency_tracking_classes[connection_class]
+
+    @classmethod
+    def get_hosts(cls, hosts, port=9200):
+        '''
+        "host", "https://host:443", {"host": ..., "port": ...} 또는 그 리스트를 [{"host", "port"}] 로 변환
+        '''
+        if isinstance(hosts, (str, dict)):
+            hosts = [hosts]
+
+        normalized_hosts = []
+        for host in hosts:
+            if isinstance(host, dict):
+                normalized_hosts.append({"port": port, **host})
+                continue
+            host = host.replace("https://", "").replace("http://", "").rstrip("/")
+            name, _, host_port = host.partition(":")
+            normalized_hosts.append({"host": name, "port": int(host_port) if host_port else port})
+
+        return normalized_hosts
+
+    @classmethod
+    def get_node_latencies(cls, os_client):
+        '''
+        {host:port: (EWMA latency (ms), 요청 수)} (LatencyTrackingConnection 만)
+        '''
+        pool = os_client.transport.connection_pool
+        connections = getattr(pool, "orig_connections", None) or pool.connections # dead node 포함
+
+        return {
+            conn.host: (None if getattr(conn, "latency", None) is None else conn.latency * 1000, getattr(conn, "n_requests", 0))
+            for conn in connections if isinstance(conn, LatencyTrackingConnection)
+        }
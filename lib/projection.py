@@ -0,0 +1,309 @@
+############################################################
+############################################################
+# Embedding 차원 축소 (PCA / Matryoshka truncation) 관련 함수들
+############################################################
+############################################################
+
+import os
+import json
+import time
+import hashlib
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from local_utils.embedding_cache import CachedEmbeddings
+
+###########################################
+### Embedding projection
+###########################################
+
+# 색인 / 검색 벡터를 (d_in,) -> (d_out,) 로 줄이는 선형 변환: (vector - mean) @ components.T
+# * pca: corpus 샘플의 주성분 (분산이 큰 순서). l2 는 평균을 빼고 (거리는 평행이동에 불변),
+#   cosinesimil / innerproduct 는 내적을 보존하도록 평균을 빼지 않은 X^T X 의 고유벡터 사용
+# * truncate: 앞 d_out 차원만 사용 (Matryoshka 학습 모델용, mean = 0)
+# * normalize=True 이면 변환 후 L2 정규화 (cosinesimil / innerproduct index)
+#
+# fit 할 때 샘플 일부를 query 로 떼어 두고, 차원별로 exact top-k 가 원래 차원의 exact top-k 와 얼마나 겹치는지
+# (recall@k) 를 report 로 남김. dimension 을 주지 않으면 target_recall 을 만족하는 가장 작은 차원을 선택.
+# version 은 변환 (method, mean, components) 의 hash: 저장 / index _meta 에 기록하고 검색 시 같은 변환인지 확인.
+#
+# 사용법:
+#   projection = EmbeddingProjection.fit(sample_vectors, method="pca", target_recall=0.95)
+#   projection.save("projection/")
+#   llm_emb = ProjectedEmbeddings(llm_emb, EmbeddingProjection.load("projection/")) # 색인 / 검색 모두 같은 변환
+#   projection.set_index_meta(os_client, index_name); projection.check_index(os_client, index_name)
+###########################################
+
+class EmbeddingProjection():
+
+    methods = ["pca", "truncate"]
+    meta_key = "embedding_projection"
+
+    def __init__(self, method, mean, components, normalize=True, model_id=None, report=None, created_at=None):
+
+        assert method in self.methods, f'Check your method: {self.methods}'
+
+        self.method = method
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.ascontiguousarray(np.asarray(components, dtype=np.float32)) # (d_out, d_in)
+        self.normalize = normalize
+        self.model_id = model_id # 임베딩 모델 식별자 (CachedEmbeddings.get_model_id)
+        self.report = report or []
+        self.created_at = created_at or time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.version = self.get_version()
+
+    @property
+    def input_dimension(self):
+
+        return self.components.shape[1]
+
+    @property
+    def dimension(self):
+
+        return self.components.shape[0]
+
+    def __repr__(self):
+
+        return f"EmbeddingProjection(method={self.method}, {self.input_dimension}->{self.dimension}, version={self.version})"
+
+    def get_version(self):
+
+        digest = hashlib.sha1(f"{self.method}:{self.normalize}:".encode("utf-8"))
+        digest.update(self.mean.tobytes())
+        digest.update(self.components.tobytes())
+
+        return digest.hexdigest()[:12]
+
+    def transform(self, vectors):
+        '''
+        (n, d_in) 또는 (d_in,) -> float32 (n, d_out) 또는 (d_out,)
+        '''
+        vectors = np.asarray(vectors, dtype=np.float32)
+        assert vectors.shape[-1] == self.input_dimension, f"Check your vectors: expected dimension {self.input_dimension}, got {vectors.shape[-1]}"
+
+        projected = (vectors - self.mean) @ self.components.T
+        if self.normalize:
+            norms = np.linalg.norm(projected, axis=-1, keepdims=True)
+            norms[norms == 0] = 1.0
+            projected = projected / norms
+
+        return projected
+
+    ###########################################
+    ### Fit / recall report
+    ###########################################
+
+    @classmethod
+    def _get_pca(cls, vectors, center=True):
+        '''
+        -> (mean, 분산이 큰 순서의 components (d_in, d_in), 설명된 분산 비율 누적합)
+        '''
+        mean = vectors.mean(axis=0) if center else np.zeros(vectors.shape[1], dtype=np.float32)
+        centered = vectors - mean
+        eigenvalues, eigenvectors = np.linalg.eigh(centered.T.astype(np.float64) @ centered)
+        order = np.argsort(eigenvalues)[::-1]
+        eigenvalues = np.clip(eigenvalues[order], 0, None)
+
+        return mean, eigenvectors[:, order].T, np.cumsum(eigenvalues) / (eigenvalues.sum() or 1.0)
+
+    @staticmethod
+    def _get_top_k(corpus, queries, k, space_type):
+
+        if space_type == "l2":
+            scores = -(((queries ** 2).sum(axis=1, keepdims=True)) - 2 * queries @ corpus.T + (corpus ** 2).sum(axis=1))
+        else:
+            if space_type == "cosinesimil":
+                corpus = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+                queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+            scores = queries @ corpus.T
+        top = np.argpartition(-scores, k-1, axis=1)[:, :k]
+
+        return top
+
+    @classmethod
+    def get_recall_report(cls, corpus, queries, mean, components, dimensions, k=10, space_type="cosinesimil", explained_variance=None):
+        '''
+        차원별 recall@k (변환한 벡터의 exact top-k 가 원래 벡터의 exact top-k 와 겹치는 비율)
+        '''
+        k = min(k, len(corpus))
+        truth = cls._get_top_k(corpus, queries, k, space_type)
+
+        report = []
+        for dimension in dimensions:
+            projection = components[:dimension]
+            top = cls._get_top_k((corpus - mean) @ projection.T, (queries - mean) @ projection.T, k, space_type)
+            recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(top, truth)])
+            report.append({
+                "dimension": int(dimension),
+                f"recall@{k}": float(recall),
+                "explained_variance": None if explained_variance is None else float(explained_variance[dimension-1]),
+                "vector_bytes": int(4 * dimension), # float32 벡터 하나의 크기
+            })
+
+        return report
+
+    @classmethod
+    def fit(
+        cls,
+        vectors,
+        method: str="pca",
+        dimension: Optional[int]=None,
+        target_recall: float=0.95,
+        dimensions: Optional[List[int]]=None,
+        k: int=10,
+        space_type: str="cosinesimil",
+        n_queries: int=200,
+        normalize: bool=True,
+        model_id: Optional[str]=None,
+        seed: int=0,
+        verbose: bool=True
+    ):
+        '''
+        corpus 샘플 벡터로 변환을 학습. dimension 이 None 이면 report 에서 target_recall 을 만족하는 가장 작은 차원
+        (만족하는 차원이 없으면 원래 차원)
+        '''
+        assert method in cls.methods, f'Check your method: {cls.methods}'
+        assert space_type in ["cosinesimil", "l2", "innerproduct"], "Check your space_type"
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        assert len(vectors) > n_queries + k, "Check your vectors: need more samples than n_queries + k"
+        input_dimension = vectors.shape[1]
+
+        # query 로 쓸 샘플은 학습에서 제외
+        order = np.random.default_rng(seed).permutation(len(vectors))
+        queries, corpus = vectors[order[:n_queries]], vectors[order[n_queries:]]
+
+        if method == "pca":
+            mean, components, explained_variance = cls._get_pca(corpus, center=space_type == "l2")
+        else:
+            mean, components, explained_variance = np.zeros(input_dimension, dtype=np.float32), np.eye(input_dimension, dtype=np.float32), None
+
+        dimensions = sorted(set(dimensions or [d for d in [32, 64, 96, 128, 192, 256, 384, 512] if d < input_dimension] + [input_dimension]))
+        if dimension is not None and dimension not in dimensions:
+            dimensions = sorted(dimensions + [dimension])
+        report = cls.get_recall_report(corpus, queries, mean, components, dimensions, k=k, space_type=space_type, explained_variance=explained_variance)
+
+        if dimension is None:
+            recall_key = f"recall@{min(k, len(corpus))}"
+            passed = [row["dimension"] for row in report if row[recall_key] >= target_recall]
+            dimension = passed[0] if passed else input_dimension
+
+        projection = cls(method, mean, components[:dimension], normalize=normalize, model_id=model_id, report=report)
+        if verbose:
+            projection.print_report()
+
+        return projection
+
+    def print_report(self):
+
+        print(f"===== {self} =====")
+        for row in self.report:
+            recall = [f"{key} {value:.4f}" for key, value in row.items() if key.startswith("recall@")]
+            variance = "" if row["explained_variance"] is None else f', explained variance {row["explained_variance"]:.3f}'
+            selected = " <- selected" if row["dimension"] == self.dimension else ""
+            print(f'dimension {row["dimension"]:>4}: {", ".join(recall)}{variance}, {row["vector_bytes"]} bytes / vector{selected}')
+
+    ###########################################
+    ### Persistence / index _meta
+    ###########################################
+
+    def get_info(self):
+
+        return {
+            "method": self.method,
+            "version": self.version,
+            "input_dimension": self.input_dimension,
+            "dimension": self.dimension,
+            "normalize": self.normalize,
+            "model_id": self.model_id,
+            "created_at": self.created_at,
+        }
+
+    def save(self, path: str):
+
+        os.makedirs(path, exist_ok=True)
+        np.savez(os.path.join(path, "projection.npz"), mean=self.mean, components=self.components)
+        with open(os.path.join(path, "projection.json"), "w", encoding="utf-8") as f:
+            json.dump({**self.get_info(), "report": self.report}, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path: str):
+
+        with open(os.path.join(path, "projection.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        arrays = np.load(os.path.join(path, "projection.npz"))
+
+        projection = cls(
+            info["method"],
+            arrays["mean"],
+            arrays["components"],
+            normalize=info["normalize"],
+            model_id=info["model_id"],
+            report=info["report"],
+            created_at=info["created_at"]
+        )
+        assert projection.version == info["version"], f'Check your projection files: version mismatch ({projection.version} != {info["version"]})'
+
+        return projection
+
+    def _get_index_meta(self, os_client, index_name):
+
+        mapping = os_client.indices.get_mapping(index=index_name)
+
+        return mapping[index_name]["mappings"].get("_meta", {})
+
+    def set_index_meta(self, os_client, index_name, overwrite=False):
+        '''
+        index mapping 의 _meta 에 변환 정보 기록.
+        이미 다른 version 으로 색인된 index 이면 (overwrite=False) AssertionError: 벡터 공간이 섞이지 않도록
+        '''
+        meta = self._get_index_meta(os_client, index_name)
+        current = meta.get(self.meta_key, None)
+        if current is not None and not overwrite:
+            assert current["version"] == self.version, f'Check your projection: index {index_name} uses version {current["version"]}, not {self.version}'
+
+        # _meta 는 통째로 교체되므로 기존 항목과 합쳐서 기록
+        os_client.indices.put_mapping(index=index_name, body={"_meta": {**meta, self.meta_key: self.get_info()}})
+
+    def check_index(self, os_client, index_name):
+        '''
+        index 에 기록된 변환 version 과 같은지 확인 (다르면 AssertionError)
+        '''
+        meta = self._get_index_meta(os_client, index_name).get(self.meta_key, None)
+        assert meta is not None, f"Check your index: {index_name} has no {self.meta_key} _meta"
+        assert meta["version"] == self.version, f'Check your projection: index {index_name} uses version {meta["version"]}, not {self.version}'
+
+        return True
+
+###########################################
+### Projected embeddings
+###########################################
+
+# llm_emb 를 감싸서 embed_documents / embed_query 결과에 같은 EmbeddingProjection 을 적용.
+# 색인 (BulkIngestionPipeline) 과 검색 (retriever_utils.get_semantic_similar_docs, search_hybrid) 이
+# 같은 llm_emb 를 쓰면 자동으로 같은 변환이 적용됨.
+# CachedEmbeddings 안쪽이 아니라 바깥에 두면 캐시에는 원래 벡터가 남아 변환을 바꿔도 재사용 가능.
+###########################################
+
+class ProjectedEmbeddings(Embeddings):
+
+    def __init__(self, embeddings: Embeddings, projection: EmbeddingProjection):
+
+        self.embeddings = embeddings
+        self.projection = projection
+        # HyDECache 등의 key 에 쓰이는 모델 id (변환 version 포함)
+        model_id = CachedEmbeddings.get_model_id(embeddings)
+        self.model_id = f"{model_id}+{projection.method}{projection.dimension}-{projection.version}"
+
+    def embed_documents(self, texts: List[str], **kwargs) -> List[List[float]]:
+
+        if not texts:
+            return []
+
+        return self.projection.transform(self.embeddings.embed_documents(texts, **kwargs)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+
+        return self.projection.transform(self.embeddings.embed_query(text)).tolist()
@@ -0,0 +1,48 @@
+############################################################
+############################################################
+# 임베딩 binary quantization 관련 함수들
+############################################################
+############################################################
+
+import numpy as np
+
+###########################################
+### Binary quantization (sign -> bit)
+###########################################
+
+# float 벡터의 각 차원을 부호 (> 0 이면 1) 한 bit 로 바꿔 8 차원씩 uint8 하나로 pack.
+# 768 차원 float32 (3072 bytes) -> 96 bytes (32배 작음), 거리는 Hamming 거리 (다른 bit 수).
+# * OpenSearch: knn_vector (data_type: binary, space_type: hammingbit) 에는 int8 리스트로 색인 / 검색
+# * LocalVectorStore(index_type="binary"): uint8 code 배열을 그대로 사용
+# Hamming 거리로 후보를 넉넉히 (k * binary_oversample) 뽑고, float 벡터로 다시 점수화 (rescoring) 해서 top-k.
+###########################################
+
+class binary_quantization_utils():
+
+    # 0 ~ 255 의 1 bit 개수
+    popcounts = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+    @classmethod
+    def get_binary_codes(cls, vectors):
+        '''
+        (n, d) float 벡터 -> (n, ceil(d/8)) uint8 code
+        '''
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+
+        return np.packbits(vectors > 0, axis=1)
+
+    @classmethod
+    def get_binary_vector(cls, vector):
+        '''
+        float 벡터 하나 -> OpenSearch binary knn_vector 값 (int8 리스트, 길이 d/8)
+        '''
+        return cls.get_binary_codes(vector)[0].view(np.int8).tolist()
+
+    @classmethod
+    def get_hamming_distances(cls, codes, query_code):
+        '''
+        codes (n, b) uint8, query_code (b,) uint8 -> Hamming 거리 (n,)
+        '''
+        return cls.popcounts[np.bitwise_xor(codes, query_code)].sum(axis=1, dtype=np.int32)
@@ -5,7 +5,6 @@
 ############################################################    
 
 import json
-import copy
 import numpy as np
 import pandas as pd
 from pprint import pprint
@@ -13,10 +12,16 @@ from operator import itemgetter
 from itertools import chain as ch
 from typing import Any, Dict, List, Optional, List, Tuple
 
-from opensearchpy import OpenSearch, RequestsHttpConnection
+from opensearchpy import OpenSearch
 
 from local_utils import print_ww
 from local_utils.opensearch import opensearch_utils
+from local_utils.embedding_cache import CachedEmbeddings
+from local_utils.projection import EmbeddingProjection, ProjectedEmbeddings
+from local_utils.fusion import fusion_utils
+from local_utils.search_results import SearchHits
+from local_utils.quantization import binary_quantization_utils
+from local_utils.cache import LRUTTLCache
 
 from langchain.schema import Document
 from langchain.chains import RetrievalQA
@@ -113,13 +118,9 @@ def get_semantic_similar_docs(**kwargs):
             # fetch_k=3,
         )
 
-    if kwargs.get("hybrid", False):
+    if kwargs.get("hybrid", False) and results:
         max_score = results[0][1]
-        new_results = []
-        for doc in results:
-            nomalized_score = float(doc[1]/max_score)
-            new_results.append((doc[0], nomalized_score))
-        results = copy.deepcopy(new_results)
+        results = [(doc, float(score/max_score)) for doc, score in results]
 
     return results
 
@@ -131,16 +132,6 @@ def get_lexical_similar_docs(**kwargs):
     assert "os_client" in kwargs, "Check your os_client"
     assert "index_name" in kwargs, "Check your index_name"
 
-    def normalize_search_results(search_results):
-
-        hits = (search_results["hits"]["hits"])
-        max_score = float(search_results["hits"]["max_score"])
-        for hit in hits:
-            hit["_score"] = float(hit["_score"]) / max_score
-        search_results["hits"]["max_score"] = hits[0]["_score"]
-        search_results["hits"]["hits"] = hits
-        return search_results
-
     query = opensearch_utils.get_query(
         query=kwargs["query"],
         minimum_should_match=kwargs.get("minimum_should_match", 0),
@@ -157,25 +148,7 @@ def get_lexical_similar_docs(**kwargs):
         index_name=kwargs["index_name"]
     )
 
-    results = []
-    if search_results["hits"]["hits"]:
-        search_results = normalize_search_results(search_results)
-        for res in search_results["hits"]["hits"]:
-
-            metadata = res["_source"]["metadata"]
-            #metadata["score"] = res["_score"]
-            metadata["id"] = res["_id"]
-
-            doc = Document(
-                page_content=res["_source"]["text"],
-                metadata=metadata
-            )
-            if kwargs.get("hybrid", False):
-                results.append((doc, res["_score"]))
-            else:
-                results.append((doc))
-
-    return results
+    return SearchHits.from_response(search_results).to_documents(with_score=kwargs.get("hybrid", False))
 
 # hybrid (lexical + semantic) search based
 def search_hybrid(**kwargs):
@@ -206,7 +179,7 @@ def search_hybrid(**kwargs):
     similar_docs_ensemble = get_ensemble_results(
         doc_lists=[similar_docs_semantic, similar_docs_keyword],
         weights=kwargs.get("ensemble_weights", [.5, .5]),
-        algorithm=kwargs.get("fusion_algorithm", "RRF"), # ["RRF", "simple_weighted"]
+        algorithm=kwargs.get("fusion_algorithm", "RRF"), # fusion_utils.algorithms
         c=60,
         k=kwargs.get("k", 5)
     )
@@ -234,43 +207,14 @@ def search_hybrid(**kwargs):
 # Score fusion and re-rank (lexical + semantic)
 def get_ensemble_results(doc_lists: List[List[Document]], weights, algorithm="RRF", c=60, k=5) -> List[Document]:
 
-    assert algorithm in ["RRF", "simple_weighted"]
-
-    # Create a union of all unique documents in the input doc_lists
-    all_documents = set()
-
-    for doc_list in doc_lists:
-        for (doc, _) in doc_list:
-            all_documents.add(doc.page_content)
-
-    # Initialize the score dictionary for each document
-    hybrid_score_dic = {doc: 0.0 for doc in all_documents}
-
-    # Calculate RRF scores for each document
-    for doc_list, weight in zip(doc_lists, weights):
-        for rank, (doc, score) in enumerate(doc_list, start=1):
-            if algorithm == "RRF": # RRF (Reciprocal Rank Fusion)
-                score = weight * (1 / (rank + c))
-            elif algorithm == "simple_weighted":
-                score *= weight
-            hybrid_score_dic[doc.page_content] += score
-
-    # Sort documents by their scores in descending order
-    sorted_documents = sorted(
-        hybrid_score_dic.items(), key=lambda x: x[1], reverse=True
+    return fusion_utils.get_ensemble_results(
+        doc_lists=doc_lists,
+        weights=weights,
+        algorithm=algorithm, # fusion_utils.algorithms
+        c=c,
+        k=k
     )
 
-    # Map the sorted page_content back to the original document objects
-    page_content_to_doc_map = {
-        doc.page_content: doc for doc_list in doc_lists for (doc, orig_score) in doc_list
-    }
-
-    sorted_docs = [
-        (page_content_to_doc_map[page_content], hybrid_score) for (page_content, hybrid_score) in sorted_documents
-    ]
-
-    return sorted_docs[:k]
-
 #################################################################
 # Document Retriever with Langchain(BaseRetriever): return List(documents)
 #################################################################
@@ -284,16 +228,6 @@ class OpenSearchLexicalSearchRetriever(BaseRetriever):
     minimum_should_match = 0
     filter = []
 
-    def normalize_search_results(self, search_results):
-
-        hits = (search_results["hits"]["hits"])
-        max_score = float(search_results["hits"]["max_score"])
-        for hit in hits:
-            hit["_score"] = float(hit["_score"]) / max_score
-        search_results["hits"]["max_score"] = hits[0]["_score"]
-        search_results["hits"]["hits"] = hits
-        return search_results
-
     def update_search_params(self, **kwargs):
 
         self.k = kwargs.get("k", 3)
@@ -326,23 +260,11 @@ class OpenSearchLexicalSearchRetriever(BaseRetriever):
             index_name=self.index_name
         )
 
-        results = []
-        if search_results["hits"]["hits"]:
-            search_results = self.normalize_search_results(search_results)
-            for res in search_results["hits"]["hits"]:
-
-                metadata = res["_source"]["metadata"]
-                metadata["id"] = res["_id"]
-
-                doc = Document(
-                    page_content=res["_source"]["text"],
-                    metadata=metadata
-                )
-                results.append((doc))
+        results = SearchHits.from_response(search_results)[:self.k].to_documents()
 
         self._reset_search_params()
 
-        return results[:self.k]
+        return results
 
 # hybrid (lexical + semantic) search based
 class OpenSearchHybridSearchRetriever(BaseRetriever):
@@ -382,7 +304,7 @@ class OpenSearchHybridSearchRetriever(BaseRetriever):
             index_name=self.index_name,
             os_client=self.os_client,
             filter=self.filter,
-            fusion_algorithm=self.fusion_algorithm, # ["RRF", "simple_weighted"]
+            fusion_algorithm=self.fusion_algorithm, # fusion_utils.algorithms
             ensemble_weights=self.ensemble_weights, # 시멘트 서치에 가중치 0.5 , 키워드 서치 가중치 0.5 부여.
             verbose=self.verbose
         )
@@ -499,7 +421,7 @@ class KoSimCSERobertaContentHandler(EmbeddingsContentHandler):
         ndim = np.array(response_json).ndim    
         
         if ndim == 4:
-            # Original shape (1, 1, n, 768)
+            # Original shape (1, 1, n, dimension): 차원은 모델에 따라 다름 (768: KoSimCSE-roberta)
             emb = response_json[0][0][0]
             emb = np.expand_dims(emb, axis=0).tolist()
         elif ndim == 2:
@@ -557,9 +479,24 @@ def opensearch_pretty_print_documents_wo_filter(response):
         print('-' * 50)
 
     
-def get_embedding_model(boto3_bedrock, is_bedrock_embeddings, is_KoSimCSERobert, aws_region, endpont_name=None):
+def embed_documents_batch(llm_emb, texts):
+    '''
+    texts 를 embed_documents 한 번의 batch 로 임베딩
+    (SagemakerEndpointEmbeddingsJumpStart 는 chunk_size 를 늘려 endpoint 호출도 한 번)
+    '''
+    embeddings = llm_emb
+    while isinstance(embeddings, (CachedEmbeddings, ProjectedEmbeddings)):
+        embeddings = embeddings.embeddings
+    if isinstance(embeddings, SagemakerEndpointEmbeddingsJumpStart):
+        return llm_emb.embed_documents(texts, chunk_size=len(texts))
+
+    return llm_emb.embed_documents(texts)
+
+def get_embedding_model(boto3_bedrock, is_bedrock_embeddings, is_KoSimCSERobert, aws_region, endpont_name=None, cache=False, projection=None, **cache_kwargs):
     '''
     Bedrock embeeding model or KoSimCSERobert model 가져오기
+    cache=True 이면 CachedEmbeddings 로 감싸서 반환 (cache_kwargs: maxsize, ttl, persist_path, model_id)
+    projection (EmbeddingProjection 또는 저장 경로) 이 주어지면 ProjectedEmbeddings 로 감싸서 반환 (캐시 바깥)
     '''
     if is_bedrock_embeddings:
 
@@ -583,6 +520,16 @@ def get_embedding_model(boto3_bedrock, is_bedrock_embeddings, is_KoSimCSERobert,
     else:
         llm_emb = None
         print("No Embedding Model Selected")
+
+    if cache and llm_emb is not None:
+        llm_emb = CachedEmbeddings(llm_emb, **cache_kwargs)
+        print(f"Embedding Cache Enabled: {llm_emb.stats()}")
+
+    if projection is not None and llm_emb is not None:
+        if isinstance(projection, str):
+            projection = EmbeddingProjection.load(projection)
+        llm_emb = ProjectedEmbeddings(llm_emb, projection)
+        print(f"Embedding Projection Enabled: {projection}")
     
     return llm_emb
 
@@ -595,17 +542,9 @@ def get_embedding_model(boto3_bedrock, is_bedrock_embeddings, is_KoSimCSERobert,
 
 def create_aws_opensearch_client(region: str, host: str, http_auth: Tuple[str, str]) -> OpenSearch:
     '''
-    오픈서치 클라이언트를 제공함.
+    오픈서치 클라이언트를 제공함. (opensearch_utils.create_aws_opensearch_client 의 프로세스 공유 client)
     '''
-    aws_client = OpenSearch(
-        hosts = [{'host': host.replace("https://", ""), 'port': 443}],
-        http_auth = http_auth,
-        use_ssl = True,
-        verify_certs = True,
-        connection_class = RequestsHttpConnection
-    )
-    
-    return aws_client
+    return opensearch_utils.create_aws_opensearch_client(region, host, http_auth)
 
 def create_index(aws_client, index_name, index_body):    
     '''
@@ -638,6 +577,7 @@ def add_doc(aws_client, index_name, document, id):
         id = id,
         refresh = True
     )
+    opensearch_utils.notify_index_write(index_name)
 
     print('\nAdding document:')
     print(response)
@@ -656,6 +596,7 @@ def delete_index(aws_client, index_name):
     response = aws_client.indices.delete(
         index = index_name
     )
+    opensearch_utils.notify_index_write(index_name)
 
     print('\nDeleting index:')
     print(response)
@@ -803,18 +744,14 @@ class ChatUX:
 #################################################################
 
 import boto3
+import hashlib
 import threading
-from functools import partial
-from multiprocessing.pool import ThreadPool
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from copy import deepcopy
+from langchain.schema.output_parser import StrOutputParser
 
 class retriever_utils():
     
     runtime_client = boto3.Session().client('sagemaker-runtime')
-    pool = ThreadPool(processes=2)
-    rag_fusion_pool = ThreadPool(processes=5)
-    hyde_pool = ThreadPool(processes=4)
     text_splitter = RecursiveCharacterTextSplitter(
         # Set a really small chunk size, just to show.
         chunk_size=512,
@@ -823,6 +760,12 @@ class retriever_utils():
         length_function=len,
     )
     token_limit = 300
+    # two_phase 검색에서 아직 text / metadata 를 가져오지 않은 Document 의 metadata 표시
+    unhydrated_key = SearchHits.unhydrated_key
+    # ingestion 시 rerank_segments 를 미리 만들 때, query 몫으로 남겨 두는 token 수
+    rerank_query_token_reserve = 64
+    # get_num_tokens 결과 memo (precompute 된 metadata 가 없는 문서와 query 용)
+    token_count_cache = LRUTTLCache(maxsize=50000)
 
     @classmethod
     # semantic search based
@@ -849,14 +792,86 @@ class retriever_utils():
 
         if kwargs.get("hybrid", False) and results:
             max_score = results[0][1]
-            new_results = []
-            for doc in results:
-                nomalized_score = float(doc[1]/max_score)
-                new_results.append((doc[0], nomalized_score))
-            results = deepcopy(new_results)
+            results = [(doc, float(score/max_score)) for doc, score in results]
 
         return results
 
+    @classmethod
+    def embed_queries(cls, llm_emb, queries):
+        '''
+        RAG-Fusion / HyDE 의 query 변형들을 embed_documents 한 번의 batch 로 임베딩
+        '''
+        return embed_documents_batch(llm_emb, queries)
+
+    @classmethod
+    def _get_semantic_query(cls, **kwargs):
+        '''
+        semantic search 쿼리 생성 (vector 가 없으면 llm_emb 로 임베딩)
+        '''
+        vector = kwargs.get("vector", None)
+        if vector is None:
+            vector = kwargs["llm_emb"].embed_query(kwargs["query"])
+        vector = np.asarray(vector, dtype=np.float32) # index 도 float32: 요청 body 가 짧고, orjson 은 리스트 변환 없이 encode
+
+        if kwargs.get("binary_search", False):
+            # 1단계: binary_vector_field 에서 Hamming 거리로 k * binary_oversample 개, 2단계: vector_field 의 float 벡터로 rescore
+            n_candidates = kwargs["k"] * kwargs.get("binary_oversample", 10)
+            query = opensearch_utils.get_query(
+                query=kwargs["query"],
+                filter=kwargs.get("boolean_filter", []),
+                search_type="semantic",
+                vector_field=kwargs.get("binary_vector_field", "binary_vector_field"),
+                vector=binary_quantization_utils.get_binary_vector(vector),
+                k=n_candidates,
+                ef_search=kwargs.get("ef_search", None)
+            )
+            query["rescore"] = opensearch_utils.get_knn_rescore(
+                vector,
+                window_size=n_candidates,
+                vector_field="vector_field",
+                space_type=kwargs.get("space_type", "cosinesimil")
+            )
+        else:
+            query = opensearch_utils.get_query(
+                query=kwargs["query"],
+                filter=kwargs.get("boolean_filter", []),
+                search_type="semantic", # enable semantic search
+                vector_field="vector_field", # for semantic search  check by using index_info = os_client.indices.get(index=index_name)
+                vector=vector,
+                k=kwargs["k"],
+                ef_search=kwargs.get("ef_search", None)
+            )
+        query["size"] = kwargs["k"]
+        if kwargs.get("two_phase", False):
+            query["_source"] = False # _id, _score 만 반환 (get_hydrated_docs 에서 top-k 만 조회)
+
+        return query
+
+    @classmethod
+    def _get_lexical_query(cls, **kwargs):
+        '''
+        lexical search 쿼리 생성
+        '''
+        query = opensearch_utils.get_query(
+            query=kwargs["query"],
+            minimum_should_match=kwargs.get("minimum_should_match", 0),
+            filter=kwargs["filter"]
+        )
+        query["size"] = kwargs["k"]
+        if kwargs.get("two_phase", False):
+            query["_source"] = False
+
+        return query
+
+    @classmethod
+    def _get_search_results_docs(cls, search_results, hybrid=False):
+        '''
+        OpenSearch 검색 결과를 정규화된 score 의 SearchHits (hybrid, fusion 입력) 또는 Document 리스트로 변환
+        '''
+        hits = SearchHits.from_response(search_results)
+
+        return hits if hybrid else hits.to_documents()
+
     @classmethod
     # semantic search based
     def get_semantic_similar_docs(cls, **kwargs):
@@ -866,25 +881,7 @@ class retriever_utils():
         assert "os_client" in kwargs, "Check your os_client"
         assert "index_name" in kwargs, "Check your index_name"
 
-        def normalize_search_results(search_results):
-
-            hits = (search_results["hits"]["hits"])
-            max_score = float(search_results["hits"]["max_score"])
-            for hit in hits:
-                hit["_score"] = float(hit["_score"]) / max_score
-            search_results["hits"]["max_score"] = hits[0]["_score"]
-            search_results["hits"]["hits"] = hits
-            return search_results
-
-        query = opensearch_utils.get_query(
-            query=kwargs["query"],
-            filter=kwargs.get("boolean_filter", []),
-            search_type="semantic", # enable semantic search
-            vector_field="vector_field", # for semantic search  check by using index_info = os_client.indices.get(index=index_name)
-            vector=kwargs["llm_emb"].embed_query(kwargs["query"]),
-            k=kwargs["k"]
-        )
-        query["size"] = kwargs["k"]
+        query = cls._get_semantic_query(**kwargs)
 
         #print ("\nsemantic search query: ")
         #pprint (query)
@@ -895,24 +892,7 @@ class retriever_utils():
             index_name=kwargs["index_name"]
         )
 
-        results = []
-        if search_results["hits"]["hits"]:
-            search_results = normalize_search_results(search_results)
-            for res in search_results["hits"]["hits"]:
-
-                metadata = res["_source"]["metadata"]
-                metadata["id"] = res["_id"]
-
-                doc = Document(
-                    page_content=res["_source"]["text"],
-                    metadata=metadata
-                )
-                if kwargs.get("hybrid", False):
-                    results.append((doc, res["_score"]))
-                else:
-                    results.append((doc))
-
-        return results
+        return cls._get_search_results_docs(search_results, hybrid=kwargs.get("hybrid", False))
 
     @classmethod
     # lexical(keyword) search based (using Amazon OpenSearch)
@@ -923,22 +903,7 @@ class retriever_utils():
         assert "os_client" in kwargs, "Check your os_client"
         assert "index_name" in kwargs, "Check your index_name"
 
-        def normalize_search_results(search_results):
-
-            hits = (search_results["hits"]["hits"])
-            max_score = float(search_results["hits"]["max_score"])
-            for hit in hits:
-                hit["_score"] = float(hit["_score"]) / max_score
-            search_results["hits"]["max_score"] = hits[0]["_score"]
-            search_results["hits"]["hits"] = hits
-            return search_results
-
-        query = opensearch_utils.get_query(
-            query=kwargs["query"],
-            minimum_should_match=kwargs.get("minimum_should_match", 0),
-            filter=kwargs["filter"]
-        )
-        query["size"] = kwargs["k"]
+        query = cls._get_lexical_query(**kwargs)
 
         #print ("\nlexical search query: ")
         #pprint (query)
@@ -949,43 +914,13 @@ class retriever_utils():
             index_name=kwargs["index_name"]
         )
 
-        results = []
-        if search_results["hits"]["hits"]:
-            search_results = normalize_search_results(search_results)
-            for res in search_results["hits"]["hits"]:
-
-                metadata = res["_source"]["metadata"]
-                metadata["id"] = res["_id"]
-
-                doc = Document(
-                    page_content=res["_source"]["text"],
-                    metadata=metadata
-                )
-                if kwargs.get("hybrid", False):
-                    results.append((doc, res["_score"]))
-                else:
-                    results.append((doc))
-
-        return results
+        return cls._get_search_results_docs(search_results, hybrid=kwargs.get("hybrid", False))
 
     @classmethod
-    # rag-fusion based
-    def get_rag_fusion_similar_docs(cls, **kwargs):
-
-        search_types = ["approximate_search", "script_scoring", "painless_scripting"]
-        space_types = ["l2", "l1", "linf", "cosinesimil", "innerproduct", "hammingbit"]
-
-        assert "llm_emb" in kwargs, "Check your llm_emb"
-        assert "query" in kwargs, "Check your query"
-        assert "query_transformation_prompt" in kwargs, "Check your query_transformation_prompt"
-        assert kwargs.get("search_type", "approximate_search") in search_types, f'Check your search_type: {search_types}'
-        assert kwargs.get("space_type", "l2") in space_types, f'Check your space_type: {space_types}'
-        assert kwargs.get("llm_text", None) != None, "Check your llm_text"
-
-        llm_text = kwargs["llm_text"]
-        query_augmentation_size = kwargs["query_augmentation_size"]
-        query_transformation_prompt = kwargs["query_transformation_prompt"]
-
+    def _get_rag_fusion_chain(cls, llm_text, query_transformation_prompt, split=True):
+        '''
+        split=False 이면 줄 단위로 나누지 않은 문자열을 출력 (astream 으로 streaming 할 때 사용)
+        '''
         generate_queries = (
             {
                 "query": itemgetter("query"),
@@ -994,117 +929,129 @@ class retriever_utils():
             | query_transformation_prompt
             | llm_text
             | StrOutputParser()
-            | (lambda x: x.split("\n"))
         )
-        rag_fusion_query = generate_queries.invoke(
+        if split:
+            generate_queries = generate_queries | (lambda x: x.split("\n"))
+
+        return generate_queries
+
+    @classmethod
+    def _get_rag_fusion_queries(cls, query, rag_fusion_query, query_augmentation_size):
+        '''
+        LLM 이 생성한 쿼리 정리 (빈 줄 제거, 개수 제한, 원본 쿼리를 맨 앞에 추가)
+        '''
+        rag_fusion_query = [q for q in rag_fusion_query if q != ""]
+        if len(rag_fusion_query) > query_augmentation_size: rag_fusion_query = rag_fusion_query[-query_augmentation_size:]
+        rag_fusion_query.insert(0, query)
+
+        return rag_fusion_query
+
+    @classmethod
+    def _get_hyde_chain(cls, template_type, llm_text):
+
+        chain = (
             {
-                "query": kwargs["query"],
-                "query_augmentation_size": kwargs["query_augmentation_size"]
+                "query": itemgetter("query")
             }
+            | prompt_repo.get_hyde(template_type)
+            | llm_text
+            | StrOutputParser()
         )
-        rag_fusion_query = [query for query in rag_fusion_query if query != ""]
-        if len(rag_fusion_query) > query_augmentation_size: rag_fusion_query = rag_fusion_query[-query_augmentation_size:]
-        rag_fusion_query.insert(0, kwargs["query"])
+        return chain
 
-        if kwargs["verbose"]:
-            print("\n")
-            print("===== RAG-Fusion Queries =====")
-            print(rag_fusion_query)
-
-        tasks = []
-        for query in rag_fusion_query:
-            semantic_search = partial(
-                cls.get_semantic_similar_docs,
-                os_client=kwargs["os_client"],
-                index_name=kwargs["index_name"],
-                query=query,
-                k=kwargs["k"],
-                boolean_filter=kwargs.get("boolean_filter", []),
-                llm_emb=kwargs["llm_emb"],
-                hybrid=True
-            )
-            tasks.append(cls.rag_fusion_pool.apply_async(semantic_search,))
-        rag_fusion_docs = [task.get() for task in tasks]
-
-        similar_docs = cls.get_ensemble_results(
-            doc_lists=rag_fusion_docs,
-            weights=[1/(query_augmentation_size+1)]*(query_augmentation_size+1), #query_augmentation_size + original query
-            algorithm=kwargs.get("fusion_algorithm", "RRF"), # ["RRF", "simple_weighted"]
-            c=60,
-            k=kwargs["k"],
-        )
+    @classmethod
+    # rag-fusion based
+    def get_rag_fusion_similar_docs(cls, **kwargs):
 
-        return similar_docs
+        from local_utils.async_rag import async_retriever_utils
+
+        return async_retriever_utils.run_sync(
+            async_retriever_utils.get_rag_fusion_similar_docs(**kwargs)
+        )
 
     @classmethod
     # HyDE based
     def get_hyde_similar_docs(cls, **kwargs):
 
-        def _get_hyde_response(query, prompt, llm_text):
+        from local_utils.async_rag import async_retriever_utils
 
-            chain = (
-                {
-                    "query": itemgetter("query")
-                }
-                | prompt
-                | llm_text
-                | StrOutputParser()
-            )
-            return chain.invoke({"query": query})
+        return async_retriever_utils.run_sync(
+            async_retriever_utils.get_hyde_similar_docs(**kwargs)
+        )
 
-        search_types = ["approximate_search", "script_scoring", "painless_scripting"]
-        space_types = ["l2", "l1", "linf", "cosinesimil", "innerproduct", "hammingbit"]
+    @classmethod
+    def _get_parent_info(cls, child_search_results):
+        '''
+        child 검색 결과로부터 parent_id 별 (최초 rank, score) 정리
+        '''
+        parent_info = {}
+        for rank, (doc, score) in enumerate(child_search_results):
+            parent_id = doc.metadata["parent_id"]
+            if parent_id not in parent_info:
+                parent_info[parent_id] = (rank+1, score)
+        parent_ids = sorted(parent_info.items(), key=lambda x: x[1], reverse=False)
+        parent_ids = list(map(lambda x:x[0], parent_ids))
 
-        assert "llm_emb" in kwargs, "Check your llm_emb"
-        assert "query" in kwargs, "Check your query"
-        assert "hyde_query" in kwargs, "Check your hyde_query"
-        assert kwargs.get("search_type", "approximate_search") in search_types, f'Check your search_type: {search_types}'
-        assert kwargs.get("space_type", "l2") in space_types, f'Check your space_type: {space_types}'
-        assert kwargs.get("llm_text", None) != None, "Check your llm_text"
-
-        query = kwargs["query"]
-        llm_text = kwargs["llm_text"]
-        hyde_query = kwargs["hyde_query"]
-
-        tasks = []
-        for template_type in hyde_query:
-            hyde_response = partial(
-                _get_hyde_response,
-                query=query,
-                prompt=prompt_repo.get_hyde(template_type),
-                llm_text=llm_text
-            )
-            tasks.append(cls.hyde_pool.apply_async(hyde_response,))
-        hyde_answers = [task.get() for task in tasks]
-        hyde_answers.insert(0, query)
-
-        tasks = []
-        for hyde_answer in hyde_answers:
-            semantic_search = partial(
-                cls.get_semantic_similar_docs,
-                os_client=kwargs["os_client"],
-                index_name=kwargs["index_name"],
-                query=hyde_answer,
-                k=kwargs["k"],
-                boolean_filter=kwargs.get("boolean_filter", []),
-                llm_emb=kwargs["llm_emb"],
-                hybrid=True
+        return parent_info, parent_ids
+
+    @classmethod
+    def _get_parent_sources(cls, parent_docs):
+        '''
+        mget 응답을 {parent_id: _source} 로 변환 (찾지 못한 문서는 제외)
+        '''
+        return {res["_id"]: res["_source"] for res in parent_docs["docs"] if res.get("found", True)}
+
+    @classmethod
+    def _get_unhydrated_ids(cls, similar_docs):
+
+        return [doc.metadata["id"] for doc, _ in similar_docs if doc.metadata.get(cls.unhydrated_key, False)]
+
+    @classmethod
+    def _get_hydrated_docs(cls, similar_docs, sources):
+        '''
+        two_phase 결과의 빈 Document 를 {_id: _source} 로 채움 (찾지 못한 문서는 제외, 순서와 score 유지)
+        '''
+        hydrated_docs = []
+        for doc, score in similar_docs:
+            if doc.metadata.get(cls.unhydrated_key, False):
+                doc_id = doc.metadata["id"]
+                source = sources.get(doc_id, None)
+                if source is None:
+                    continue
+                if isinstance(source, Document):
+                    doc = source
+                else:
+                    doc = Document(page_content=source["text"], metadata={**source["metadata"], "id": doc_id})
+            hydrated_docs.append((doc, score))
+
+        return hydrated_docs
+
+    @classmethod
+    def _get_cached_parent_sources(cls, parent_cache, index_name, parent_ids):
+        '''
+        parent_cache (ParentDocumentCache) 에 있는 parent 와 mget 이 필요한 parent_id 리스트
+        '''
+        parent_sources = {} if parent_cache is None else parent_cache.get_many(index_name, parent_ids)
+        missing_ids = [parent_id for parent_id in parent_ids if parent_id not in parent_sources]
+
+        return parent_sources, missing_ids
+
+    @classmethod
+    def _get_parent_docs(cls, parent_sources, parent_ids, parent_info, hybrid):
+
+        similar_docs = []
+        for parent_id in parent_ids:
+            source = parent_sources.get(parent_id, None)
+            if source is None:
+                continue
+            doc = Document(
+                page_content=source["text"],
+                metadata=dict(source["metadata"])
             )
-            tasks.append(cls.hyde_pool.apply_async(semantic_search,))
-        hyde_docs = [task.get() for task in tasks]
-        hyde_doc_size = len(hyde_docs)
-
-        similar_docs = cls.get_ensemble_results(
-            doc_lists=hyde_docs,
-            weights=[1/(hyde_doc_size)]*(hyde_doc_size), #query_augmentation_size + original query
-            algorithm=kwargs.get("fusion_algorithm", "RRF"), # ["RRF", "simple_weighted"]
-            c=60,
-            k=kwargs["k"],
-        )
-        if kwargs["verbose"]:
-            print("\n")
-            print("===== HyDE Answers =====")
-            print(hyde_answers)
+            if hybrid:
+                similar_docs.append((doc, parent_info[parent_id][1]))
+            else:
+                similar_docs.append((doc))
 
         return similar_docs
 
@@ -1113,32 +1060,23 @@ class retriever_utils():
     def get_parent_document_similar_docs(cls, **kwargs):
 
         child_search_results = kwargs["similar_docs"]
+        parent_cache = kwargs.get("parent_cache", None)
 
-        parent_info = {}
-        for rank, (doc, score) in enumerate(child_search_results):
-            parent_id = doc.metadata["parent_id"]
-            if parent_id not in parent_info:
-                parent_info[parent_id] = (rank+1, score)
-        parent_ids = sorted(parent_info.items(), key=lambda x: x[1], reverse=False)
-        parent_ids = list(map(lambda x:x[0], parent_ids))
+        parent_info, parent_ids = cls._get_parent_info(child_search_results)
+        parent_sources, missing_ids = cls._get_cached_parent_sources(parent_cache, kwargs["index_name"], parent_ids)
 
-        parent_docs = opensearch_utils.get_documents_by_ids(
-            os_client=kwargs["os_client"],
-            ids=parent_ids,
-            index_name=kwargs["index_name"],
-        )
-        similar_docs = []
-        if parent_docs["docs"]:
-            for res in parent_docs["docs"]:
-                doc_id = res["_id"]
-                doc = Document(
-                    page_content=res["_source"]["text"],
-                    metadata=res["_source"]["metadata"]
-                )
-                if kwargs["hybrid"]:
-                    similar_docs.append((doc, parent_info[doc_id][1]))
-                else:
-                    similar_docs.append((doc))
+        if missing_ids:
+            parent_docs = opensearch_utils.get_documents_by_ids(
+                os_client=kwargs["os_client"],
+                ids=missing_ids,
+                index_name=kwargs["index_name"],
+            )
+            fetched_sources = cls._get_parent_sources(parent_docs)
+            if parent_cache is not None:
+                parent_cache.set_many(kwargs["index_name"], fetched_sources)
+            parent_sources.update(fetched_sources)
+
+        similar_docs = cls._get_parent_docs(parent_sources, parent_ids, parent_info, kwargs["hybrid"])
 
         if kwargs["verbose"]:
             print("===== ParentDocument =====")
@@ -1146,34 +1084,92 @@ class retriever_utils():
             print (f'# child_docs: {len(child_search_results)}')
             print (f'# parent docs: {len(similar_docs)}')
             print (f'# duplicates: {len(child_search_results)-len(similar_docs)}')
+            print (f'# parent cache hits: {len(parent_ids)-len(missing_ids)}')
 
 
         return similar_docs
 
     @classmethod
-    def get_rerank_docs(cls, **kwargs):
+    def get_num_tokens(cls, llm_text, text):
+        '''
+        llm_text.get_num_tokens 의 memo 버전 (key: 모델 + text hash)
+        '''
+        model = getattr(llm_text, "model_id", None) or type(llm_text).__name__
+        key = (model, hashlib.sha1(text.encode("utf-8")).hexdigest())
 
-        assert "reranker_endpoint_name" in kwargs, "Check your reranker_endpoint_name"
-        assert "k" in kwargs, "Check your k"
+        num_tokens = cls.token_count_cache.get(key)
+        if num_tokens is None:
+            num_tokens = llm_text.get_num_tokens(text)
+            cls.token_count_cache.set(key, num_tokens)
+
+        return num_tokens
+
+    @classmethod
+    def get_rerank_segments(cls, llm_text, text):
+        '''
+        text_splitter 로 분할한 rerank 용 segment 의 text 안 위치 (start, end) 와 token 수.
+        segment text 를 복사해 두지 않으므로 metadata 에 저장해도 _source 가 커지지 않음
+        '''
+        segments, start = [], 0
+        for segment in cls.text_splitter.split_text(text):
+            position = text.find(segment, start)
+            if position < 0: # splitter 가 text 를 바꾼 경우 (일반적으로 없음) 에만 text 를 저장
+                segments.append({"text": segment, "token_count": cls.get_num_tokens(llm_text, segment)})
+                continue
+            start = position + 1 # 다음 segment 는 overlap 이 있어도 이 segment 보다 뒤에서 시작
+            segments.append({"start": position, "end": position + len(segment), "token_count": cls.get_num_tokens(llm_text, segment)})
+
+        return segments
+
+    @classmethod
+    def _get_segment_text(cls, text, segment):
+
+        return segment["text"] if "text" in segment else text[segment["start"]:segment["end"]]
+
+    @classmethod
+    def get_rerank_metadata(cls, llm_text, text):
+        '''
+        ingestion 시 chunk metadata 에 저장할 rerank 정보.
+        * token_count: chunk 의 token 수
+        * rerank_segments: (token_limit - rerank_query_token_reserve) 를 넘는 chunk 만, 미리 분할한 segment 의 위치와 token 수
+        (KNNIndexProfile 의 mapping 은 metadata.rerank_segments 를 "enabled": false 로 두어 색인하지 않음)
+        '''
+        rerank_metadata = {"token_count": cls.get_num_tokens(llm_text, text)}
+        if rerank_metadata["token_count"] > cls.token_limit - cls.rerank_query_token_reserve:
+            rerank_metadata["rerank_segments"] = cls.get_rerank_segments(llm_text, text)
+
+        return rerank_metadata
 
+    @classmethod
+    def _get_rerank_inputs(cls, **kwargs):
+        '''
+        reranker 입력 생성. token_limit 를 넘는 context 는 분할 후 길이 정보를 함께 저장.
+        metadata 에 token_count / rerank_segments 가 있으면 (ingestion 시 precompute) tokenizer / splitter 를 호출하지 않음
+        '''
         contexts, query, llm_text, rerank_queries = kwargs["context"], kwargs["query"], kwargs["llm_text"], {"inputs":[]}
+        query_tokens = cls.get_num_tokens(llm_text, query)
 
         exceed_info = []
         for idx, (context, score) in enumerate(contexts):
             page_content = context.page_content
-            token_size = llm_text.get_num_tokens(query+page_content)
+            token_count = context.metadata.get("token_count", None)
+            if token_count is None:
+                token_count = cls.get_num_tokens(llm_text, page_content)
+            token_size = query_tokens + token_count
             exceed_flag = False
 
             if token_size > cls.token_limit:
                 exceed_flag = True
-                splited_docs = cls.text_splitter.split_documents([context])
-                if kwargs["verbose"]:
-                    print(f"\n[Exeeds ReRanker token limit] Number of chunk_docs after split and chunking= {len(splited_docs)}\n")
+                segments = context.metadata.get("rerank_segments", None)
+                if segments is None:
+                    segments = cls.get_rerank_segments(llm_text, page_content)
+                if kwargs.get("verbose", False):
+                    print(f"\n[Exeeds ReRanker token limit] Number of chunk_docs after split and chunking= {len(segments)}\n")
 
                 partial_set, length = [], []
-                for splited_doc in splited_docs:
-                    rerank_queries["inputs"].append({"text": query, "text_pair": splited_doc.page_content})
-                    length.append(llm_text.get_num_tokens(splited_doc.page_content))
+                for segment in segments:
+                    rerank_queries["inputs"].append({"text": query, "text_pair": cls._get_segment_text(page_content, segment)})
+                    length.append(segment["token_count"])
                     partial_set.append(len(rerank_queries["inputs"])-1)
             else:
                 rerank_queries["inputs"].append({"text": query, "text_pair": page_content})
@@ -1183,16 +1179,13 @@ class retriever_utils():
             else:
                 exceed_info.append([idx, exceed_flag, len(rerank_queries["inputs"])-1, None])
 
-        rerank_queries = json.dumps(rerank_queries)
-
-        response = cls.runtime_client.invoke_endpoint(
-            EndpointName=kwargs["reranker_endpoint_name"],
-            ContentType="application/json",
-            Accept="application/json",
-            Body=rerank_queries
-        )
-        outs = json.loads(response['Body'].read().decode()) ## for json
+        return rerank_queries, exceed_info
 
+    @classmethod
+    def _get_rerank_contexts(cls, contexts, outs, exceed_info, k):
+        '''
+        reranker 출력 score 를 context 에 다시 매핑 (분할된 context 는 길이 가중 평균)
+        '''
         rerank_contexts = []
         for idx, exceed_flag, partial_set, length in exceed_info:
             if not exceed_flag:
@@ -1209,257 +1202,61 @@ class retriever_utils():
             reverse=True
         )
 
-        return rerank_contexts[:kwargs["k"]]
+        return rerank_contexts[:k]
 
     @classmethod
-    # hybrid (lexical + semantic) search based
-    def search_hybrid(cls, **kwargs):
-
-        assert "query" in kwargs, "Check your query"
-        assert "llm_emb" in kwargs, "Check your llm_emb"
-        assert "index_name" in kwargs, "Check your index_name"
-        assert "os_client" in kwargs, "Check your os_client"
-
-        rag_fusion = kwargs.get("rag_fusion", False)
-        hyde = kwargs.get("hyde", False)
-        parent_document = kwargs.get("parent_document", False)
-
-        assert (rag_fusion + hyde) <= 1, "choose only one between RAG-FUSION and HyDE"
-        if rag_fusion:
-            assert "query_augmentation_size" in kwargs, "if you use RAG-FUSION, Check your query_augmentation_size"
-        if hyde:
-            assert "hyde_query" in kwargs, "if you use HyDE, Check your hyde_query"
-
-        verbose = kwargs.get("verbose", False)
-        async_mode = kwargs.get("async_mode", True)
-        reranker = kwargs.get("reranker", False)
-        search_filter = deepcopy(kwargs.get("filter", []))
-        if parent_document:
-            search_filter.append({"term": {"metadata.family_tree": "child"}})
-
-        def do_sync():
-
-            if rag_fusion:
-                similar_docs_semantic = cls.get_rag_fusion_similar_docs(
-                    index_name=kwargs["index_name"],
-                    os_client=kwargs["os_client"],
-                    llm_emb=kwargs["llm_emb"],
-
-                    query=kwargs["query"],
-                    k=kwargs.get("k", 5) if not reranker else int(kwargs["k"]*1.5),
-                    boolean_filter=search_filter,
-                    hybrid=True,
-
-                    llm_text=kwargs.get("llm_text", None),
-                    query_augmentation_size=kwargs["query_augmentation_size"],
-                    query_transformation_prompt=kwargs.get("query_transformation_prompt", None),
-                    fusion_algorithm=kwargs.get("fusion_algorithm", "RRF"), # ["RRF", "simple_weighted"]
-
-                    verbose=kwargs.get("verbose", False),
-                )
-            elif hyde:
-                similar_docs_semantic = cls.get_hyde_similar_docs(
-                    index_name=kwargs["index_name"],
-                    os_client=kwargs["os_client"],
-                    llm_emb=kwargs["llm_emb"],
-
-                    query=kwargs["query"],
-                    k=kwargs.get("k", 5) if not reranker else int(kwargs["k"]*1.5),
-                    boolean_filter=search_filter,
-                    hybrid=True,
-
-                    llm_text=kwargs.get("llm_text", None),
-                    hyde_query=kwargs["hyde_query"],
-                    fusion_algorithm=kwargs.get("fusion_algorithm", "RRF"), # ["RRF", "simple_weighted"]
-
-                    verbose=kwargs.get("verbose", False),
-                )
-            else:
-                similar_docs_semantic = cls.get_semantic_similar_docs(
-                    index_name=kwargs["index_name"],
-                    os_client=kwargs["os_client"],
-                    llm_emb=kwargs["llm_emb"],
-
-                    query=kwargs["query"],
-                    k=kwargs.get("k", 5) if not reranker else int(kwargs["k"]*1.5),
-                    boolean_filter=search_filter,
-                    hybrid=True
-                )
-
-            similar_docs_keyword = cls.get_lexical_similar_docs(
-                index_name=kwargs["index_name"],
-                os_client=kwargs["os_client"],
-
-                query=kwargs["query"],
-                k=kwargs.get("k", 5) if not reranker else int(kwargs["k"]*1.5),
-                minimum_should_match=kwargs.get("minimum_should_match", 0),
-                filter=search_filter,
-                hybrid=True
-            )
-
-            return similar_docs_semantic, similar_docs_keyword
-
-        def do_async():
-
-            if rag_fusion:
-                semantic_search = partial(
-                    cls.get_rag_fusion_similar_docs,
-                    index_name=kwargs["index_name"],
-                    os_client=kwargs["os_client"],
-                    llm_emb=kwargs["llm_emb"],
-
-                    query=kwargs["query"],
-                    k=kwargs.get("k", 5) if not reranker else int(kwargs["k"]*1.5),
-                    boolean_filter=search_filter,
-                    hybrid=True,
-
-                    llm_text=kwargs.get("llm_text", None),
-                    query_augmentation_size=kwargs["query_augmentation_size"],
-                    query_transformation_prompt=kwargs.get("query_transformation_prompt", None),
-                    fusion_algorithm=kwargs.get("fusion_algorithm", "RRF"), # ["RRF", "simple_weighted"]
-
-                    verbose=kwargs.get("verbose", False),
-                )
-            elif hyde:
-                semantic_search = partial(
-                    cls.get_hyde_similar_docs,
-                    index_name=kwargs["index_name"],
-                    os_client=kwargs["os_client"],
-                    llm_emb=kwargs["llm_emb"],
-
-                    query=kwargs["query"],
-                    k=kwargs.get("k", 5) if not reranker else int(kwargs["k"]*1.5),
-                    boolean_filter=search_filter,
-                    hybrid=True,
-
-                    llm_text=kwargs.get("llm_text", None),
-                    hyde_query=kwargs["hyde_query"],
-                    fusion_algorithm=kwargs.get("fusion_algorithm", "RRF"), # ["RRF", "simple_weighted"]
-
-                    verbose=kwargs.get("verbose", False),
-                )
-            else:
-                semantic_search = partial(
-                    cls.get_semantic_similar_docs,
-                    index_name=kwargs["index_name"],
-                    os_client=kwargs["os_client"],
-                    llm_emb=kwargs["llm_emb"],
-
-                    query=kwargs["query"],
-                    k=kwargs.get("k", 5) if not reranker else int(kwargs["k"]*1.5),
-                    boolean_filter=search_filter,
-                    hybrid=True
-                )
-
-            lexical_search = partial(
-                cls.get_lexical_similar_docs,
-                index_name=kwargs["index_name"],
-                os_client=kwargs["os_client"],
-
-                query=kwargs["query"],
-                k=kwargs.get("k", 5) if not reranker else int(kwargs["k"]*1.5),
-                minimum_should_match=kwargs.get("minimum_should_match", 0),
-                filter=search_filter,
-                hybrid=True
-            )
-            semantic_pool = cls.pool.apply_async(semantic_search,)
-            lexical_pool = cls.pool.apply_async(lexical_search,)
-            similar_docs_semantic, similar_docs_keyword = semantic_pool.get(), lexical_pool.get()
-
-            return similar_docs_semantic, similar_docs_keyword
+    def _invoke_reranker(cls, reranker_endpoint_name, rerank_queries):
 
-        if async_mode:
-            similar_docs_semantic, similar_docs_keyword = do_async()
-        else:
-            similar_docs_semantic, similar_docs_keyword = do_sync()
-
-        similar_docs = cls.get_ensemble_results(
-            doc_lists=[similar_docs_semantic, similar_docs_keyword],
-            weights=kwargs.get("ensemble_weights", [.51, .49]),
-            algorithm=kwargs.get("fusion_algorithm", "RRF"), # ["RRF", "simple_weighted"]
-            c=60,
-            k=kwargs.get("k", 5) if not reranker else int(kwargs["k"]*1.5),
+        response = cls.runtime_client.invoke_endpoint(
+            EndpointName=reranker_endpoint_name,
+            ContentType="application/json",
+            Accept="application/json",
+            Body=json.dumps(rerank_queries)
         )
-        #print (len(similar_docs_keyword), len(similar_docs_semantic), len(similar_docs))
-        #print ("1-similar_docs")
-        #for i, doc in enumerate(similar_docs): print (i, doc)
-
-        if verbose: 
-            similar_docs_wo_reranker = copy.deepcopy(similar_docs)
+        outs = json.loads(response['Body'].read().decode()) ## for json
 
-        if reranker:
-            reranker_endpoint_name = kwargs["reranker_endpoint_name"]
-            similar_docs = cls.get_rerank_docs(
-                llm_text=kwargs["llm_text"],
-                query=kwargs["query"],
-                context=similar_docs,
-                k=kwargs.get("k", 5),
-                reranker_endpoint_name=reranker_endpoint_name,
-                verbose=verbose
-            )
+        return outs
 
-        #print ("2-similar_docs")
-        #for i, doc in enumerate(similar_docs): print (i, doc)
+    @classmethod
+    def get_rerank_docs(cls, **kwargs):
 
-        if parent_document:
-            similar_docs = cls.get_parent_document_similar_docs(
-                index_name=kwargs["index_name"],
-                os_client=kwargs["os_client"],
-                similar_docs=similar_docs,
-                hybrid=True,
-                boolean_filter=search_filter,
-                verbose=verbose
-            )
+        reranker_service = kwargs.get("reranker_service", None) # MicroBatchReranker
+        assert reranker_service is not None or "reranker_endpoint_name" in kwargs, "Check your reranker_endpoint_name"
+        assert "k" in kwargs, "Check your k"
 
-        if verbose:
-
-            print("##############################")
-            print("async_mode")
-            print("##############################")
-            print(async_mode)
-
-            print("##############################")
-            print("reranker")
-            print("##############################")
-            print(reranker)
-
-            print("##############################")
-            print("rag_fusion")
-            print("##############################")
-            print(rag_fusion)
-
-            print("##############################")
-            print("HyDE")
-            print("##############################")
-            print(hyde)
-
-            print("##############################")
-            print("parent_document")
-            print("##############################")
-            print(parent_document)
-
-            print("##############################")
-            print("similar_docs_semantic")
-            print("##############################")
-            print (opensearch_utils.opensearch_pretty_print_documents_with_score(similar_docs_semantic))
-
-            print("##############################")
-            print("similar_docs_keyword")
-            print("##############################")
-            print (opensearch_utils.opensearch_pretty_print_documents_with_score(similar_docs_keyword))
-            
-            if reranker:
-                print("##############################")
-                print("similar_docs_without_reranker")
-                print("##############################")
-                print (opensearch_utils.opensearch_pretty_print_documents_with_score(similar_docs_wo_reranker))
+        rerank_queries, exceed_info = cls._get_rerank_inputs(**kwargs)
+        if reranker_service is not None:
+            outs = reranker_service.rerank(rerank_queries["inputs"])
+        else:
+            outs = cls._invoke_reranker(kwargs["reranker_endpoint_name"], rerank_queries)
 
-            print("##############################")
-            print("similar_docs")
-            print("##############################")
-            print (opensearch_utils.opensearch_pretty_print_documents_with_score(similar_docs))
+        return cls._get_rerank_contexts(kwargs["context"], outs, exceed_info, kwargs["k"])
 
-        similar_docs = list(map(lambda x:x[0], similar_docs))
+    @classmethod
+    # hybrid (lexical + semantic) search based
+    def search_hybrid(cls, **kwargs):
+        '''
+        async_retriever_utils.search_hybrid 를 공용 event loop 에서 실행.
+        async_mode=False 이면 각 단계를 순차적으로 실행.
+        result_cache (RetrievalResultCache) 가 주어지면 cache hit 은 event loop 를 거치지 않고 바로 반환.
+        latency_budget (초 또는 LatencyBudget) 이 주어지면 시간이 부족할 때 선택 단계를 줄이거나 건너뜀
+        (적용된 degradation 은 반환값 HybridSearchResults 의 .degradations)
+        '''
+        from local_utils.async_rag import async_retriever_utils, HybridSearchResults
+
+        result_cache = kwargs.get("result_cache", None)
+        if result_cache is not None:
+            similar_docs = result_cache.get(**kwargs)
+            if similar_docs is not None:
+                return HybridSearchResults(similar_docs)
+
+        kwargs["latency_budget"] = budget = async_retriever_utils._get_latency_budget(kwargs.get("latency_budget", None))
+        similar_docs = async_retriever_utils.run_sync(
+            async_retriever_utils._search_hybrid(**kwargs),
+            timeout=kwargs.get("timeout", None)
+        )
+        if result_cache is not None and not (budget is not None and budget.degradations):
+            result_cache.set(similar_docs, **kwargs)
 
         return similar_docs
 
@@ -1467,40 +1264,11 @@ class retriever_utils():
     # Score fusion and re-rank (lexical + semantic)
     def get_ensemble_results(cls, doc_lists: List[List[Document]], weights, algorithm="RRF", c=60, k=5) -> List[Document]:
 
-        assert algorithm in ["RRF", "simple_weighted"]
-
-        # Create a union of all unique documents in the input doc_lists
-        all_documents = set()
-
-        for doc_list in doc_lists:
-            for (doc, _) in doc_list:
-                all_documents.add(doc.page_content)
-
-        # Initialize the score dictionary for each document
-        hybrid_score_dic = {doc: 0.0 for doc in all_documents}    
-
-        # Calculate RRF scores for each document
-        for doc_list, weight in zip(doc_lists, weights):
-            for rank, (doc, score) in enumerate(doc_list, start=1):
-                if algorithm == "RRF": # RRF (Reciprocal Rank Fusion)
-                    score = weight * (1 / (rank + c))
-                elif algorithm == "simple_weighted":
-                    score *= weight
-                hybrid_score_dic[doc.page_content] += score
-
-        # Sort documents by their scores in descending order
-        sorted_documents = sorted(
-            hybrid_score_dic.items(), key=lambda x: x[1], reverse=True
+        return fusion_utils.get_ensemble_results(
+            doc_lists=doc_lists,
+            weights=weights,
+            algorithm=algorithm, # fusion_utils.algorithms
+            c=c,
+            k=k
         )
 
-        # Map the sorted page_content back to the original document objects
-        page_content_to_doc_map = {
-            doc.page_content: doc for doc_list in doc_lists for (doc, orig_score) in doc_list
-        }
-
-        sorted_docs = [
-            (page_content_to_doc_map[page_content], hybrid_score) for (page_content, hybrid_score) in sorted_documents
-        ]
-
-        return sorted_docs[:k]
-
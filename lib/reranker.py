@@ -0,0 +1,308 @@
+############################################################
+############################################################
+# Reranker 관련 함수들 (micro-batching reranker service)
+############################################################
+############################################################
+
+import json
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Dict, List
+
+import boto3
+import requests
+import numpy as np
+
+try:
+    import torch
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+except ImportError:
+    torch = None
+
+###########################################
+### Reranker backends
+###########################################
+
+# backend 는 pairs ([{"text": query, "text_pair": context}, ...]) 를 받아
+# 같은 순서의 [{"score": float}, ...] 를 반환 (SageMaker reranker endpoint 응답과 동일한 형식)
+# * SagemakerRerankerBackend: 기존 reranker endpoint (invoke_endpoint)
+# * HTTPRerankerBackend: 같은 {"inputs": [{"text", "text_pair"}]} 프로토콜을 쓰는 local HTTP 서버
+# * CrossEncoderRerankerBackend: transformers cross-encoder 를 프로세스 안에서 실행 (CPU)
+###########################################
+
+class SagemakerRerankerBackend():
+
+    def __init__(self, endpoint_name: str, runtime_client=None):
+
+        self.endpoint_name = endpoint_name
+        self.runtime_client = runtime_client or boto3.Session().client('sagemaker-runtime')
+
+    def __call__(self, pairs: List[Dict[str, str]]) -> List[Dict[str, float]]:
+
+        response = self.runtime_client.invoke_endpoint(
+            EndpointName=self.endpoint_name,
+            ContentType="application/json",
+            Accept="application/json",
+            Body=json.dumps({"inputs": pairs})
+        )
+
+        return json.loads(response['Body'].read().decode())
+
+class HTTPRerankerBackend():
+
+    def __init__(self, url: str, timeout: float=15):
+
+        self.url = url
+        self.model_id = url # RetrievalResultCache key (CachedEmbeddings.get_model_id)
+        self.timeout = timeout
+        self.session = requests.Session() # keep-alive
+
+    def __call__(self, pairs: List[Dict[str, str]]) -> List[Dict[str, float]]:
+
+        response = self.session.post(self.url, json={"inputs": pairs}, timeout=self.timeout)
+        response.raise_for_status()
+
+        return response.json()
+
+class CrossEncoderRerankerBackend():
+
+    def __init__(self, model_name: str="Dongjin-kr/ko-reranker", max_length: int=512, device: str="cpu"):
+
+        assert torch is not None, "torch and transformers are required for CrossEncoderRerankerBackend"
+
+        self.model_name = model_name
+        self.max_length = max_length
+        self.device = device
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_name).to(device).eval()
+
+    def __call__(self, pairs: List[Dict[str, str]]) -> List[Dict[str, float]]:
+
+        inputs = self.tokenizer(
+            [pair["text"] for pair in pairs],
+            [pair["text_pair"] for pair in pairs],
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="pt"
+        ).to(self.device)
+
+        with torch.inference_mode():
+            logits = self.model(**inputs).logits
+        if logits.shape[-1] == 1:
+            scores = torch.sigmoid(logits[:, 0])
+        else:
+            scores = torch.softmax(logits, dim=-1)[:, -1]
+
+        return [{"score": float(score)} for score in scores.cpu()]
+
+###########################################
+### Micro-batching reranker service
+###########################################
+
+# 여러 요청(세션)의 pair 를 모아 backend 를 한 번에 호출하고, 결과를 요청별로 나눠서 돌려줌.
+# 첫 요청이 들어온 뒤 max_wait_ms 동안 또는 pair 가 max_batch_size 개 모일 때까지 기다림.
+# 한 요청의 pair 가 max_batch_size 보다 많으면 여러 batch 로 나뉘어 처리됨.
+# queue 에 max_queue_size 개 요청이 쌓이면 rerank / arerank(block=True) 는 자리가 날 때까지 기다리고
+# (arerank 는 thread 에서 기다리므로 event loop 를 막지 않음), arerank(block=False) 는 바로 queue.Full 을 발생
+#
+# 사용법:
+#   reranker_service = MicroBatchReranker(CrossEncoderRerankerBackend())
+#   retriever_utils.search_hybrid(..., reranker=True, reranker_service=reranker_service)
+###########################################
+
+class MicroBatchReranker():
+
+    def __init__(self, backend, max_batch_size: int=32, max_wait_ms: float=10, max_queue_size: int=1024):
+
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._carry = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "pairs": 0, "batches": 0, "errors": 0, "rejected": 0}
+
+        self._worker = threading.Thread(target=self._run, name="micro-batch-reranker", daemon=True)
+        self._worker.start()
+
+    def submit(self, pairs: List[Dict[str, str]], block: bool=True) -> Future:
+        '''
+        pairs 를 queue 에 넣고 [{"score": float}, ...] 를 결과로 갖는 Future 반환.
+        block=False 이면 queue 가 가득 찼을 때 기다리지 않고 queue.Full 발생
+        '''
+        assert not self._closed, "reranker service is closed"
+
+        future = Future()
+        if not pairs:
+            future.set_result([])
+            return future
+        try:
+            self._queue.put((list(pairs), future), block=block)
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise queue.Full(f"reranker queue is full (max_queue_size={self._queue.maxsize})") from None
+
+        return future
+
+    def rerank(self, pairs: List[Dict[str, str]], timeout=None) -> List[Dict[str, float]]:
+
+        return self.submit(pairs).result(timeout=timeout)
+
+    async def arerank(self, pairs: List[Dict[str, str]], block: bool=False) -> List[Dict[str, float]]:
+
+        if block:
+            future = await asyncio.to_thread(self.submit, pairs)
+        else:
+            future = self.submit(pairs, block=False)
+
+        return await asyncio.wrap_future(future)
+
+    def _collect(self, first):
+        '''
+        첫 요청 이후 max_wait 동안 (또는 max_batch_size 개 pair 가 모일 때까지) 요청을 모음
+        '''
+        requests_, n_pairs = [first], len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while n_pairs < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None) # close 신호는 다음 루프에서 처리
+                break
+            if n_pairs + len(request[0]) > self.max_batch_size:
+                self._carry = request # batch 를 넘치게 하는 요청은 다음 batch 의 첫 요청으로
+                break
+            requests_.append(request)
+            n_pairs += len(request[0])
+
+        return requests_
+
+    def _run(self):
+
+        while True:
+            first, self._carry = self._carry or self._queue.get(), None
+            if first is None:
+                break
+            requests_ = [request for request in self._collect(first) if request[1].set_running_or_notify_cancel()]
+            if not requests_:
+                continue
+
+            pairs = [pair for request_pairs, _ in requests_ for pair in request_pairs]
+            try:
+                outs = []
+                for start in range(0, len(pairs), self.max_batch_size):
+                    outs.extend(self.backend(pairs[start:start+self.max_batch_size]))
+                    with self._lock:
+                        self._stats["batches"] += 1
+            except Exception as e:
+                with self._lock:
+                    self._stats["errors"] += 1
+                for _, future in requests_:
+                    future.set_exception(e)
+                continue
+
+            with self._lock:
+                self._stats["requests"] += len(requests_)
+                self._stats["pairs"] += len(pairs)
+
+            start = 0
+            for request_pairs, future in requests_:
+                future.set_result(outs[start:start+len(request_pairs)])
+                start += len(request_pairs)
+
+    def close(self):
+
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._worker.join()
+
+    def stats(self):
+
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_batch_size"] = stats["pairs"] / stats["batches"] if stats["batches"] else 0.0
+
+        return stats
+
+###########################################
+### Cascade reranking
+###########################################
+
+# cross-encoder 앞단의 저비용 1단계: fusion 후보를 query 벡터와 chunk 벡터의 cosine 으로 다시 점수화하고
+# 상위 M 개만 get_rerank_docs 로 보냄.
+# M 은 [k, max_m] 범위에서 cosine score 가 가장 크게 떨어지는 지점 (gap >= gap_ratio * score 범위) 으로 정하고,
+# 뚜렷한 gap 이 없으면 max_m.
+# chunk 벡터를 찾지 못한 후보는 탈락시키지 않고 1단계를 통과시킴.
+###########################################
+
+class cascade_utils():
+
+    @classmethod
+    def get_cosine_scores(cls, query_vector, doc_vectors):
+        '''
+        query_vector (d,), doc_vectors (n, d) -> cosine (n,) (행렬곱 한 번)
+        '''
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        doc_vectors = np.asarray(doc_vectors, dtype=np.float32)
+        doc_norms = np.linalg.norm(doc_vectors, axis=1)
+        doc_norms[doc_norms == 0] = 1.0
+
+        return (doc_vectors @ query_vector) / (doc_norms * (np.linalg.norm(query_vector) or 1.0))
+
+    @classmethod
+    def get_adaptive_m(cls, sorted_scores, min_m, max_m, gap_ratio=0.15):
+        '''
+        내림차순 score 에서 [min_m, max_m] 안의 가장 큰 gap 위치 (없으면 max_m)
+        '''
+        n = len(sorted_scores)
+        min_m, max_m = min(min_m, n), min(max_m, n)
+        if max_m <= min_m:
+            return max_m
+
+        gaps = sorted_scores[min_m-1:max_m-1] - sorted_scores[min_m:max_m]
+        spread = sorted_scores[0] - sorted_scores[-1]
+        best = int(np.argmax(gaps))
+        if spread > 0 and gaps[best] >= gap_ratio * spread:
+            return min_m + best
+
+        return max_m
+
+    @classmethod
+    def get_cascade_candidates(cls, query_vector, candidates, vectors, k, max_m=None, gap_ratio=0.15):
+        '''
+        candidates: [(Document, score)], vectors: {metadata["id"]: vector}
+        -> (cross-encoder 로 보낼 [(Document, cosine)], 1단계 정보)
+        '''
+        max_m = max_m or int(k*1.5)
+        ids = [doc.metadata.get("id", None) for doc, _ in candidates]
+        has_vector = np.asarray([doc_id in vectors for doc_id in ids], dtype=bool)
+
+        scores = np.full(len(candidates), np.inf, dtype=np.float32) # 벡터가 없으면 통과
+        if has_vector.any():
+            scores[has_vector] = cls.get_cosine_scores(
+                query_vector,
+                np.stack([vectors[doc_id] for doc_id, found in zip(ids, has_vector) if found])
+            )
+
+        order = np.argsort(-scores, kind="stable")
+        finite_scores = scores[order][np.isfinite(scores[order])]
+        n_passed = int((~has_vector).sum())
+        m = n_passed + cls.get_adaptive_m(finite_scores, max(k-n_passed, 1), max(max_m-n_passed, 1), gap_ratio) if len(finite_scores) else n_passed
+        m = max(min(m, len(candidates)), min(k, len(candidates)))
+
+        cascade_docs = [(candidates[idx][0], float(scores[idx])) for idx in order[:m]]
+        info = {"candidates": len(candidates), "without_vector": n_passed, "m": m}
+
+        return cascade_docs, info
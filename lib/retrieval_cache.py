@@ -0,0 +1,271 @@
+############################################################
+############################################################
+# Retrieval 결과 캐시 관련 함수들
+############################################################
+############################################################
+
+import json
+import hashlib
+
+from local_utils.cache import LRUTTLCache, normalize_text
+from local_utils.embedding_cache import CachedEmbeddings
+from local_utils.opensearch import opensearch_utils
+
+###########################################
+### search_hybrid result cache
+###########################################
+
+# 매개변수 (Parameters):
+# * maxsize, ttl: 최대 항목 수와 만료 시간(초)
+# * invalidate_on_write: True 이면 opensearch_utils 의 index 쓰기(add_doc, create_index, delete_index)
+#   또는 local store (LocalVectorStore / LocalLexicalStore) 의 add 시점에 해당 index / store 의 캐시 항목을 모두 제거
+#
+# key 는 (namespace, 옵션 JSON). namespace 는 검색에 쓰는 index_name 과 local store 이름 (store.name) 의 tuple 이므로
+# index_name=None 인 서로 다른 local store 가 같은 key 를 쓰지 않음
+###########################################
+
+class RetrievalResultCache():
+
+    # 검색 결과에 영향을 주는 search_hybrid 옵션 (key 에 포함)
+    key_options = {
+        "k": 5,
+        "filter": [],
+        "ensemble_weights": [.51, .49],
+        "fusion_algorithm": "RRF",
+        "minimum_should_match": 0,
+        "rag_fusion": False,
+        "query_augmentation_size": None,
+        "hyde": False,
+        "hyde_query": None,
+        "reranker": False,
+        "cascade": False,
+        "cascade_depth": None, # None 이면 k*4
+        "cascade_max_m": None, # None 이면 int(k*1.5)
+        "cascade_gap_ratio": 0.15,
+        "parent_document": False,
+        "server_side_hybrid": False,
+        "hybrid_normalization": "min_max",
+        "hybrid_combination": "arithmetic_mean",
+        "ef_search": None,
+        "binary_search": False,
+        "binary_oversample": 10,
+        "binary_vector_field": "binary_vector_field",
+        "space_type": "cosinesimil",
+        "query_transformation_prompt": None,
+        "reranker_endpoint_name": None,
+    }
+    # 결과에 영향을 주는 모델 (key 에는 CachedEmbeddings.get_model_id 를 포함, reranker_service 는 backend 의 id)
+    model_options = ["llm_emb", "llm_text", "reranker_service"]
+    # search backend 로 쓰는 local store (key 의 namespace 에 store.name 을 포함)
+    store_options = ["vector_store", "lexical_store"]
+
+    def __init__(self, maxsize=1024, ttl=60*10, invalidate_on_write=True):
+
+        self.cache = LRUTTLCache(maxsize=maxsize, ttl=ttl)
+        if invalidate_on_write:
+            opensearch_utils.register_index_write_hook(self.invalidate)
+
+    def get_namespace(self, **kwargs):
+        '''
+        (index_name, local store 이름, ...): 이 중 하나에 쓰기가 일어나면 항목 제거
+        '''
+        namespace = [kwargs.get("index_name", None)]
+        for name in self.store_options:
+            store = kwargs.get(name, None)
+            if store is not None:
+                namespace.append(store.name)
+
+        return tuple(namespace)
+
+    def get_key(self, **kwargs):
+        '''
+        (namespace, 정규화된 query + 옵션 + 모델 id 의 canonical JSON)
+        '''
+        options = {name: kwargs.get(name, default) for name, default in self.key_options.items()}
+        for name in self.model_options:
+            model = kwargs.get(name, None)
+            if name == "reranker_service" and model is not None:
+                model = model.backend # MicroBatchReranker
+            options[name] = None if model is None else CachedEmbeddings.get_model_id(model)
+        options["query"] = normalize_text(kwargs["query"])
+
+        return (self.get_namespace(**kwargs), json.dumps(options, sort_keys=True, ensure_ascii=False, default=str))
+
+    def get(self, **kwargs):
+        '''
+        캐시된 결과 (List[Document]) 또는 None. Document 객체는 캐시와 공유되므로 수정하지 말 것
+        '''
+        similar_docs = self.cache.get(self.get_key(**kwargs))
+
+        return None if similar_docs is None else list(similar_docs)
+
+    def set(self, similar_docs, **kwargs):
+
+        self.cache.set(self.get_key(**kwargs), tuple(similar_docs))
+
+    def invalidate(self, index_name=None):
+        '''
+        index_name (또는 local store 이름) 을 namespace 에 포함한 항목 제거 (None 이면 전체)
+        '''
+        if index_name is None:
+            removed = len(self.cache)
+            self.cache.clear()
+            return removed
+
+        return self.cache.pop_if(lambda key, value: index_name in key[0])
+
+    def close(self):
+
+        opensearch_utils.unregister_index_write_hook(self.invalidate)
+
+    def stats(self):
+
+        return self.cache.stats()
+
+###########################################
+### ParentDocument cache
+###########################################
+
+# get_parent_document_similar_docs 에서 mget 전에 조회하는 parent 문서(_source) 캐시.
+# 자주 조회되는 parent 는 OpenSearch 왕복 없이 반환
+###########################################
+
+class ParentDocumentCache():
+
+    def __init__(self, maxsize=10000, ttl=60*60, invalidate_on_write=True):
+
+        self.cache = LRUTTLCache(maxsize=maxsize, ttl=ttl)
+        if invalidate_on_write:
+            opensearch_utils.register_index_write_hook(self.invalidate)
+
+    def get_many(self, index_name, parent_ids):
+        '''
+        {parent_id: _source} (캐시에 있는 것만)
+        '''
+        parent_sources = {}
+        for parent_id in parent_ids:
+            source = self.cache.get((index_name, parent_id))
+            if source is not None:
+                parent_sources[parent_id] = source
+
+        return parent_sources
+
+    def set_many(self, index_name, parent_sources):
+
+        for parent_id, source in parent_sources.items():
+            self.cache.set((index_name, parent_id), source)
+
+    def invalidate(self, index_name=None):
+
+        if index_name is None:
+            removed = len(self.cache)
+            self.cache.clear()
+            return removed
+
+        return self.cache.pop_if(lambda key, value: key[0] == index_name)
+
+    def close(self):
+
+        opensearch_utils.unregister_index_write_hook(self.invalidate)
+
+    def stats(self):
+
+        return self.cache.stats()
+
+###########################################
+### Chunk vector cache
+###########################################
+
+# cascade reranking (cascade_utils) 에서 후보 chunk 의 벡터를 mget 없이 재사용하기 위한 캐시.
+# {(index_name, _id): np.float32 벡터}
+###########################################
+
+class ChunkVectorCache():
+
+    def __init__(self, maxsize=50000, ttl=60*60, invalidate_on_write=True):
+
+        self.cache = LRUTTLCache(maxsize=maxsize, ttl=ttl)
+        if invalidate_on_write:
+            opensearch_utils.register_index_write_hook(self.invalidate)
+
+    def get_many(self, index_name, ids):
+        '''
+        {_id: vector} (캐시에 있는 것만)
+        '''
+        vectors = {}
+        for doc_id in ids:
+            vector = self.cache.get((index_name, doc_id))
+            if vector is not None:
+                vectors[doc_id] = vector
+
+        return vectors
+
+    def set_many(self, index_name, vectors):
+
+        for doc_id, vector in vectors.items():
+            self.cache.set((index_name, doc_id), vector)
+
+    def invalidate(self, index_name=None):
+
+        if index_name is None:
+            removed = len(self.cache)
+            self.cache.clear()
+            return removed
+
+        return self.cache.pop_if(lambda key, value: key[0] == index_name)
+
+    def close(self):
+
+        opensearch_utils.unregister_index_write_hook(self.invalidate)
+
+    def stats(self):
+
+        return self.cache.stats()
+
+###########################################
+### HyDE cache
+###########################################
+
+# HyDE 가상 문서(LLM 답변)와 그 임베딩 캐시. 프로세스에 하나를 만들어 세션 간에 공유.
+# * 답변 key: (template_type, 정규화된 query, llm 모델)
+# * 벡터 key: (임베딩 모델, 답변 hash)
+# 반복되는 질문은 LLM 생성 / 임베딩 없이 바로 검색
+###########################################
+
+class HyDECache():
+
+    def __init__(self, maxsize=10000, ttl=60*60*24):
+
+        self.cache = LRUTTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get_answer_key(self, template_type, query, llm_text):
+
+        return ("answer", template_type, normalize_text(query), CachedEmbeddings.get_model_id(llm_text))
+
+    def get_vector_key(self, answer, llm_emb):
+
+        return ("vector", CachedEmbeddings.get_model_id(llm_emb), hashlib.sha1(answer.encode("utf-8")).hexdigest())
+
+    def get_answer(self, template_type, query, llm_text):
+
+        return self.cache.get(self.get_answer_key(template_type, query, llm_text))
+
+    def set_answer(self, template_type, query, llm_text, answer):
+
+        self.cache.set(self.get_answer_key(template_type, query, llm_text), answer)
+
+    def get_vector(self, answer, llm_emb):
+
+        return self.cache.get(self.get_vector_key(answer, llm_emb))
+
+    def set_vector(self, answer, llm_emb, vector):
+
+        self.cache.set(self.get_vector_key(answer, llm_emb), vector)
+
+    def clear(self):
+
+        self.cache.clear()
+
+    def stats(self):
+
+        return self.cache.stats()
@@ -0,0 +1,109 @@
+############################################################
+############################################################
+# OpenSearch 검색 결과 (hits) 디코딩 관련 함수들
+############################################################
+############################################################
+
+import numpy as np
+from typing import List
+
+from langchain.schema import Document
+
+###########################################
+### Columnar search hits
+###########################################
+
+# OpenSearch 응답을 hit 마다 Document 로 만들지 않고 열(column) 단위로 보관.
+# * ids: _id 리스트, scores: float32 배열 (max_score 로 정규화)
+# * sources: 응답의 _source 를 복사 없이 참조 (two_phase 검색처럼 _source 가 없으면 None)
+# text / metadata / Document 는 row 단위로 필요할 때만 만들고 (응답은 수정하지 않음),
+# 리스트처럼 [(Document, score), ...] 로 iterate / index / slice 할 수 있음.
+# fusion_utils 는 ids / scores 만 사용하고 최종 top-k 의 Document 만 만듦.
+###########################################
+
+class SearchHits():
+
+    # two_phase 검색에서 아직 text / metadata 를 가져오지 않은 Document 의 metadata 표시
+    unhydrated_key = "_unhydrated"
+
+    def __init__(self, ids, scores, sources):
+
+        self.ids = ids
+        self.scores = scores
+        self.sources = sources
+        self._docs = [None] * len(ids)
+
+    @classmethod
+    def from_response(cls, search_results, normalize=True):
+        '''
+        search / msearch 응답 하나를 SearchHits 로 변환 (normalize=True 이면 score / max_score)
+        '''
+        hits = search_results["hits"]["hits"]
+        ids = [hit["_id"] for hit in hits]
+        scores = np.fromiter((hit["_score"] for hit in hits), dtype=np.float32, count=len(hits))
+        sources = [hit.get("_source", None) for hit in hits]
+
+        if normalize and len(scores):
+            # 응답의 max_score 는 rescore (binary_search) 이전 점수일 수 있으므로 hit 의 최대값 사용
+            max_score = float(scores.max())
+            if max_score:
+                scores /= np.float32(max_score)
+
+        return cls(ids, scores, sources)
+
+    def __len__(self):
+
+        return len(self.ids)
+
+    def __iter__(self):
+
+        for row in range(len(self.ids)):
+            yield self[row]
+
+    def __getitem__(self, row):
+
+        if isinstance(row, slice):
+            rows = range(len(self.ids))[row]
+            return self.take(rows)
+
+        return (self.get_document(row), float(self.scores[row]))
+
+    def take(self, rows):
+        '''
+        rows 순서의 SearchHits (materialize 된 Document 는 공유)
+        '''
+        hits = SearchHits([self.ids[row] for row in rows], self.scores[list(rows)], [self.sources[row] for row in rows])
+        hits._docs = [self._docs[row] for row in rows]
+
+        return hits
+
+    def get_text(self, row):
+
+        source = self.sources[row]
+
+        return "" if source is None else source["text"]
+
+    def get_metadata(self, row):
+
+        source = self.sources[row]
+        if source is None:
+            return {"id": self.ids[row], self.unhydrated_key: True}
+
+        return {**source["metadata"], "id": self.ids[row]}
+
+    def get_document(self, row):
+
+        doc = self._docs[row]
+        if doc is None:
+            doc = self._docs[row] = Document(page_content=self.get_text(row), metadata=self.get_metadata(row))
+
+        return doc
+
+    def to_documents(self, with_score=False) -> List[Document]:
+        '''
+        API 경계에서 Document (with_score=True 이면 (Document, score)) 리스트로 변환
+        '''
+        if with_score:
+            return list(self)
+
+        return [self.get_document(row) for row in range(len(self.ids))]
@@ -0,0 +1,179 @@
+############################################################
+############################################################
+# OpenSearch client 직렬화(JSON) 관련 함수들
+############################################################
+############################################################
+
+import json
+import time
+
+import numpy as np
+from opensearchpy.serializer import JSONSerializer
+from opensearchpy.exceptions import SerializationError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+###########################################
+### orjson serializer
+###########################################
+
+# opensearch-py 기본 JSONSerializer (json 모듈) 대신 orjson 으로 요청 body 를 encode / 응답을 decode.
+# * np.ndarray (float32 벡터 등) 와 NumPy scalar 를 리스트로 바꾸지 않고 바로 encode (OPT_SERIALIZE_NUMPY)
+# * orjson 이 처리하지 못하는 타입 (Decimal, pandas 등) 은 JSONSerializer.default 로 처리
+# * 응답 decode: ASCII 응답 (two_phase 검색의 _id / _score, 벡터 mget 등) 은 orjson,
+#   한글 _source 가 긴 응답은 json 모듈이 더 빠르므로 json 사용 (serializer_utils.benchmark 참고)
+# * mimetype 이 application/json 이므로 client 에 넘기면 응답 decode 에도 사용됨
+#
+# 사용법:
+#   os_client = opensearch_utils.create_local_opensearch_client(host, http_auth) # orjson 이 있으면 기본값
+#   os_client = opensearch_utils.create_local_opensearch_client(host, http_auth, serializer=JSONSerializer())
+###########################################
+
+class OrjsonSerializer(JSONSerializer):
+
+    options = 0 if orjson is None else orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def __init__(self):
+
+        assert orjson is not None, "orjson is required for OrjsonSerializer"
+
+    def default(self, data):
+
+        if isinstance(data, np.ndarray): # non-contiguous 또는 orjson 이 지원하지 않는 dtype
+            return data.tolist()
+
+        return super().default(data)
+
+    def dumps(self, data):
+
+        if isinstance(data, (str, bytes)):
+            return data
+
+        try:
+            # msearch / bulk 는 줄 단위 dumps 결과를 "\n" 으로 join 하므로 str 로 반환
+            return orjson.dumps(data, default=self.default, option=self.options).decode("utf-8")
+        except (TypeError, ValueError) as e:
+            raise SerializationError(data, e)
+
+    def loads(self, s):
+
+        try:
+            if isinstance(s, str) and not s.isascii():
+                return json.loads(s)
+            return orjson.loads(s)
+        except (TypeError, ValueError) as e:
+            raise SerializationError(s, e)
+
+class serializer_utils():
+
+    @classmethod
+    def get_serializer(cls, serializer=None):
+        '''
+        serializer 가 주어지면 그대로, 아니면 OrjsonSerializer (orjson 이 없으면 None: opensearch-py 기본값)
+        '''
+        if serializer is not None:
+            return serializer
+
+        return OrjsonSerializer() if orjson is not None else None
+
+    @classmethod
+    def get_client_kwargs(cls, serializer=None):
+        '''
+        OpenSearch / AsyncOpenSearch 생성자에 넘길 serializer 인자
+        '''
+        serializer = cls.get_serializer(serializer)
+
+        return {} if serializer is None else {"serializer": serializer}
+
+    ###########################################
+    ### Benchmark
+    ###########################################
+
+    @classmethod
+    def get_benchmark_request(cls, dimension=768, k=10, n_queries=4):
+        '''
+        msearch (semantic 쿼리 n_queries 개 + lexical 쿼리) 요청 body. 벡터는 np.float32
+        '''
+        rng = np.random.default_rng(0)
+        body = []
+        for _ in range(n_queries):
+            body.append({"index": "benchmark"})
+            body.append({
+                "size": k,
+                "query": {"knn": {"vector_field": {"vector": rng.standard_normal(dimension).astype(np.float32), "k": k}}}
+            })
+        body.append({"index": "benchmark"})
+        body.append({"size": k, "query": {"match": {"text": {"query": "반도체 수출 실적", "minimum_should_match": "0%"}}}})
+
+        return body
+
+    @classmethod
+    def get_benchmark_response(cls, n_hits=50, text_length=1000, source=True):
+        '''
+        hit n_hits 개의 search 응답 JSON 문자열 (source=False 이면 two_phase 처럼 _id / _score 만)
+        '''
+        hits = [
+            {
+                "_index": "benchmark",
+                "_id": f"doc-{idx}",
+                "_score": 1.0 / (idx+1),
+            } for idx in range(n_hits)
+        ]
+        if source:
+            for idx, hit in enumerate(hits):
+                hit["_source"] = {
+                    "text": "가" * text_length,
+                    "metadata": {"source": f"file-{idx}.pdf", "page": idx, "parent_id": f"parent-{idx//4}", "family_tree": "child"}
+                }
+
+        return json.dumps({"took": 3, "timed_out": False, "hits": {"total": {"value": n_hits}, "max_score": 1.0, "hits": hits}}, ensure_ascii=False)
+
+    @classmethod
+    def _time_per_call(cls, func, repeat):
+
+        func()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+
+        return (time.perf_counter() - start) / repeat * 1000
+
+    @classmethod
+    def benchmark(cls, dimension=768, k=10, n_queries=4, n_hits=50, repeat=200, verbose=True):
+        '''
+        쿼리 한 번 (msearch 요청 encode + 응답 decode) 의 직렬화 비용 (ms) 비교.
+        json: 기존 방식 (벡터를 리스트로 바꾼 뒤 JSONSerializer), orjson: OrjsonSerializer (np.float32 그대로)
+        decode 는 _source (한글 text) 가 있는 응답과 two_phase 응답 (_id / _score) 각각 측정
+        '''
+        body = cls.get_benchmark_request(dimension=dimension, k=k, n_queries=n_queries)
+        response = cls.get_benchmark_response(n_hits=n_hits)
+        id_response = cls.get_benchmark_response(n_hits=n_hits, source=False)
+
+        def to_lists(line):
+            if "query" in line and "knn" in line["query"]:
+                knn = line["query"]["knn"]["vector_field"]
+                return {**line, "query": {"knn": {"vector_field": {**knn, "vector": knn["vector"].tolist()}}}}
+            return line
+
+        serializers = {"json": (JSONSerializer(), to_lists)}
+        if orjson is not None:
+            serializers["orjson"] = (OrjsonSerializer(), lambda line: line)
+
+        results = {}
+        for name, (serializer, prepare) in serializers.items():
+            encode_ms = cls._time_per_call(lambda: "\n".join(serializer.dumps(prepare(line)) for line in body), repeat)
+            decode_ms = cls._time_per_call(lambda: serializer.loads(response), repeat)
+            id_decode_ms = cls._time_per_call(lambda: serializer.loads(id_response), repeat)
+            results[name] = {"encode_ms": encode_ms, "decode_ms": decode_ms, "id_decode_ms": id_decode_ms, "total_ms": encode_ms + decode_ms}
+
+        if verbose:
+            print(f"===== Serializer benchmark (dimension: {dimension}, queries: {n_queries}, hits: {n_hits}) =====")
+            for name, result in results.items():
+                print(f'{name:>7}: encode {result["encode_ms"]:.3f} ms, decode {result["decode_ms"]:.3f} ms (two_phase {result["id_decode_ms"]:.3f} ms), total {result["total_ms"]:.3f} ms / query')
+            if "orjson" in results:
+                print(f'speedup: {results["json"]["total_ms"] / results["orjson"]["total_ms"]:.1f}x')
+
+        return results
@@ -0,0 +1,18 @@
+############################################################
+# pytest 설정: lib/ 를 local_utils 패키지로 import
+############################################################
+
+import os
+import sys
+import types
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib")
+
+if "local_utils" not in sys.modules:
+    try:
+        import local_utils
+    except ImportError:
+        local_utils = types.ModuleType("local_utils")
+        local_utils.__path__ = [LIB_DIR]
+        local_utils.print_ww = print
+        sys.modules["local_utils"] = local_utils
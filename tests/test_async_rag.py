@@ -0,0 +1,353 @@
+############################################################
+# async_retriever_utils 테스트 (AsyncOpenSearch + 녹화된 응답)
+############################################################
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("langchain")
+opensearchpy = pytest.importorskip("opensearchpy")
+
+from local_utils.async_rag import async_retriever_utils, HybridSearchResults
+from local_utils.local_lexical_store import LocalLexicalStore, NgramTokenizer
+from local_utils.local_vector_store import LocalVectorStore
+from local_utils.opensearch import opensearch_utils
+from local_utils.reranker import MicroBatchReranker
+from local_utils.retrieval_cache import HyDECache
+
+###########################################
+### Stand-in cluster
+###########################################
+
+def get_search_response(ids, source=True):
+
+    hits = [
+        {
+            "_index": "test-index",
+            "_id": doc_id,
+            "_score": 2.0 - 0.25*rank,
+            **({"_source": {"text": f"text of {doc_id}", "metadata": {"source": doc_id}}} if source else {}),
+        }
+        for rank, doc_id in enumerate(ids)
+    ]
+
+    return {
+        "took": 3,
+        "timed_out": False,
+        "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+        "hits": {"total": {"value": len(hits), "relation": "eq"}, "max_score": hits[0]["_score"] if hits else None, "hits": hits},
+    }
+
+class RecordedTransport():
+    '''
+    AsyncOpenSearch.transport.perform_request 대신 (method, url) 별 녹화된 응답 반환
+    '''
+    def __init__(self, responses):
+
+        self.responses = responses
+        self.requests = []
+
+    async def perform_request(self, method, url, headers=None, params=None, body=None):
+
+        self.requests.append((method, url, params, body))
+        response = self.responses[(method, url)]
+        if isinstance(response, Exception):
+            raise response
+
+        return response(body) if callable(response) else response
+
+def get_async_client(responses):
+
+    os_client = opensearch_utils.create_async_local_opensearch_client("localhost", None, shared=False)
+    transport = RecordedTransport(responses)
+    os_client.transport.perform_request = transport.perform_request
+
+    return os_client, transport
+
+class FakeEmbeddings():
+
+    async def aembed_query(self, text):
+
+        return [0.1, 0.2, 0.3, 0.4]
+
+    def embed_documents(self, texts, **kwargs):
+
+        return [[0.1, 0.2, 0.3, 0.4] for _ in texts]
+
+###########################################
+### AsyncOpenSearch
+###########################################
+
+def test_async_client_is_detected():
+
+    os_client, _ = get_async_client({})
+
+    assert isinstance(os_client, opensearchpy.AsyncOpenSearch)
+    assert async_retriever_utils._is_async_client(os_client)
+    assert async_retriever_utils._is_coroutine_function(os_client.search)
+
+def test_lexical_search_with_async_client():
+
+    os_client, transport = get_async_client({("POST", "/test-index/_search"): get_search_response(["a", "b", "c"])})
+
+    similar_docs = asyncio.run(async_retriever_utils.get_lexical_similar_docs(
+        query="보안 정책",
+        k=3,
+        os_client=os_client,
+        index_name="test-index",
+        filter=[],
+    ))
+
+    assert [doc.metadata["source"] for doc in similar_docs] == ["a", "b", "c"]
+    assert len(transport.requests) == 1
+
+def test_search_hybrid_two_phase_with_async_client():
+
+    msearch_response = {"took": 5, "responses": [get_search_response(["a", "b"], source=False), get_search_response(["b", "c"], source=False)]}
+    mget_response = lambda body: {"docs": [
+        {"_index": "test-index", "_id": doc_id, "found": True, "_source": {"text": f"text of {doc_id}", "metadata": {"source": doc_id}}}
+        for doc_id in body["ids"]
+    ]}
+    os_client, transport = get_async_client({
+        ("POST", "/test-index/_msearch"): msearch_response,
+        ("POST", "/test-index/_mget"): mget_response,
+    })
+
+    similar_docs = async_retriever_utils.run_sync(async_retriever_utils.search_hybrid(
+        query="보안 정책",
+        k=3,
+        llm_emb=FakeEmbeddings(),
+        os_client=os_client,
+        index_name="test-index",
+        two_phase=True,
+    ))
+
+    assert sorted(doc.metadata["source"] for doc in similar_docs) == ["a", "b", "c"]
+    assert all(doc.page_content == f'text of {doc.metadata["source"]}' for doc in similar_docs)
+    assert [request[:2] for request in transport.requests] == [("POST", "/test-index/_msearch"), ("POST", "/test-index/_mget")]
+
+###########################################
+### Latency budget
+###########################################
+
+class SlowReranker():
+
+    async def arerank(self, pairs, block=False):
+
+        await asyncio.sleep(1.0)
+
+        return [{"score": 1.0} for _ in pairs]
+
+class FakeTokenizer():
+
+    def get_num_tokens(self, text):
+
+        return len(text)
+
+def get_local_search_options(**kwargs):
+
+    ids, texts = [f"d{i}" for i in range(10)], [f"보안 정책 문서 {i}" for i in range(10)]
+    vector_store = LocalVectorStore(4, index_type="flat")
+    vector_store.add(ids, texts, [{} for _ in ids], [[0.1*i, 0.2, 0.3, 0.4] for i in range(10)])
+    lexical_store = LocalLexicalStore(tokenizer=NgramTokenizer())
+    lexical_store.add(ids, texts, [{} for _ in ids])
+
+    return dict(
+        query="보안 정책",
+        k=3,
+        llm_emb=FakeEmbeddings(),
+        llm_text=FakeTokenizer(),
+        vector_store=vector_store,
+        lexical_store=lexical_store,
+        reranker=True,
+        **kwargs
+    )
+
+def test_search_hybrid_reports_degradations_for_float_budget():
+
+    options = get_local_search_options(reranker_service=SlowReranker())
+    similar_docs = async_retriever_utils.run_sync(async_retriever_utils.search_hybrid(**options, latency_budget=0.2))
+
+    assert isinstance(similar_docs, HybridSearchResults)
+    assert len(similar_docs) == 3
+    assert similar_docs.degraded and similar_docs.degradations[0] in ["skip_reranker", "reranker_timeout"]
+    assert similar_docs.budget_info["total"] == 0.2
+
+    similar_docs = async_retriever_utils.run_sync(async_retriever_utils.search_hybrid(**{**options, "reranker": False}))
+
+    assert similar_docs.degradations == [] and similar_docs.budget_info is None
+
+###########################################
+### Two-phase hydration
+###########################################
+
+def test_two_phase_hydrates_from_local_store():
+
+    ids = ["a", "b", "c"]
+    vector_store = LocalVectorStore(4, index_type="flat")
+    vector_store.add(ids, [f"text of {doc_id}" for doc_id in ids], [{"source": doc_id} for doc_id in ids], [[0.1, 0.2, 0.3, 0.4 + i] for i in range(3)])
+    os_client, transport = get_async_client({("POST", "/test-index/_search"): get_search_response(["c", "a"], source=False)})
+
+    similar_docs = async_retriever_utils.run_sync(async_retriever_utils.search_hybrid(
+        query="보안 정책",
+        k=3,
+        llm_emb=FakeEmbeddings(),
+        os_client=os_client,
+        index_name="test-index",
+        vector_store=vector_store,
+        two_phase=True,
+    ))
+
+    assert sorted(doc.metadata["source"] for doc in similar_docs) == ["a", "b", "c"]
+    assert all(doc.page_content == f'text of {doc.metadata["source"]}' for doc in similar_docs)
+    assert [request[:2] for request in transport.requests] == [("POST", "/test-index/_search")] # mget 없음
+
+###########################################
+### Server-side hybrid
+###########################################
+
+HYDE_TEMPLATES = ["web_search", "sci_fact", "fiqa", "trec_news"]
+
+def get_hyde_cache(llm_text, query, template_types):
+
+    hyde_cache = HyDECache()
+    for template_type in template_types:
+        hyde_cache.set_answer(template_type, query, llm_text, f"{template_type} answer about {query}")
+
+    return hyde_cache
+
+def test_server_side_hybrid_counts_original_query_for_hyde():
+
+    options = dict(server_side_hybrid=True, hyde=True)
+
+    # semantic: 원래 query + HyDE 답변, + lexical 1개 <= hybrid_max_queries (5)
+    assert async_retriever_utils._use_server_side_hybrid(**options, hyde_query=HYDE_TEMPLATES[:3])
+    assert not async_retriever_utils._use_server_side_hybrid(**options, hyde_query=HYDE_TEMPLATES)
+    assert async_retriever_utils._use_server_side_hybrid(server_side_hybrid=True, rag_fusion=True, query_augmentation_size=3)
+    assert not async_retriever_utils._use_server_side_hybrid(server_side_hybrid=True, rag_fusion=True, query_augmentation_size=4)
+
+def test_server_side_hybrid_search_pipeline():
+
+    pipeline_name, _ = opensearch_utils.get_hybrid_pipeline(weights=[.51, .49])
+    os_client, transport = get_async_client({
+        ("GET", f"/_search/pipeline/{pipeline_name}"): opensearchpy.exceptions.NotFoundError(404, "resource_not_found_exception", {}),
+        ("PUT", f"/_search/pipeline/{pipeline_name}"): {"acknowledged": True},
+        ("POST", "/test-index/_search"): get_search_response(["a", "b", "c"]),
+    })
+
+    similar_docs = async_retriever_utils.run_sync(async_retriever_utils.search_hybrid(
+        query="보안 정책",
+        k=3,
+        llm_emb=FakeEmbeddings(),
+        os_client=os_client,
+        index_name="test-index",
+        server_side_hybrid=True,
+    ))
+
+    assert [doc.metadata["source"] for doc in similar_docs] == ["a", "b", "c"]
+    assert [request[:2] for request in transport.requests] == [
+        ("GET", f"/_search/pipeline/{pipeline_name}"),
+        ("PUT", f"/_search/pipeline/{pipeline_name}"),
+        ("POST", "/test-index/_search"),
+    ]
+    _, _, params, body = transport.requests[-1]
+    assert params["search_pipeline"] in [pipeline_name, pipeline_name.encode("utf-8")] # opensearch-py 가 query string 값을 bytes 로 바꿈
+    assert len(body["query"]["hybrid"]["queries"]) == 2
+
+def test_server_side_hybrid_falls_back_when_hyde_exceeds_max_queries():
+
+    query, llm_text = "보안 정책", FakeTokenizer()
+    msearch_response = {"took": 5, "responses": [get_search_response(["a", "b", "c"]) for _ in range(len(HYDE_TEMPLATES) + 2)]}
+    os_client, transport = get_async_client({("POST", "/test-index/_msearch"): msearch_response})
+
+    similar_docs = async_retriever_utils.run_sync(async_retriever_utils.search_hybrid(
+        query=query,
+        k=3,
+        llm_emb=FakeEmbeddings(),
+        llm_text=llm_text,
+        os_client=os_client,
+        index_name="test-index",
+        server_side_hybrid=True,
+        hyde=True,
+        hyde_query=HYDE_TEMPLATES,
+        hyde_cache=get_hyde_cache(llm_text, query, HYDE_TEMPLATES),
+    ))
+
+    assert sorted(doc.metadata["source"] for doc in similar_docs) == ["a", "b", "c"]
+    assert [request[:2] for request in transport.requests] == [("POST", "/test-index/_msearch")] # client-side fusion
+
+def test_search_hybrid_with_saturated_reranker_service():
+
+    release = threading.Event()
+    def backend(pairs):
+        release.wait(timeout=10)
+        return [{"score": float(len(pair["text_pair"]))} for pair in pairs]
+
+    reranker_service = MicroBatchReranker(backend, max_batch_size=1, max_wait_ms=1, max_queue_size=1)
+    try:
+        # worker 가 첫 요청을 처리하는 동안 두 번째 요청이 queue 를 채움
+        reranker_service.submit([{"text": "q", "text_pair": "busy"}])
+        while reranker_service._queue.qsize() > 0:
+            time.sleep(0.001)
+        reranker_service.submit([{"text": "q", "text_pair": "busy"}])
+        options = get_local_search_options(reranker_service=reranker_service)
+
+        # latency budget: queue 를 기다리지 않고 reranker 를 건너뜀
+        similar_docs = async_retriever_utils.run_sync(async_retriever_utils.search_hybrid(**options, latency_budget=5.0))
+
+        assert len(similar_docs) == 3
+        assert similar_docs.degradations == ["reranker_rejected"]
+        assert reranker_service.stats()["rejected"] >= 1
+
+        # budget 없음: event loop 를 막지 않고 queue 에 자리가 날 때까지 기다림
+        future = asyncio.run_coroutine_threadsafe(async_retriever_utils.search_hybrid(**options), async_retriever_utils._get_loop())
+        assert async_retriever_utils.run_sync(asyncio.sleep(0, result="loop alive"), timeout=1) == "loop alive"
+        release.set()
+        similar_docs = future.result(timeout=10)
+
+        assert len(similar_docs) == 3 and similar_docs.degradations == []
+    finally:
+        release.set()
+        reranker_service.close()
+
+###########################################
+### Cascade
+###########################################
+
+class CountingEmbeddings(FakeEmbeddings):
+
+    def __init__(self):
+
+        self.calls = {"aembed_query": 0, "embed_documents": 0}
+
+    async def aembed_query(self, text):
+
+        self.calls["aembed_query"] += 1
+
+        return await super().aembed_query(text)
+
+    def embed_documents(self, texts, **kwargs):
+
+        self.calls["embed_documents"] += 1
+
+        return super().embed_documents(texts, **kwargs)
+
+class LengthReranker():
+
+    async def arerank(self, pairs, block=False):
+
+        return [{"score": float(len(pair["text_pair"]))} for pair in pairs]
+
+def test_cascade_reuses_query_vector_from_search():
+
+    llm_emb = CountingEmbeddings()
+    options = get_local_search_options(reranker_service=LengthReranker(), cascade=True, cascade_max_m=4)
+    similar_docs = async_retriever_utils.run_sync(async_retriever_utils.search_hybrid(**{**options, "llm_emb": llm_emb}))
+
+    assert len(similar_docs) == 3
+    # 검색 단계의 batch 임베딩 한 번만 (cascade 에서 query 를 다시 임베딩하지 않음)
+    assert llm_emb.calls == {"aembed_query": 0, "embed_documents": 1}
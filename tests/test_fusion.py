@@ -0,0 +1,42 @@
+############################################################
+# IncrementalFusion 테스트 (fusion_utils 와 같은 결과)
+############################################################
+
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain")
+
+from langchain.schema import Document
+
+from local_utils.fusion import fusion_utils, IncrementalFusion
+
+def get_random_doc_lists(rng, n_lists, n_docs=40, size=15):
+
+    doc_lists = []
+    for _ in range(n_lists):
+        doc_ids = rng.choice(n_docs, size, replace=False)
+        scores = np.sort(rng.random(size))[::-1]
+        doc_lists.append([(Document(page_content=f"text {doc_id}", metadata={"id": f"d{doc_id}"}), float(score)) for doc_id, score in zip(doc_ids, scores)])
+
+    return doc_lists
+
+@pytest.mark.parametrize("algorithm", fusion_utils.algorithms)
+def test_incremental_fusion_matches_batch_in_any_arrival_order(algorithm):
+
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        n_lists = int(rng.integers(2, 8))
+        doc_lists = get_random_doc_lists(rng, n_lists)
+        weight = float(rng.random())
+        expected = fusion_utils.get_ensemble_results(doc_lists, [weight]*n_lists, algorithm=algorithm, c=60, k=20)
+
+        fusion = IncrementalFusion(algorithm=algorithm, c=60)
+        fusion.add(get_random_doc_lists(rng, 1)[0], list_id=n_lists) # 나중에 제거되는 리스트
+        for list_id in rng.permutation(n_lists):
+            fusion.add(doc_lists[list_id], list_id=int(list_id))
+        fusion.remove(n_lists)
+        results = fusion.get_ensemble_results(k=20, weight=weight)
+
+        # score 까지 bit 단위로 같아야 함 (합산 순서가 도착 순서에 따라 바뀌지 않음)
+        assert [(doc.metadata["id"], score) for doc, score in results] == [(doc.metadata["id"], score) for doc, score in expected]
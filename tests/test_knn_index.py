@@ -0,0 +1,121 @@
+############################################################
+# KNNIndexProfile / KNNIndexTuner 테스트 (in-memory stand-in cluster)
+############################################################
+
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain")
+pytest.importorskip("opensearchpy")
+
+from local_utils.knn_index import KNNIndexProfile, KNNIndexTuner
+
+###########################################
+### Stand-in cluster
+###########################################
+
+class FakeIndices():
+
+    def __init__(self, client):
+
+        self.client = client
+
+    def exists(self, index_name):
+
+        return index_name in self.client.indices_
+
+    def create(self, index_name, body):
+
+        self.client.indices_[index_name] = body
+        return {"acknowledged": True}
+
+    def delete(self, index):
+
+        self.client.indices_.pop(index)
+        return {"acknowledged": True}
+
+    def forcemerge(self, **kwargs):
+
+        return {}
+
+    def refresh(self, **kwargs):
+
+        return {}
+
+    def put_settings(self, index, body):
+
+        self.client.indices_[index]["settings"]["index"].update(body["index"])
+
+class FakeClient():
+    '''
+    exact search 만 하는 cluster: k-NN 검색도 exact 이므로 recall 은 항상 1
+    '''
+    def __init__(self, vectors):
+
+        self.vectors = vectors
+        self.indices_ = {}
+        self.indices = FakeIndices(self)
+        self.knn_queries = []
+
+    def count(self, index):
+
+        return {"count": len(self.vectors)}
+
+    def reindex(self, body, **kwargs):
+
+        return {}
+
+    def search(self, body, index, **kwargs):
+
+        query = body["query"]
+        if "script_score" in query:
+            vector = query["script_score"]["script"]["params"]["query_value"]
+        else:
+            knn = query["knn"]["vector_field"]
+            self.knn_queries.append(knn)
+            vector = knn["vector"]
+        order = np.argsort(((self.vectors - np.asarray(vector)) ** 2).sum(axis=1))[:body["size"]]
+
+        return {"took": 1, "hits": {"hits": [{"_id": f"d{row}"} for row in order]}}
+
+###########################################
+### Tuner
+###########################################
+
+def test_tuner_clamps_ef_search_to_k():
+
+    vectors = np.random.default_rng(0).standard_normal((100, 8)).astype(np.float32)
+    os_client = FakeClient(vectors)
+    tuner = KNNIndexTuner(os_client, "source-index", KNNIndexProfile(8), m_grid=[8], ef_construction_grid=[128], ef_search_grid=[4, 8])
+
+    best_profile, results = tuner.tune(query_vectors=vectors[:5], k=10, verbose=False)
+
+    assert [result["ef_search"] for result in results] == [10]
+    assert best_profile.ef_search == 10
+    assert all(knn["method_parameters"]["ef_search"] == 10 for knn in os_client.knn_queries)
+    assert os_client.indices_ == {} # 임시 index 삭제
+
+def test_select_without_results_raises():
+
+    with pytest.raises(ValueError):
+        KNNIndexTuner.select([])
+
+###########################################
+### Binary profile
+###########################################
+
+def test_binary_profile_maps_float_vectors_without_graph():
+
+    profile = KNNIndexProfile(768, space_type="cosinesimil", binary_vector_field="binary_vector_field")
+    properties = profile.get_index_body()["mappings"]["properties"]
+
+    assert properties["vector_field"] == {"type": "knn_vector", "dimension": 768, "index": False}
+    assert properties["binary_vector_field"]["data_type"] == "binary"
+    assert properties["binary_vector_field"]["method"]["space_type"] == "hammingbit"
+    assert "method" in KNNIndexProfile(768).get_vector_mapping()
+
+def test_index_body_does_not_index_rerank_segments():
+
+    metadata_mapping = KNNIndexProfile(768).get_index_body()["mappings"]["properties"]["metadata"]
+
+    assert metadata_mapping["properties"]["rerank_segments"] == {"type": "object", "enabled": False}
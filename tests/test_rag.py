@@ -0,0 +1,45 @@
+############################################################
+# retriever_utils 테스트 (rerank 입력)
+############################################################
+
+import pytest
+
+pytest.importorskip("langchain")
+pytest.importorskip("opensearchpy")
+
+from langchain.schema import Document
+
+from local_utils.rag import retriever_utils
+
+class FakeTokenizer():
+
+    def get_num_tokens(self, text):
+
+        return len(text)
+
+class FakeSplitter():
+    '''
+    100 글자 segment, 20 글자 overlap (RecursiveCharacterTextSplitter 처럼 앞뒤 공백 제거)
+    '''
+    def split_text(self, text):
+
+        return [text[start:start+100].strip() for start in range(0, len(text), 80)]
+
+def test_rerank_segments_store_positions_instead_of_text(monkeypatch):
+
+    monkeypatch.setattr(retriever_utils, "text_splitter", FakeSplitter())
+    text = " ".join(f"문장 {i} 보안 정책 설명" for i in range(300))
+
+    rerank_metadata = retriever_utils.get_rerank_metadata(FakeTokenizer(), text)
+    segments = rerank_metadata["rerank_segments"]
+
+    assert all("text" not in segment for segment in segments)
+    assert [retriever_utils._get_segment_text(text, segment) for segment in segments] == FakeSplitter().split_text(text)
+
+    rerank_queries, _ = retriever_utils._get_rerank_inputs(
+        context=[(Document(page_content=text, metadata=rerank_metadata), 1.0)],
+        query="보안 정책",
+        llm_text=FakeTokenizer(),
+    )
+
+    assert [pair["text_pair"] for pair in rerank_queries["inputs"]] == FakeSplitter().split_text(text)
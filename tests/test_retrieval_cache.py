@@ -0,0 +1,95 @@
+############################################################
+# RetrievalResultCache 테스트 (key / local store invalidation)
+############################################################
+
+import gc
+import weakref
+
+import pytest
+
+pytest.importorskip("langchain")
+pytest.importorskip("opensearchpy")
+
+from langchain.schema import Document
+
+from local_utils.local_lexical_store import LocalLexicalStore, NgramTokenizer
+from local_utils.local_vector_store import LocalVectorStore
+from local_utils.opensearch import opensearch_utils
+from local_utils.retrieval_cache import RetrievalResultCache
+
+@pytest.fixture
+def result_cache():
+
+    cache = RetrievalResultCache()
+    yield cache
+    cache.close()
+
+def test_key_includes_result_affecting_options(result_cache):
+
+    key = result_cache.get_key(query="보안 정책", index_name="test-index")
+
+    assert key != result_cache.get_key(query="보안 정책", index_name="test-index", space_type="l2")
+    assert key != result_cache.get_key(query="보안 정책", index_name="test-index", reranker_endpoint_name="reranker-a")
+    assert key == result_cache.get_key(query="  보안   정책 ", index_name="test-index")
+
+def test_key_includes_reranker_service_backend(result_cache):
+
+    class RerankerService():
+        def __init__(self, endpoint_name):
+            self.backend = type("Backend", (), {"endpoint_name": endpoint_name})()
+
+    options = dict(query="보안 정책", index_name="test-index", reranker=True)
+
+    assert result_cache.get_key(**options, reranker_service=RerankerService("reranker-a")) != result_cache.get_key(**options, reranker_service=RerankerService("reranker-b"))
+    assert result_cache.get_key(**options, reranker_service=RerankerService("reranker-a")) == result_cache.get_key(**options, reranker_service=RerankerService("reranker-a"))
+
+def test_key_includes_cascade_options(result_cache):
+
+    options = dict(query="보안 정책", index_name="test-index", reranker=True, cascade=True)
+    key = result_cache.get_key(**options)
+
+    assert key != result_cache.get_key(**options, cascade_depth=40)
+    assert key != result_cache.get_key(**options, cascade_max_m=12)
+    assert key != result_cache.get_key(**options, cascade_gap_ratio=0.3)
+
+def test_local_stores_do_not_share_keys(result_cache):
+
+    store_a, store_b = LocalVectorStore(4, index_type="flat"), LocalVectorStore(4, index_type="flat")
+
+    assert result_cache.get_key(query="q", vector_store=store_a) != result_cache.get_key(query="q", vector_store=store_b)
+
+def test_local_store_add_invalidates(result_cache):
+
+    vector_store = LocalVectorStore(4, index_type="flat", name="vectors")
+    lexical_store = LocalLexicalStore(tokenizer=NgramTokenizer(), name="lexical")
+    other_store = LocalVectorStore(4, index_type="flat", name="other")
+    docs = [Document(page_content="text", metadata={})]
+
+    result_cache.set(docs, query="q", vector_store=vector_store, lexical_store=lexical_store)
+    result_cache.set(docs, query="q", vector_store=other_store)
+
+    lexical_store.add(["a"], ["보안 정책 문서"], [{}])
+
+    assert result_cache.get(query="q", vector_store=vector_store, lexical_store=lexical_store) is None
+    assert result_cache.get(query="q", vector_store=other_store) == docs
+
+    vector_store.add(["a"], ["보안 정책 문서"], [{}], [[0.1, 0.2, 0.3, 0.4]])
+    result_cache.set(docs, query="q", vector_store=vector_store)
+    other_store.add(["a"], ["보안 정책 문서"], [{}], [[0.1, 0.2, 0.3, 0.4]])
+
+    assert result_cache.get(query="q", vector_store=vector_store) == docs
+    assert result_cache.get(query="q", vector_store=other_store) is None
+
+def test_unclosed_cache_is_garbage_collected():
+
+    n_hooks = len(opensearch_utils.index_write_hooks)
+    result_cache = RetrievalResultCache()
+    result_cache.set([], query="q", index_name="test-index")
+    cache_ref = weakref.ref(result_cache)
+
+    del result_cache
+    gc.collect()
+    opensearch_utils.notify_index_write("test-index")
+
+    assert cache_ref() is None
+    assert len(opensearch_utils.index_write_hooks) == n_hooks